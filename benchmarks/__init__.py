@@ -0,0 +1,7 @@
+"""
+Performance benchmarks for wireworks.
+
+Run them with ``python -m benchmarks``; see ``python -m benchmarks --help`` for the options.
+"""
+
+__author__ = 'rob'
@@ -0,0 +1,90 @@
+"""
+Run the wireworks benchmarks.
+
+    python -m benchmarks                                  # the quick suite, printed as a table
+    python -m benchmarks --suite full -o results.json     # everything, up to 1M keys, saved as JSON
+    python -m benchmarks -k glob --compare baseline.json  # compare against a saved run
+"""
+
+from __future__ import print_function
+
+__author__ = 'rob'
+
+import argparse
+import sys
+
+from benchmarks import harness
+
+# importing each module registers its benchmarks
+from benchmarks import bench_bus, bench_dispatch, bench_gc, bench_glob, bench_import  # noqa
+from benchmarks import bench_journal, bench_payload, bench_registry, bench_timing_wheel  # noqa
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', choices=harness.SUITES, default='quick', help="Parameter grid to run")
+    parser.add_argument('-k', '--filter', help="Only run benchmarks whose name contains this")
+    parser.add_argument('-o', '--output', help="Write results as JSON to this path")
+    parser.add_argument('--compare', help="Compare against results previously saved with --output")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Fractional slowdown against the baseline that counts as a regression (default 0.1)")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed repeats per case (default 5)")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Minimum seconds per repeat (default 0.2)")
+    parser.add_argument('--list', action='store_true', help="List the cases that would run, and stop")
+    args = parser.parse_args(argv)
+
+    cases = harness.get_benchmarks(args.suite, args.filter)
+    if args.list:
+        for (name, _, params) in cases:
+            print(harness.case_id(name, params))
+        return 0
+
+    environment = harness.environment()
+    print("%s %s, GIL %s" % (environment['implementation'], environment['python'],
+                             "enabled" if environment['gil_enabled'] else "disabled"))
+
+    results = []
+    for (name, fn, params) in cases:
+        case_id = harness.case_id(name, params)
+        result = harness.run_case(fn, params, repeat=args.repeat, min_time=args.min_time)
+        result.update(id=case_id, name=name, params=params)
+        results.append(result)
+        print(_format_result(result))
+        sys.stdout.flush()
+
+    if args.output:
+        harness.write_results(args.output, results)
+
+    if args.compare:
+        comparisons = harness.compare(harness.load_results(args.compare), results, args.threshold)
+        print()
+        print("%-60s %12s %12s %8s" % ("case", "baseline", "current", "ratio"))
+        for (case_id, before, after, ratio, regressed) in comparisons:
+            print("%-60s %12s %12s %7.2fx%s" % (case_id, _format_time(before), _format_time(after), ratio,
+                                                "  REGRESSED" if regressed else ""))
+
+        if any(regressed for (_, _, _, _, regressed) in comparisons):
+            return 1
+
+    return 0
+
+
+def _format_time(seconds):
+    for (scale, unit) in ((1, 's'), (1e-3, 'ms'), (1e-6, 'us')):
+        if seconds >= scale:
+            return "%.3f%s" % (seconds / scale, unit)
+    return "%.1fns" % (seconds / 1e-9)
+
+
+def _format_result(result):
+    if 'ops_per_sec' in result:
+        return "%-60s %12s/op %14.0f ops/s" % (result['id'], _format_time(result['min']), result['ops_per_sec'])
+
+    details = ", ".join("%s=%s" % (key, value) for key, value in sorted(result.items())
+                        if key not in ('id', 'name', 'params'))
+    return "%-60s %s" % (result['id'], details)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
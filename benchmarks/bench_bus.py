@@ -0,0 +1,82 @@
+"""
+Cross-process bus benchmarks: round trips to a sibling's handlers over Unix domain sockets. Both ends of the bus run
+in this process, so this measures the framing, pickling and socket overhead rather than any real parallelism.
+"""
+
+__author__ = 'rob'
+
+import os
+import shutil
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import noop
+from benchmarks.harness import benchmark
+from wireworks.bus import Bus
+from wireworks.registry import Registry
+
+
+def _connected_pair(connections):
+    """Set up a local registry connected to a remote one with a handler for 'orders.created'"""
+    directory = tempfile.mkdtemp()
+    local = Registry()
+    remote = Registry()
+    remote.register('orders.created', noop, strongly_reference=True)
+
+    local_bus = Bus(local)
+    remote_bus = Bus(remote)
+    remote_bus.listen(os.path.join(directory, 'remote.sock'))
+    peer = local_bus.connect(remote_bus.get_path(), connections)
+    peer.wait_for_subscription('orders.created', timeout=10)
+
+    def teardown():
+        local_bus.close()
+        remote_bus.close()
+        shutil.rmtree(directory)
+
+    return local.with_filter('orders.created'), teardown
+
+
+@benchmark('bus.call', quick={'connections': [1]}, full={'connections': [1, 4]})
+def call(connections):
+    """Dispatch to a sibling, waiting for the reply"""
+    (dispatcher, teardown) = _connected_pair(connections)
+
+    def run():
+        dispatcher.call(1).await_all()
+
+    return run, 1, teardown
+
+
+@benchmark('bus.call_concurrent', quick={'connections': [1, 4], 'threads': [8]},
+           full={'connections': [1, 4], 'threads': [1, 8, 32]})
+def call_concurrent(connections, threads):
+    """Dispatch to a sibling from `threads` threads at once, 100 dispatches per thread, batching writes between them"""
+    (dispatcher, teardown) = _connected_pair(connections)
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    def dispatch_many():
+        for _ in range(100):
+            dispatcher.call(1).await_all()
+
+    def run():
+        for future in [pool.submit(dispatch_many) for _ in range(threads)]:
+            future.result()
+
+    def teardown_all():
+        pool.shutdown()
+        teardown()
+
+    return run, threads * 100, teardown_all
+
+
+@benchmark('bus.emit', quick={'connections': [1]}, full={'connections': [1, 4]})
+def emit(connections):
+    """Fire-and-forget dispatch to a sibling"""
+    (dispatcher, teardown) = _connected_pair(connections)
+
+    def run():
+        dispatcher.emit(1)
+
+    return run, 1, teardown
@@ -0,0 +1,150 @@
+"""
+Dispatch benchmarks across handler fan-out and executor types, multi-core scaling, waiting on many dispatches at once,
+and the tail latency of urgent dispatches under a flood of bulk ones.
+"""
+
+__author__ = 'rob'
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import make_executor, make_keys, noop
+from benchmarks.harness import benchmark
+from wireworks.event import EventGroup
+from wireworks.registry import Registry
+from wireworks.util.priority_executor import HIGH, LOW
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+@benchmark('dispatch.call', quick={'fanout': [1, 10, 100], 'executor': ['sync', 'threads']},
+           full={'fanout': [1, 10, 100, 1000, 10000], 'executor': ['sync', 'threads']})
+def call(fanout, executor):
+    """Dispatch to `fanout` handlers, spread over as many keys, waiting for them all to complete"""
+    registry = Registry()
+    for key in make_keys(fanout):
+        registry.register(key, noop, strongly_reference=True)
+
+    (pool, teardown) = make_executor(executor)
+    dispatcher = registry.with_executor(pool).with_filter('**')
+
+    def run():
+        dispatcher.call().await_all()
+
+    return run, 1, teardown
+
+
+@benchmark('dispatch.emit', quick={'fanout': [1, 10, 100], 'executor': ['sync', 'threads']},
+           full={'fanout': [1, 10, 100, 1000, 10000], 'executor': ['sync', 'threads']})
+def emit(fanout, executor):
+    """Fire-and-forget dispatch to `fanout` handlers, spread over as many keys"""
+    registry = Registry()
+    for key in make_keys(fanout):
+        registry.register(key, noop, strongly_reference=True)
+
+    (pool, teardown) = make_executor(executor)
+    dispatcher = registry.with_executor(pool).with_filter('**')
+
+    def run():
+        dispatcher.emit()
+
+    return run, 1, teardown
+
+
+@benchmark('dispatch.call_single_key', quick={'fanout': [1, 10, 100]}, full={'fanout': [1, 10, 100, 1000, 10000]})
+def call_single_key(fanout):
+    """Synchronously dispatch to `fanout` handlers all registered under one key"""
+    registry = Registry()
+    handlers = [lambda: None for _ in range(fanout)]
+    for handler in handlers:
+        registry.register('single.key', handler, strongly_reference=True)
+
+    dispatcher = registry.with_filter('single.key')
+
+    def run():
+        dispatcher.call()
+
+    return run, 1
+
+
+@benchmark('dispatch.scaling', quick={'threads': [1, 2, 4, 8]}, full={'threads': [1, 2, 4, 8, 16, 32]})
+def scaling(threads):
+    """Synchronously dispatch to 10 handlers through one shared glob from `threads` threads at once, 2000 dispatches
+    per thread. Compare ops/s across thread counts, and between GIL and free-threaded builds (see the environment
+    recorded with --output): with the GIL, throughput stays flat as threads are added; without it, it should grow
+    with the number of cores."""
+    registry = Registry()
+    for key in make_keys(1000):
+        registry.register(key, noop, strongly_reference=True)
+
+    dispatcher = registry.with_filter('svc7.*.*')
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    def dispatch_many():
+        for _ in range(2000):
+            dispatcher.call()
+
+    def run():
+        for future in [pool.submit(dispatch_many) for _ in range(threads)]:
+            future.result()
+
+    return run, threads * 2000, pool.shutdown
+
+
+@benchmark('dispatch.fan_in', quick={'events': [100, 1000], 'wait': ['each', 'group']},
+           full={'events': [100, 1000, 10000], 'wait': ['each', 'group']})
+def fan_in(events, wait):
+    """Dispatch `events` events of 10 handlers each to a threadpool, then wait for all of them: one Event at a time
+    with await_all, or all at once through an EventGroup"""
+    registry = Registry()
+    for key in make_keys(10):
+        registry.register(key, noop, strongly_reference=True)
+
+    (pool, teardown) = make_executor('threads')
+    dispatcher = registry.with_executor(pool).with_filter('**')
+
+    def run():
+        dispatched = [dispatcher.call() for _ in range(events)]
+        if wait == 'group':
+            EventGroup(dispatched).wait_all()
+        else:
+            for event in dispatched:
+                event.await_all()
+
+    return run, events, teardown
+
+
+@benchmark('dispatch.priority_tail', quick={'executor': ['threads', 'priority'], 'flood': [2000]},
+           full={'executor': ['threads', 'priority'], 'flood': [2000, 20000]})
+def priority_tail(executor, flood):
+    """Emit `flood` bulk dispatches at low priority to four workers, each taking 200us, with an urgent dispatch at high
+    priority after every 20th. Records how long urgent dispatches waited to start (p50, p99 and max, in seconds; 'min'
+    is the p99, for baseline comparisons). A ThreadPoolExecutor ignores priorities, so urgent dispatches queue up
+    behind the flood; a PriorityExecutor should start them as soon as a worker is free."""
+    registry = Registry()
+    waits = []
+
+    def bulk():
+        time.sleep(0.0002)
+
+    def urgent(submitted):
+        waits.append(_clock() - submitted)
+
+    registry.register('bulk.work', bulk, strongly_reference=True)
+    registry.register('urgent.work', urgent, strongly_reference=True)
+
+    (pool, teardown) = make_executor(executor)
+    bulk_dispatcher = registry.with_executor(pool).with_filter('bulk.work').with_priority(LOW)
+    urgent_dispatcher = registry.with_executor(pool).with_filter('urgent.work').with_priority(HIGH)
+    try:
+        for index in range(flood):
+            bulk_dispatcher.emit()
+            if index % 20 == 19:
+                urgent_dispatcher.emit(_clock())
+    finally:
+        teardown()
+
+    waits.sort()
+    p99 = waits[min(len(waits) - 1, int(len(waits) * 0.99))]
+    return {'min': p99, 'p50': waits[len(waits) // 2], 'p99': p99, 'max': waits[-1], 'samples': len(waits)}
@@ -0,0 +1,59 @@
+"""
+Garbage collector pressure from dispatching: how often the cyclic GC runs, and how much it finds, per million
+dispatches. A dispatch that leaves no reference cycles behind should barely trouble the GC at all.
+"""
+
+__author__ = 'rob'
+
+import gc
+
+from benchmarks.fixtures import make_executor, make_keys, noop
+from benchmarks.harness import benchmark
+from wireworks.registry import Registry
+
+
+def _failing(*args, **kwargs):
+    raise ValueError("failed")
+
+
+def _gc_totals():
+    """Collections run and objects collected so far, over all generations"""
+    stats = gc.get_stats()
+    return sum(generation['collections'] for generation in stats), sum(generation['collected'] for generation in stats)
+
+
+@benchmark('gc.dispatch',
+           quick={'dispatches': [100000], 'fanout': [1, 10], 'executor': ['sync', 'threads'],
+                  'mode': ['call', 'emit', 'pooled', 'raising']},
+           full={'dispatches': [1000000], 'fanout': [1, 10, 100], 'executor': ['sync', 'threads'],
+                 'mode': ['call', 'emit', 'pooled', 'raising']})
+def dispatch(dispatches, fanout, executor, mode):
+    """Dispatch to `fanout` handlers `dispatches` times, counting GC runs. In 'raising' mode, every handler raises."""
+    registry = Registry()
+    for key in make_keys(fanout):
+        registry.register(key, _failing if mode == 'raising' else noop, strongly_reference=True)
+
+    (pool, teardown) = make_executor(executor)
+    dispatcher = registry.with_executor(pool).with_filter('**')
+    if mode == 'pooled':
+        dispatcher = dispatcher.with_event_pool()
+
+    gc.collect()
+    (collections_before, collected_before) = _gc_totals()
+    try:
+        for _ in range(dispatches):
+            if mode == 'emit':
+                dispatcher.emit()
+            elif mode == 'pooled':
+                dispatcher.call_pooled()
+            else:
+                dispatcher.call().await_all()
+    finally:
+        # shutting the pool down waits for anything still in flight, so that it's counted too
+        if teardown:
+            teardown()
+    (collections_after, collected_after) = _gc_totals()
+
+    scale = 1000000.0 / dispatches
+    return {'collections_per_million': (collections_after - collections_before) * scale,
+            'collected_per_million': (collected_after - collected_before) * scale}
@@ -0,0 +1,51 @@
+"""
+GlobbableDict lookup benchmarks, with and without a warm glob cache.
+"""
+
+__author__ = 'rob'
+
+from benchmarks.fixtures import make_keys
+from benchmarks.harness import benchmark
+from wireworks.util.globbable_dict import GlobbableDict
+
+_PATTERNS = {
+    'exact': 'svc1.entity0.action1',
+    'single': 'svc1.*.*',
+    'double': 'svc1.**',
+    'all': '**',
+}
+
+_GRID_QUICK = {'keys': [10, 1000, 10000], 'pattern': sorted(_PATTERNS)}
+_GRID_FULL = {'keys': [10, 1000, 10000, 100000, 1000000], 'pattern': sorted(_PATTERNS)}
+
+
+def _make_dict(keys):
+    glob_dict = GlobbableDict()
+    for key in make_keys(keys):
+        glob_dict[key] = key
+    return glob_dict
+
+
+@benchmark('glob.cold', quick=_GRID_QUICK, full=_GRID_FULL)
+def cold_glob(keys, pattern):
+    glob_dict = _make_dict(keys)
+    glob_pattern = _PATTERNS[pattern]
+
+    def run():
+        glob_dict._empty_cache()
+        glob_dict.glob(glob_pattern)
+
+    return run, 1
+
+
+@benchmark('glob.warm', quick=_GRID_QUICK, full=_GRID_FULL)
+def warm_glob(keys, pattern):
+    glob_dict = _make_dict(keys)
+    glob_pattern = _PATTERNS[pattern]
+    glob_dict.glob(glob_pattern)
+
+    def run():
+        for _ in range(100):
+            glob_dict.glob(glob_pattern)
+
+    return run, 100
@@ -0,0 +1,35 @@
+"""
+Import time benchmarks. Each import is timed in a fresh interpreter, as a module is only ever imported once.
+"""
+
+__author__ = 'rob'
+
+import subprocess
+import sys
+
+from benchmarks.harness import benchmark
+
+_SCRIPT = """
+import sys, time
+before = set(sys.modules)
+started = time.perf_counter() if hasattr(time, 'perf_counter') else time.time()
+import %s
+elapsed = (time.perf_counter() if hasattr(time, 'perf_counter') else time.time()) - started
+print("%%r %%d" %% (elapsed, len(set(sys.modules) - before)))
+"""
+
+
+@benchmark('import', quick={'module': ['wireworks.registry'], 'runs': [10]},
+           full={'module': ['wireworks.registry', 'wireworks.metrics', 'wireworks.profiling', 'wireworks.tracing'],
+                 'runs': [30]})
+def import_module(module, runs):
+    """Import `module` in `runs` fresh interpreters, recording the time taken and the number of modules loaded"""
+    timings = []
+    modules_loaded = None
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', _SCRIPT % module])
+        (elapsed, modules_loaded) = output.decode('ascii').split()
+        timings.append(float(elapsed))
+
+    timings.sort()
+    return {'min': timings[0], 'median': timings[len(timings) // 2], 'modules_loaded': int(modules_loaded)}
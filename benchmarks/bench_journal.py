@@ -0,0 +1,65 @@
+"""
+Journal benchmarks: the cost of journaling a dispatch, with and without waiting for it to reach the disk, and replaying
+recorded traffic back through a registry.
+"""
+
+__author__ = 'rob'
+
+import shutil
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import make_keys, noop
+from benchmarks.harness import benchmark
+from wireworks.journal import Journal, Replayer
+from wireworks.registry import Registry
+
+
+@benchmark('journal.call', quick={'durable': [False, True], 'threads': [1, 8]},
+           full={'durable': [False, True], 'threads': [1, 8, 32]})
+def call(durable, threads):
+    """Journaled dispatches from `threads` threads at once, 100 per thread. Durable appends share flushes."""
+    directory = tempfile.mkdtemp()
+    registry = Registry()
+    registry.register('orders.created', noop, strongly_reference=True)
+    journal = Journal(directory, durable=durable)
+    dispatcher = registry.with_filter('orders.created').with_journal(journal)
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    def dispatch_many():
+        for i in range(100):
+            dispatcher.call(i, 'some', 'arguments')
+
+    def run():
+        for future in [pool.submit(dispatch_many) for _ in range(threads)]:
+            future.result()
+
+    def teardown():
+        pool.shutdown()
+        journal.close()
+        shutil.rmtree(directory)
+
+    return run, threads * 100, teardown
+
+
+@benchmark('journal.replay', quick={'calls': [10000], 'keys': [100]},
+           full={'calls': [100000], 'keys': [100, 10000]})
+def replay(calls, keys):
+    """Replay `calls` recorded calls, spread over `keys` keys, as fast as possible"""
+    directory = tempfile.mkdtemp()
+    registry = Registry()
+    patterns = make_keys(keys)
+    for pattern in patterns:
+        registry.register(pattern, noop, strongly_reference=True)
+
+    with Journal(directory, durable=False) as journal:
+        for i in range(calls):
+            journal.append(patterns[i % keys], (i,), {})
+
+    replayer = Replayer(registry, directory)
+
+    def run():
+        replayer.replay()
+
+    return run, calls, lambda: shutil.rmtree(directory)
@@ -0,0 +1,37 @@
+"""
+Large payload benchmarks: dispatching multi-megabyte buffers to handlers run in a process pool, pickled once per
+handler or shared once through shared memory.
+"""
+
+__author__ = 'rob'
+
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.fixtures import make_keys
+from benchmarks.harness import benchmark
+from wireworks.registry import Registry
+
+
+def payload_size(payload):
+    """Module level, so that it can be run in a process pool"""
+    return len(payload)
+
+
+@benchmark('payload.process_pool', quick={'megabytes': [8], 'fanout': [4], 'shared': [False, True]},
+           full={'megabytes': [1, 8, 64], 'fanout': [1, 4, 16], 'shared': [False, True]})
+def process_pool(megabytes, fanout, shared):
+    """Dispatch a `megabytes` buffer to `fanout` handlers in a process pool, waiting for them all to complete"""
+    registry = Registry()
+    for key in make_keys(fanout):
+        registry.register(key, payload_size, strongly_reference=True)
+
+    pool = ProcessPoolExecutor(max_workers=4)
+    dispatcher = registry.with_executor(pool).with_filter('**').with_deduplication(False)
+    if shared:
+        dispatcher = dispatcher.with_payload_views()
+    payload = b'\0' * (megabytes * 1024 * 1024)
+
+    def run():
+        dispatcher.call(payload).await_all()
+
+    return run, 1, pool.shutdown
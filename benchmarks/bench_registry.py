@@ -0,0 +1,121 @@
+"""
+Registration benchmarks: bulk registration, wired instance create/destroy churn (from one thread or many), scoped
+registration churn, and child registry overlays.
+"""
+
+__author__ = 'rob'
+
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fixtures import make_keys, noop
+from benchmarks.harness import benchmark
+from wireworks.registry import Registry
+
+
+@benchmark('registry.register', quick={'keys': [10, 1000, 10000]}, full={'keys': [10, 1000, 10000, 100000, 1000000]})
+def register(keys):
+    key_list = make_keys(keys)
+
+    def run():
+        registry = Registry()
+        for key in key_list:
+            registry.register(key, noop, strongly_reference=True)
+
+    return run, keys
+
+
+@benchmark('registry.instance_churn', quick={'instances': [100, 1000], 'methods': [1, 5]},
+           full={'instances': [100, 1000, 10000], 'methods': [1, 5, 20]})
+def instance_churn(instances, methods):
+    """Create and immediately destroy instances of a wired class, each wiring `methods` weakly referenced methods"""
+    registry = Registry()
+
+    attrs = {'__init__': lambda self: None}
+    for index in range(methods):
+        attrs['method%d' % index] = registry.wire_instance_method('churn.method%d' % index)(lambda self: None)
+    wired_class = registry.wire_class_instances(type('Wired', (object,), attrs))
+
+    def run():
+        for _ in range(instances):
+            wired_class()
+
+    return run, instances
+
+
+@benchmark('registry.concurrent_instance_churn', quick={'threads': [1, 8], 'shards': [0, 16]},
+           full={'threads': [1, 2, 4, 8, 16], 'shards': [0, 4, 16, 64]})
+def concurrent_instance_churn(threads, shards):
+    """Create and destroy instances of wired classes from `threads` threads at once, 1000 per thread, in a registry
+    with `shards` shards (0 for an unsharded one). Each thread has a class of its own, wired under keys of its own."""
+    registry = Registry(shards=shards or None)
+
+    wired_classes = []
+    for thread in range(threads):
+        attrs = {'__init__': lambda self: None}
+        for index in range(3):
+            pattern = 'component%d.method%d' % (thread, index)
+            attrs['method%d' % index] = registry.wire_instance_method(pattern)(lambda self: None)
+        wired_classes.append(registry.wire_class_instances(type('Wired%d' % thread, (object,), attrs)))
+
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    def churn(wired_class):
+        for _ in range(1000):
+            wired_class()
+
+    def run():
+        for future in [pool.submit(churn, wired_class) for wired_class in wired_classes]:
+            future.result()
+
+    return run, threads * 1000, pool.shutdown
+
+
+@benchmark('registry.scope_churn', quick={'keys': [1000, 10000], 'handlers': [1, 10]},
+           full={'keys': [1000, 10000, 100000], 'handlers': [1, 10, 100]})
+def scope_churn(keys, handlers):
+    """Open a scope, register `handlers` handlers under keys of its own, dispatch to them and close it again, while
+    dispatching to long-lived handlers over `keys` keys in between"""
+    registry = Registry()
+    for key in make_keys(keys):
+        registry.register(key, noop, strongly_reference=True)
+
+    long_lived = [registry.with_filter('svc%d.**' % index) for index in range(10)]
+    counter = [0]
+
+    def run():
+        counter[0] += 1
+        tenant = 'tenant%d' % counter[0]
+        with registry.scope() as scope:
+            for index in range(handlers):
+                scope.register('%s.handler%d' % (tenant, index), noop, strongly_reference=True)
+            registry.with_filter(tenant + '.*').emit()
+
+        for dispatcher in long_lived:
+            dispatcher.emit()
+
+    return run, 1
+
+
+@benchmark('registry.child', quick={'keys': [1000, 100000], 'mode': ['create', 'dispatch']},
+           full={'keys': [1000, 100000, 1000000], 'mode': ['create', 'dispatch']})
+def child(keys, mode):
+    """Layer a child registry over a parent with `keys` keys, adding one handler of its own and masking one of the
+    parent's: in 'create' mode, time making the overlay; in 'dispatch' mode, time a warm synchronous dispatch through it
+    to ``svc7.entity0.*``, matching keys in both layers. Both should cost the same however many keys the parent has."""
+    registry = Registry()
+    for key in make_keys(keys):
+        registry.register(key, noop, strongly_reference=True)
+
+    def make_overlay():
+        overlay = registry.child()
+        overlay.register('svc7.entity0.extra', noop, strongly_reference=True)
+        overlay.mask('svc7.entity0.action7')
+        return overlay
+
+    if mode == 'create':
+        return make_overlay, 1
+
+    dispatcher = make_overlay().with_filter('svc7.entity0.*')
+    dispatcher.call()
+
+    return dispatcher.call, 1
@@ -0,0 +1,47 @@
+"""
+Timing wheel benchmarks: the cost of a tick of the wheel with many calls scheduled on later turns, and of scheduling
+and cancelling calls.
+"""
+
+__author__ = 'rob'
+
+from benchmarks.fixtures import noop
+from benchmarks.harness import benchmark
+from wireworks.util.timing_wheel import TimingWheel
+
+_WHEEL_SIZE = 512
+
+
+def _idle_wheel():
+    """A wheel whose own thread won't tick until long after the benchmark's done, so the benchmark can drive it"""
+    return TimingWheel(tick=3600, wheel_size=_WHEEL_SIZE)
+
+
+@benchmark('timing_wheel.tick', quick={'timers': [1000, 100000]}, full={'timers': [1000, 100000, 1000000]})
+def tick(timers):
+    """One full turn of the wheel with `timers` calls pending on later turns, spread over every slot. Nothing is due,
+    so this is the pure cost of the wheel looking for due calls."""
+    wheel = _idle_wheel()
+    for index in range(timers):
+        wheel.call_later(3600 * (_WHEEL_SIZE + index), noop)
+
+    def run():
+        with wheel._condition:
+            for tick_index in range(1, _WHEEL_SIZE + 1):
+                wheel._take_due(tick_index)
+
+    return run, _WHEEL_SIZE, wheel.shutdown
+
+
+@benchmark('timing_wheel.schedule', quick={'timers': [1000, 100000]}, full={'timers': [1000, 100000, 1000000]})
+def schedule(timers):
+    """Schedule and cancel a call with `timers` other calls already pending"""
+    wheel = _idle_wheel()
+    for index in range(timers):
+        wheel.call_later(3600 * (_WHEEL_SIZE + index), noop)
+
+    def run():
+        for index in range(100):
+            wheel.call_later(3600 * index, noop).cancel()
+
+    return run, 100, wheel.shutdown
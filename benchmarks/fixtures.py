@@ -0,0 +1,33 @@
+"""
+Shared setup for benchmarks.
+"""
+
+__author__ = 'rob'
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wireworks.util.priority_executor import PriorityExecutor
+from wireworks.util.synchronous_executor import SynchronousExecutor
+
+
+def make_keys(count):
+    """
+    Make `count` distinct three-component keys, spread over 100 top-level components, eg ``svc7.entity3.action1207``.
+    """
+    return ["svc%d.entity%d.action%d" % (i % 100, (i // 100) % 100, i) for i in range(count)]
+
+
+def make_executor(name):
+    """
+    Returns:
+        tuple: (executor, teardown) for an executor name of 'sync', 'threads' or 'priority'
+    """
+    if name == 'sync':
+        return SynchronousExecutor(), None
+
+    executor = PriorityExecutor(max_workers=4) if name == 'priority' else ThreadPoolExecutor(max_workers=4)
+    return executor, executor.shutdown
+
+
+def noop(*args, **kwargs):
+    pass
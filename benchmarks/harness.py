@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+A tiny benchmark harness: benchmark registration, parameter grids, timing, JSON output and baseline comparison.
+
+A benchmark is a function that takes its parameters as kwargs, does any setup it needs, and returns a tuple of
+``(run, ops)``: a no-arg callable to time, and the number of operations each call to it performs. Register one with
+the `benchmark` decorator, giving a parameter grid for each suite::
+
+    @benchmark('glob.warm', quick={'keys': [10, 1000]}, full={'keys': [10, 1000, 1000000]})
+    def warm_glob(keys):
+        ...
+        return run, 1
+
+Every combination of the grid's parameters is run.
+
+Benchmarks that measure something other than time per operation can instead return a dict of results, which is
+recorded as-is. Include a 'min' entry (lower is better) for the result to take part in baseline comparisons.
+"""
+
+__author__ = 'rob'
+
+import gc
+import itertools
+import json
+import platform
+import sys
+import time
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+_BENCHMARKS = []
+
+SUITES = ('quick', 'full')
+
+
+def benchmark(name, **suites):
+    """
+    Register a benchmark function.
+
+    Args:
+        name (str): Name of the benchmark
+        suites: For each suite name, a dict of parameter name to list of values. Suites that aren't given run the
+            benchmark with the 'quick' grid, or with no parameters if that's missing too.
+    """
+    def decorator(fn):
+        _BENCHMARKS.append((name, fn, suites))
+        return fn
+    return decorator
+
+
+def get_benchmarks(suite, name_filter=None):
+    """
+    Get every registered benchmark case for a suite.
+
+    Returns:
+        list: Tuples of (name, fn, params)
+    """
+    cases = []
+    for (name, fn, suites) in _BENCHMARKS:
+        if name_filter and name_filter not in name:
+            continue
+
+        grid = suites.get(suite, suites.get('quick', {}))
+        names = sorted(grid)
+        for values in itertools.product(*[grid[param] for param in names]):
+            cases.append((name, fn, dict(zip(names, values))))
+
+    return cases
+
+
+def case_id(name, params):
+    """
+    Returns:
+        str: A stable identifier for a benchmark case, eg ``glob.warm[keys=1000]``
+    """
+    return "%s[%s]" % (name, ",".join("%s=%s" % (key, params[key]) for key in sorted(params)))
+
+
+def run_case(fn, params, repeat=5, min_time=0.2):
+    """
+    Set up and time a single benchmark case (or, for benchmarks returning a dict, just run it).
+
+    Each repeat calls the benchmark's run callable as many times as it takes to fill min_time, and the time per
+    operation is worked out from that. The GC is left on, as it would be in real use.
+
+    Returns:
+        dict: Timings in seconds per operation (min, median, mean), ops per second (from the min), and the number of
+        operations timed
+    """
+    setup = fn(**params)
+    if isinstance(setup, dict):
+        return setup
+
+    (run, ops) = setup[:2]
+    teardown = setup[2] if len(setup) > 2 else None
+
+    try:
+        # warm up, and work out how many calls fill min_time
+        started = _clock()
+        run()
+        elapsed = max(_clock() - started, 1e-9)
+        loops = max(1, int(min_time / elapsed))
+
+        per_op = []
+        for _ in range(repeat):
+            gc.collect()
+            started = _clock()
+            for _ in range(loops):
+                run()
+            per_op.append((_clock() - started) / (loops * ops))
+    finally:
+        if teardown:
+            teardown()
+
+    per_op.sort()
+    return {'min': per_op[0], 'median': per_op[len(per_op) // 2], 'mean': sum(per_op) / len(per_op),
+            'ops_per_sec': 1.0 / per_op[0] if per_op[0] else None, 'ops': loops * ops * repeat}
+
+
+def environment():
+    """
+    Returns:
+        dict: Details of the interpreter and machine the benchmarks ran on
+    """
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    return {'python': sys.version.split()[0], 'implementation': platform.python_implementation(),
+            'platform': platform.platform(), 'gil_enabled': gil_enabled, 'timestamp': time.time()}
+
+
+def write_results(path, results):
+    with open(path, 'w') as output:
+        json.dump({'environment': environment(), 'results': results}, output, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)['results']
+
+
+def compare(baseline, results, threshold):
+    """
+    Compare results against a baseline, using the minimum time per operation.
+
+    Returns:
+        list: Tuples of (case id, baseline seconds per op, current seconds per op, ratio, regressed) for every case in
+        both sets of results. A case has regressed if it's slower than the baseline by more than threshold (as a
+        fraction).
+    """
+    baseline_by_id = dict((result['id'], result) for result in baseline)
+    comparisons = []
+    for result in results:
+        before = baseline_by_id.get(result['id'])
+        if not before or 'min' not in before or 'min' not in result:
+            continue
+
+        ratio = result['min'] / before['min'] if before['min'] else float('inf')
+        comparisons.append((result['id'], before['min'], result['min'], ratio, ratio > 1 + threshold))
+
+    return comparisons
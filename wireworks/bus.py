@@ -0,0 +1,693 @@
+"""
+Event dispatch across process boundaries, over Unix domain sockets.
+
+Each process wraps its `Registry` in a `Bus`, listens on a socket path of its own, and connects to the paths of its
+siblings:
+
+    >>> bus = Bus(registry)
+    >>> bus.listen("/run/myapp/worker-%d.sock" % worker_id)
+    >>> for path in sibling_paths:
+    ...     bus.connect(path)
+
+A process forwards the patterns it has handlers registered against to every process connected to it, as they come
+and go. The connecting process registers a `RemoteHandler` against each of those patterns in its own registry, so
+dispatchers there publish to the sibling exactly as they would to a local handler - and a process is only ever sent
+events it has handlers for. Each remote call comes back as one normal Future on the dispatch's Event, whose result is
+the list of results of the sibling's handlers for that pattern (highest priority first). If any of them raised, the
+Future raises the first such exception instead. Exceptions that can't be pickled are raised as `RemoteError`.
+
+Arguments and results are pickled, so they need to be picklable; a call whose arguments can't be pickled fails
+locally, without anything being sent. Calls made through `Dispatcher.emit` are sent without asking for a reply.
+
+On the wire, everything is a frame: a fixed header of payload length, frame type and call id, then the payload.
+Connections are persistent, and a `Peer` keeps a small pool of them per sibling, spreading calls over the pool. Frames
+sent from several threads at once are batched together into a single write.
+
+Frames are unpickled as they arrive, so anything able to connect to a Bus's socket can run code in its process. The
+socket is only accessible to its owner by default, and where the platform can say who's on the other end of a
+connection (`SO_PEERCRED`, on Linux), connections from other users are refused. Elsewhere, every process able to
+reach the socket path must be trusted.
+"""
+
+__author__ = 'rob'
+
+import errno
+import itertools
+import os
+import socket
+import stat
+import struct
+import time
+
+from threading import Condition, RLock, Thread
+
+from wireworks.dispatcher import get_default_executor, log_handler_error, _unwrap
+from wireworks.event import Event
+from wireworks.handler import Handler
+from wireworks.util.lazy_logger import LazyLogger
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+_LOG = LazyLogger("wireworks.bus")
+
+# payload length, frame type, call id
+_HEADER = struct.Struct('!IBQ')
+
+_CALL = 1           # payload: pickled (pattern, args, kwargs). A call id of 0 asks for no reply.
+_RESULT = 2         # payload: pickled list of results
+_ERROR = 3          # payload: pickled exception
+_LISTEN = 4         # no payload: start forwarding subscriptions on this connection
+_SUBSCRIBE = 5      # payload: the pattern, utf-8 encoded
+_UNSUBSCRIBE = 6    # payload: the pattern, utf-8 encoded
+
+_NO_REPLY = 0
+
+
+class RemoteError(Exception):
+    """Raised from the Future of a remote call that failed in a way that can't be reproduced locally - the connection
+    was lost, or the sibling's handler raised something that couldn't be pickled."""
+
+
+def _frame(kind, call_id, payload=b''):
+    return _HEADER.pack(len(payload), kind, call_id) + payload
+
+
+def _pickled_error(error):
+    """Pickle an exception, falling back to a `RemoteError` describing it if it can't be"""
+    try:
+        return pickle.dumps(error, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return pickle.dumps(RemoteError("%s: %s" % (type(error).__name__, error)), pickle.HIGHEST_PROTOCOL)
+
+
+def _remove_stale_socket(path):
+    """Remove a socket file left behind at the given path (eg by a crashed process), if there is one.
+
+    A socket is only stale if nothing is listening on it any more.
+
+    :raises OSError:    If there's something other than a stale socket at the path
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EADDRINUSE, "Not a socket", path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (IOError, OSError, socket.error) as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+        os.unlink(path)
+    else:
+        raise OSError(errno.EADDRINUSE, "Another process is listening on the socket", path)
+    finally:
+        probe.close()
+
+
+def _peer_uid(sock):
+    """Get the uid of the process at the other end of a Unix domain socket, or None if the platform can't tell us"""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    (_, uid, _) = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    return uid
+
+
+class _Connection(object):
+    """One end of a socket carrying frames.
+
+    Frames are read on a thread of the connection's own, and handed to `frame_handler(connection, kind, call_id,
+    payload)`. Sending is threadsafe: a thread sending while another is already writing leaves its frame to be
+    written along with everything else that's queued up once the current write finishes, so concurrent senders share
+    writes rather than queueing for them.
+
+    Once closed, `close_handler(connection, error)` is called, with the error that broke the connection (if any) - which
+    is the only way the senders of frames still queued when a write fails find out about it.
+    """
+    def __init__(self, sock, frame_handler, close_handler, name):
+        self._socket = sock
+        self._frame_handler = frame_handler
+        self._close_handler = close_handler
+        self._name = name
+        # reentrant, as frames may be sent from garbage collector callbacks (see `Registry.add_listener`)
+        self._send_lock = RLock()
+        self._outgoing = []
+        self._writing = False
+        self._closed = False
+
+    def start(self):
+        reader = Thread(target=self._read_frames, name="wireworks-bus-%s" % self._name)
+        reader.daemon = True
+        reader.start()
+
+    def send(self, frame):
+        """Send a frame, batched together with any others sent at the same time.
+
+        :raises RemoteError:    If the connection is closed
+        """
+        with self._send_lock:
+            if self._closed:
+                raise RemoteError("Connection %s is closed" % self._name)
+            self._outgoing.append(frame)
+            if self._writing:
+                return
+            self._writing = True
+
+        try:
+            while True:
+                with self._send_lock:
+                    if not self._outgoing:
+                        self._writing = False
+                        return
+                    data = b''.join(self._outgoing)
+                    del self._outgoing[:]
+
+                self._socket.sendall(data)
+        except (IOError, OSError, socket.error) as e:
+            with self._send_lock:
+                self._writing = False
+            self.close(e)
+            raise RemoteError("Connection %s lost: %s" % (self._name, e))
+
+    def close(self, error=None):
+        """Close the connection, dropping any frames still queued to be sent.
+
+        :param error:   The error that broke the connection, if it was broken
+        """
+        with self._send_lock:
+            if self._closed:
+                return
+            self._closed = True
+            del self._outgoing[:]
+
+        try:
+            # wakes the reader thread up
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except (IOError, OSError, socket.error):
+            pass
+        self._socket.close()
+        self._close_handler(self, error)
+
+    def closed(self):
+        return self._closed
+
+    def _read_frames(self):
+        reader = self._socket.makefile('rb')
+        try:
+            while True:
+                header = reader.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                (length, kind, call_id) = _HEADER.unpack(header)
+                payload = reader.read(length) if length else b''
+                if len(payload) < length:
+                    break
+
+                try:
+                    self._frame_handler(self, kind, call_id, payload)
+                except Exception:
+                    _LOG.exception("Couldn't handle frame of type %d on connection %s", kind, self._name)
+        except (IOError, OSError, socket.error, ValueError):
+            pass
+        finally:
+            reader.close()
+            self.close()
+
+
+class RemoteHandler(Handler):
+    """Stands in for the handlers a sibling process has registered against a pattern.
+
+    Registered in the local registry by a `Peer`. Every call is sent to the sibling rather than being submitted to an
+    executor, and its Future completes when the reply arrives.
+    """
+    def __init__(self, peer, pattern):
+        super(RemoteHandler, self).__init__(None, None)
+        self._peer = peer
+        self._pattern = pattern
+
+    def get_callable(self):
+        return self
+
+    def get_pattern(self):
+        """Get the pattern this stands in for the sibling's handlers for.
+
+        :return:    The pattern
+        """
+        return self._pattern
+
+    def try_short_circuit(self, args, kwargs):
+        return self._peer.call(self._pattern, args, kwargs), None
+
+    def __call__(self, *args, **kwargs):
+        self._peer.send(self._pattern, args, kwargs)
+
+    def __repr__(self):
+        return "RemoteHandler(%r via %s)" % (self._pattern, self._peer.get_path())
+
+
+class Peer(object):
+    """A pool of connections to a sibling process's `Bus`, made with `Bus.connect`.
+
+    While connected, the sibling's subscriptions are registered in the local registry as `RemoteHandler` instances.
+    Closing the Peer (or losing the connection it receives subscriptions over) unregisters them all, and fails any
+    calls still waiting for a reply with a `RemoteError`.
+
+    :param registry:    The local registry to register subscriptions in
+    :param path:        The sibling's socket path
+    :param connections: The number of connections to keep open to the sibling
+    :param priority:    The priority to register subscriptions with
+    """
+    def __init__(self, registry, path, connections=2, priority=0):
+        self._registry = registry
+        self._path = path
+        self._priority = priority
+        self._lock = Condition(RLock())
+        self._subscriptions = {}
+        self._pending = {}
+        self._call_ids = itertools.count(1)
+        self._next_connection = itertools.count()
+        self._closed = False
+
+        self._connections = []
+        try:
+            for index in range(max(1, connections)):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.connect(path)
+                except (IOError, OSError, socket.error):
+                    sock.close()
+                    raise
+                self._connections.append(_Connection(sock, self._handle_frame, self._connection_closed,
+                                                     "%s#%d" % (path, index)))
+        except Exception:
+            self.close()
+            raise
+
+        for connection in self._connections:
+            connection.start()
+        self._connections[0].send(_frame(_LISTEN, _NO_REPLY))
+
+    def get_path(self):
+        return self._path
+
+    def get_subscriptions(self):
+        """Get the patterns the sibling currently has handlers for.
+
+        :return:    A list of patterns
+        """
+        with self._lock:
+            return list(self._subscriptions)
+
+    def wait_for_subscription(self, pattern, timeout=None):
+        """Wait until the sibling has told us it has handlers for a pattern.
+
+        :param pattern: The pattern to wait for
+        :param timeout: Amount of time to wait in seconds before giving up
+        :return:        True if the sibling is subscribed to the pattern
+        """
+        started = time.time()
+        with self._lock:
+            while pattern not in self._subscriptions and not self._closed:
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.time() - started)
+                    if remaining <= 0:
+                        break
+                self._lock.wait(remaining)
+
+            return pattern in self._subscriptions
+
+    def call(self, pattern, args, kwargs):
+        """Call the sibling's handlers for a pattern.
+
+        :return:    A Future for the list of their results
+        """
+        from concurrent.futures import Future
+
+        future = Future()
+        try:
+            payload = pickle.dumps((pattern, args, kwargs), pickle.HIGHEST_PROTOCOL)
+            connection = self._choose_connection()
+            with self._lock:
+                # itertools.count isn't threadsafe without the GIL, and call ids must never be handed out twice
+                call_id = next(self._call_ids)
+                self._pending[call_id] = (connection, future)
+            try:
+                connection.send(_frame(_CALL, call_id, payload))
+            except RemoteError:
+                with self._lock:
+                    pending = self._pending.pop(call_id, None)
+                if pending is None:
+                    # closing the broken connection has already failed the call
+                    return future
+                raise
+        except Exception as e:
+            future.set_exception(e)
+
+        return future
+
+    def send(self, pattern, args, kwargs):
+        """Call the sibling's handlers for a pattern, without waiting for (or being told about) the results"""
+        payload = pickle.dumps((pattern, args, kwargs), pickle.HIGHEST_PROTOCOL)
+        self._choose_connection().send(_frame(_CALL, _NO_REPLY, payload))
+
+    def close(self):
+        """Close every connection to the sibling, and unregister its subscriptions"""
+        with self._lock:
+            self._closed = True
+        for connection in list(self._connections):
+            connection.close()
+
+    def closed(self):
+        return self._closed
+
+    def _choose_connection(self):
+        connections = self._connections
+        for _ in range(len(connections)):
+            connection = connections[next(self._next_connection) % len(connections)]
+            if not connection.closed():
+                return connection
+
+        raise RemoteError("No open connections to %s" % self._path)
+
+    def _handle_frame(self, connection, kind, call_id, payload):
+        if kind == _RESULT or kind == _ERROR:
+            with self._lock:
+                (_, future) = self._pending.pop(call_id, (None, None))
+            if future is None:
+                return
+            try:
+                value = pickle.loads(payload)
+            except Exception as e:
+                future.set_exception(RemoteError("Couldn't unpickle reply: %s" % e))
+                return
+            if kind == _RESULT:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        elif kind == _SUBSCRIBE:
+            self._subscribe(payload.decode('utf-8'))
+        elif kind == _UNSUBSCRIBE:
+            self._unsubscribe(payload.decode('utf-8'))
+        else:
+            _LOG.error("Unexpected frame of type %d from %s", kind, self._path)
+
+    def _subscribe(self, pattern):
+        with self._lock:
+            if self._closed or pattern in self._subscriptions:
+                return
+            scope = self._registry.scope()
+            scope.register(pattern, RemoteHandler(self, pattern), strongly_reference=True, priority=self._priority)
+            self._subscriptions[pattern] = scope
+            self._lock.notify_all()
+
+    def _unsubscribe(self, pattern):
+        with self._lock:
+            scope = self._subscriptions.pop(pattern, None)
+        if scope is not None:
+            scope.close()
+
+    def _connection_closed(self, connection, error):
+        with self._lock:
+            failed = [future for call_id, (pending_connection, future) in list(self._pending.items())
+                      if pending_connection is connection]
+            self._pending = dict((call_id, pending) for call_id, pending in self._pending.items()
+                                 if pending[0] is not connection)
+            if connection is self._connections[0]:
+                # the sibling's gone (or we're closing): it can't receive anything any more
+                self._closed = True
+            scopes = list(self._subscriptions.values()) if self._closed else []
+            if self._closed:
+                self._subscriptions.clear()
+            self._lock.notify_all()
+
+        for scope in scopes:
+            scope.close()
+        message = "Connection to %s lost" % self._path
+        if error is not None:
+            message = "%s: %s" % (message, error)
+        for future in failed:
+            future.set_exception(RemoteError(message))
+        if self._closed:
+            for other in self._connections:
+                other.close()
+
+
+class _Reply(object):
+    """Collects the results of a call made to us by a sibling, and sends them back once they're all in"""
+    def __init__(self, connection, call_id, calls, futures):
+        self._connection = connection
+        self._call_id = call_id
+        self._calls = calls
+        self._futures = futures
+        self._lock = RLock()
+        self._outstanding = len(futures)
+
+    def start(self):
+        if not self._futures:
+            self._finish()
+            return
+        for future in self._futures:
+            future.add_done_callback(self._completed)
+
+    def _completed(self, future):
+        with self._lock:
+            self._outstanding -= 1
+            if self._outstanding:
+                return
+        self._finish()
+
+    def _finish(self):
+        results = []
+        for (one_callable, future) in zip(self._calls, self._futures):
+            error = RemoteError("Cancelled") if future.cancelled() else future.exception()
+            if error is None:
+                results.append(future.result())
+            elif self._call_id == _NO_REPLY:
+                log_handler_error(_unwrap(one_callable), error)
+            else:
+                self._reply(_ERROR, _pickled_error(error))
+                return
+
+        if self._call_id == _NO_REPLY:
+            return
+
+        try:
+            payload = pickle.dumps(results, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            self._reply(_ERROR, _pickled_error(RemoteError("Couldn't pickle results: %s" % e)))
+        else:
+            self._reply(_RESULT, payload)
+
+    def _reply(self, kind, payload):
+        try:
+            self._connection.send(_frame(kind, self._call_id, payload))
+        except RemoteError:
+            _LOG.debug("Couldn't reply to call %d: connection closed", self._call_id)
+
+
+class Bus(object):
+    """Connects a `Registry` to the registries of sibling processes, over Unix domain sockets. See the module
+    documentation.
+
+    Calls from siblings are run with the given executor (synchronously, on the connection's own thread, by default),
+    and only ever invoke this process's own handlers - never the `RemoteHandler` instances standing in for other
+    processes, so events don't bounce back and forth between siblings.
+
+    :param registry:    The local registry
+    :param executor:    Executor to run calls from siblings with. Defaults to running them synchronously.
+    :param priority:    The priority to register siblings' subscriptions with
+    """
+    def __init__(self, registry, executor=None, priority=0):
+        self._registry = registry
+        self._executor = executor
+        self._priority = priority
+        self._lock = RLock()
+        self._advertised = set()
+        self._listening_connections = []
+        self._peers = []
+        self._path = None
+        self._listener = None
+        self._socket_inode = None
+        self._peer_uids = frozenset()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def listen(self, path, backlog=64, mode=0o600, peer_uids=None):
+        """Start accepting connections from siblings on a socket at the given path.
+
+        A stale socket file already at the path (eg left behind by a crashed process) is replaced. Anything else there
+        - including a socket another process is still listening on - is left alone, and an error raised.
+
+        Everything sent to the socket is unpickled, so only trusted processes should be able to connect to it. See
+        the module documentation.
+
+        :param path:        The socket path
+        :param backlog:     The listen backlog
+        :param mode:        The permissions to give the socket file. Only its owner can connect by default.
+        :param peer_uids:   The uids of the users allowed to connect, where the platform can tell who's connecting.
+                            Defaults to our own.
+        :raises OSError:    If there's something other than a stale socket at the path
+        """
+        _remove_stale_socket(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(path)
+            os.chmod(path, mode)
+            listener.listen(backlog)
+        except (IOError, OSError, socket.error):
+            listener.close()
+            raise
+
+        with self._lock:
+            self._path = path
+            self._listener = listener
+            self._socket_inode = os.stat(path).st_ino
+            self._peer_uids = frozenset(peer_uids if peer_uids is not None else [os.getuid()])
+            self._advertised = set(pattern for pattern in self._registry.get_patterns() if self._has_local(pattern))
+        self._registry.add_listener(self._registration_changed)
+
+        acceptor = Thread(target=self._accept, args=(listener,), name="wireworks-bus-accept-%s" % path)
+        acceptor.daemon = True
+        acceptor.start()
+
+    def connect(self, path, connections=2):
+        """Connect to a sibling's Bus, registering its subscriptions in our registry.
+
+        :param path:        The sibling's socket path
+        :param connections: The number of connections to keep open to the sibling
+        :return:            The connected `Peer`
+        """
+        peer = Peer(self._registry, path, connections, self._priority)
+        with self._lock:
+            self._peers.append(peer)
+        return peer
+
+    def get_path(self):
+        return self._path
+
+    def get_peers(self):
+        with self._lock:
+            return [peer for peer in self._peers if not peer.closed()]
+
+    def close(self):
+        """Stop listening, and close every connection from and to siblings"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            listener = self._listener
+            connections = list(self._listening_connections)
+            peers = list(self._peers)
+
+        self._registry.remove_listener(self._registration_changed)
+        if listener is not None:
+            try:
+                listener.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError, socket.error):
+                pass
+            listener.close()
+            try:
+                # unless another process has replaced it since
+                if os.stat(self._path).st_ino == self._socket_inode:
+                    os.unlink(self._path)
+            except OSError:
+                pass
+
+        for connection in connections:
+            connection.close()
+        for peer in peers:
+            peer.close()
+
+    def _accept(self, listener):
+        count = itertools.count()
+        while True:
+            try:
+                (sock, _) = listener.accept()
+            except (IOError, OSError, socket.error):
+                return
+
+            with self._lock:
+                if self._closed:
+                    sock.close()
+                    return
+
+            uid = _peer_uid(sock)
+            if uid is not None and uid not in self._peer_uids:
+                _LOG.error("Refused a connection to %s from uid %d", self._path, uid)
+                sock.close()
+                continue
+
+            connection = _Connection(sock, self._handle_frame, self._connection_closed,
+                                     "%s<%d" % (self._path, next(count)))
+            connection.start()
+
+    def _handle_frame(self, connection, kind, call_id, payload):
+        if kind == _CALL:
+            (pattern, args, kwargs) = pickle.loads(payload)
+            self._run_call(connection, call_id, pattern, args, kwargs)
+        elif kind == _LISTEN:
+            with self._lock:
+                self._listening_connections.append(connection)
+                for pattern in list(self._advertised):
+                    connection.send(_frame(_SUBSCRIBE, _NO_REPLY, pattern.encode('utf-8')))
+        else:
+            _LOG.error("Unexpected frame of type %d on %s", kind, self._path)
+
+    def _run_call(self, connection, call_id, pattern, args, kwargs):
+        calls = [Handler.for_reference(reference) for reference in self._registry.get_references(pattern)]
+        calls = [one_callable for one_callable in calls
+                 if one_callable and not isinstance(one_callable, RemoteHandler)]
+
+        executor = self._executor if self._executor is not None else get_default_executor()
+        event = Event(calls, executor, pattern).go(*args, **kwargs)
+        _Reply(connection, call_id, calls, event.get_all_futures()).start()
+
+    def _connection_closed(self, connection, error):
+        with self._lock:
+            if connection in self._listening_connections:
+                self._listening_connections.remove(connection)
+
+    def _has_local(self, pattern):
+        """Check whether this process has any handlers of its own registered against a pattern"""
+        for reference in self._registry.get_references(pattern):
+            fn = reference.get_callable()
+            if fn and not isinstance(fn, RemoteHandler):
+                return True
+        return False
+
+    def _registration_changed(self, pattern, reference, added):
+        if isinstance(reference.get_callable(), RemoteHandler):
+            return
+
+        with self._lock:
+            has_local = self._has_local(pattern)
+            if has_local == (pattern in self._advertised):
+                return
+
+            if has_local:
+                self._advertised.add(pattern)
+                kind = _SUBSCRIBE
+            else:
+                self._advertised.discard(pattern)
+                kind = _UNSUBSCRIBE
+
+            frame = _frame(kind, _NO_REPLY, pattern.encode('utf-8'))
+            for connection in list(self._listening_connections):
+                try:
+                    connection.send(frame)
+                except RemoteError:
+                    pass
@@ -1,30 +1,522 @@
-from wireworks.util.synchronous_executor import SynchronousExecutor
-from wireworks.event import Event
+from wireworks.util.timing_wheel import get_default_timing_wheel
+from wireworks.event import Event, EventPool, LazyEvent, ReducingEvent
+from wireworks.handler import Handler
+from wireworks.instrumentation import CompositeInstrumentation
+from wireworks.util.callable_references import callable_name
+from wireworks.util.lazy_logger import LazyLogger
+from wireworks.util.static_functions import run_in_copied_context, runs_out_of_process
 
 __author__ = 'rob'
 
-_DEFAULT_SYNCHRONOUS_EXECUTOR = SynchronousExecutor()
+import time
+
+from threading import Lock, Event as ThreadingEvent, current_thread
+
+# created on first use, so that concurrent.futures isn't imported until something is actually dispatched
+_default_synchronous_executor = None
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def log_handler_error(handler, error):
+    """The default error sink for `Dispatcher.emit`: logs the error, along with its traceback.
+
+    :param handler: The callable that raised
+    :param error:   The Exception it raised
+    """
+    Dispatcher._LOG.error("Handler %s raised an exception", callable_name(handler),
+                          exc_info=(type(error), error, getattr(error, '__traceback__', None)))
+
+
+def get_default_executor():
+    """Get the shared `SynchronousExecutor` used by dispatchers that haven't been given an executor.
+
+    :return:    The executor
+    """
+    global _default_synchronous_executor
+    if _default_synchronous_executor is None:
+        from wireworks.util.synchronous_executor import SynchronousExecutor
+        _default_synchronous_executor = SynchronousExecutor()
+
+    return _default_synchronous_executor
+
+
+def _runs_synchronously(executor):
+    """Check whether an executor (None meaning the default) runs calls in the submitting thread"""
+    if executor is None:
+        return True
+
+    from wireworks.util.synchronous_executor import SynchronousExecutor
+    return isinstance(executor, SynchronousExecutor)
 
 
 class Dispatcher(object):
-    def __init__(self, glob_dict, pattern="*", executor=_DEFAULT_SYNCHRONOUS_EXECUTOR):
+    _LOG = LazyLogger("wireworks.dispatcher")
+
+    def __init__(self, glob_dict, pattern="*", executor=None, instrumentation=None, event_pool=None,
+                 error_sink=log_handler_error, deduplicate=True, journal=None, payload_views=None, priority=None):
         self._executor = executor
         self._pattern = pattern
         self._dispatcher_glob_dict = glob_dict
+        self._instrumentation = instrumentation
+        self._event_pool = event_pool
+        self._error_sink = error_sink
+        self._deduplicate = deduplicate
+        self._journal = journal
+        self._payload_views = payload_views
+        self._priority = priority
 
     def call(self, *args, **kwargs):
-        event = Event(self._all_matching_callables(), self._executor)
-        event.go(*args, **kwargs)
+        event = self._new_event(Event)
+        self._go(event, args, kwargs)
+
+        return event
+
+    def emit(self, *args, **kwargs):
+        """Dispatch without keeping track of anything - the cheapest way to dispatch, when nobody's interested in
+        what the handlers return, or when they've finished.
+
+        No Event is made, and with a synchronous executor, no Futures either: matching callables are simply called in
+        turn. Anything they raise is handed to this Dispatcher's error sink (see `with_error_sink`) rather than being
+        stored, and doesn't stop the remaining callables being called.
+
+        Callables are run without an event of their own, so `current_event()` gives them the event (if any) that was
+        current when `emit` was called. Result caches are bypassed, but rate limits aren't: calls they shed are handed
+        to the error sink as a `CallRejected`.
+        """
+        callables = self._all_matching_callables()
+        error_sink = self._error_sink
+        if self._payload_views is not None:
+            (args, kwargs, _) = self._payload_views.prepare(args, kwargs, runs_out_of_process(self._executor), False)
+
+        synchronous = _runs_synchronously(self._executor)
+        if self._instrumentation is None and synchronous:
+            for one_callable in callables:
+                try:
+                    one_callable(*args, **kwargs)
+                except Exception as e:
+                    error_sink(_unwrap(one_callable), e)
+            return
+
+        executor = self._get_executor()
+        for one_callable in callables:
+            target = executor
+            if isinstance(one_callable, Handler):
+                # shed before submission, so that calls don't queue up behind a limit
+                one_callable = one_callable.admit()
+                rejection = one_callable.get_rejection()
+                if rejection is not None:
+                    error_sink(one_callable.get_callable(), rejection)
+                    continue
+                target = one_callable.executor_for(executor)
+
+            emission = _Emission(one_callable, args, kwargs, error_sink, self._pattern, self._instrumentation)
+            if synchronous:
+                emission()
+            else:
+                target.submit(run_in_copied_context(emission))
+
+    def call_pooled(self, *args, **kwargs):
+        """Dispatch without handing back an Event, for when nobody's interested in the results.
+
+        If this Dispatcher has an `EventPool` (see `with_event_pool`), the Event is taken from the pool and returned
+        to it once all its callables have completed, rather than being thrown away.
+        """
+        if self._event_pool is None:
+            self.call(*args, **kwargs)
+            return
+
+        event = self._event_pool.acquire(self._all_matching_callables(), self._get_executor(), self._pattern,
+                                         self._instrumentation)
+        self._go(event, args, kwargs)
+        self._event_pool.release_when_done(event)
+
+    def call_lazy(self, *args, **kwargs):
+        """Dispatch lazily, only invoking each matching callable as its result is asked for.
+
+        Callables are invoked in priority order. See `LazyEvent`.
+        """
+        if self._payload_views is not None:
+            (args, kwargs, _) = self._payload_views.prepare(args, kwargs, runs_out_of_process(self._executor), False)
+        return self._new_event(LazyEvent).go(*args, **kwargs)
+
+    def call_reduce(self, reducer, initial, *args, **kwargs):
+        """Dispatch, folding each callable's result into a single value as it completes.
+
+        Use `result()` on the returned event to get the reduced value. See `ReducingEvent`.
 
+        :param reducer:     Callable taking the value reduced so far and a single result, returning the new value
+        :param initial:     The value to start reducing from
+        """
+        event = self._new_event(ReducingEvent, reducer, initial)
+        self._go(event, args, kwargs, journal=False)
         return event
 
+    def call_later(self, delay, *args, **kwargs):
+        """Dispatch after a delay.
+
+        Calls are scheduled on a single shared `TimingWheel`, and dispatched from its thread.
+
+        :param delay:   Delay in seconds
+        :return:        A `ScheduledCall` handle, which can be used to cancel the dispatch or get at its Event
+        """
+        return get_default_timing_wheel().call_later(delay, self.call, *args, **kwargs)
+
+    def call_at(self, when, *args, **kwargs):
+        """Dispatch at a given time. See `call_later`.
+
+        :param when:    Time to dispatch, as returned by time.time()
+        :return:        A `ScheduledCall` handle, which can be used to cancel the dispatch or get at its Event
+        """
+        return get_default_timing_wheel().call_at(when, self.call, *args, **kwargs)
+
+    def call_every(self, interval, *args, **kwargs):
+        """Dispatch repeatedly until cancelled, starting after one interval. See `call_later`.
+
+        :param interval:    Interval in seconds
+        :return:            A `ScheduledCall` handle, which can be used to cancel further dispatches
+        """
+        return get_default_timing_wheel().call_every(interval, self.call, *args, **kwargs)
+
     def with_filter(self, pattern):
-        return Dispatcher(self._dispatcher_glob_dict, pattern, self._executor)
+        return self._derive(pattern=pattern)
 
     def with_executor(self, executor):
-        return Dispatcher(self._dispatcher_glob_dict, self._pattern, executor)
+        return self._derive(executor=executor)
+
+    def with_instrumentation(self, instrumentation):
+        """Get a Dispatcher that reports on its dispatches to the given instrumentation.
+
+        :param instrumentation:     An `Instrumentation`, or None to turn instrumentation off
+        """
+        return self._derive(instrumentation=instrumentation)
+
+    def with_profiling(self, profiler):
+        """Get a Dispatcher that profiles a sample of handler invocations. See `HandlerProfiler`.
+
+        Any instrumentation this Dispatcher already has is kept.
+
+        :param profiler:    The `HandlerProfiler` to report to
+        """
+        if self._instrumentation is not None:
+            return self._derive(instrumentation=CompositeInstrumentation(self._instrumentation, profiler))
+        return self._derive(instrumentation=profiler)
+
+    def with_event_pool(self, pool=None):
+        """Get a Dispatcher that reuses Events for `call_pooled` dispatches.
+
+        :param pool:    The `EventPool` to use, or None for a new one
+        """
+        return self._derive(event_pool=pool if pool is not None else EventPool())
+
+    def with_error_sink(self, error_sink):
+        """Get a Dispatcher that hands anything raised by callables invoked from `emit` to the given sink.
+
+        :param error_sink:  Callable taking the callable that raised and the Exception it raised. Called from whichever
+                            thread the callable was run in. The default, `log_handler_error`, logs them.
+        """
+        return self._derive(error_sink=error_sink)
+
+    def with_deduplication(self, deduplicate=True):
+        """Get a Dispatcher that does (or doesn't) deduplicate callables matched through more than one key.
+
+        By default, a callable registered under several keys that all match the filter is only invoked once per
+        dispatch (at the highest priority it was registered with). Turn deduplication off to invoke it once per key.
+
+        :param deduplicate:     False to invoke callables once for every matching key they're registered under
+        """
+        return self._derive(deduplicate=deduplicate)
+
+    def with_journal(self, journal):
+        """Get a Dispatcher that appends every `call` and `call_pooled` dispatch to a journal before starting it.
+        See `wireworks.journal`.
+
+        Other kinds of dispatch (`emit`, `call_lazy`, `call_reduce`) aren't journaled.
+
+        :param journal:     The `Journal` to append to, or None to stop journaling
+        """
+        return self._derive(journal=journal)
+
+    def with_payload_views(self, enabled=True, share_min_size=64 * 1024):
+        """Get a Dispatcher that hands `bytes`, `bytearray` and `memoryview` arguments to handlers as read-only
+        memoryviews, without copying them. See `wireworks.payload`.
+
+        If the executor runs calls in other processes, buffers of at least `share_min_size` bytes are put in shared
+        memory once per dispatch, rather than being pickled once per handler. Shared memory isn't used by `emit` or
+        `call_lazy`.
+
+        :param enabled:         False to pass buffers to handlers as they are
+        :param share_min_size:  The smallest buffer, in bytes, worth putting in shared memory
+        """
+        if not enabled:
+            return self._derive(payload_views=None)
+
+        from wireworks.payload import PayloadViews
+        return self._derive(payload_views=PayloadViews(share_min_size))
+
+    def with_priority(self, priority):
+        """Get a Dispatcher that submits calls at the given priority, when its executor has priority lanes (see
+        `wireworks.util.priority_executor.PriorityExecutor`). Urgent calls then overtake bulk ones queued ahead of
+        them. Other executors run calls in the order they were submitted, whatever their priority.
+
+        The priority applies to every call, including calls to callables registered with a dispatch priority of their
+        own (see `Registry.register`).
+
+            >>> registry.with_executor(PriorityExecutor()).with_priority(HIGH).call(...)
+
+        :param priority:    The lane to submit calls in, or None to go back to the executor's default
+        """
+        return self._derive(priority=priority)
+
+    def with_coalescing(self, window=0, key_on_args=False):
+        """Get a Dispatcher that merges redundant calls into a single dispatch. See `CoalescingDispatcher`.
+
+        :param window:      Time in seconds after a dispatch starts during which further calls are merged into it
+        :param key_on_args: If True, only calls with equal arguments are merged
+        """
+        return CoalescingDispatcher(self._dispatcher_glob_dict, window=window, key_on_args=key_on_args,
+                                    **self._settings())
+
+    def _settings(self):
+        """The settings needed to build a Dispatcher that behaves like this one"""
+        return {'pattern': self._pattern, 'executor': self._executor, 'instrumentation': self._instrumentation,
+                'event_pool': self._event_pool, 'error_sink': self._error_sink, 'deduplicate': self._deduplicate,
+                'journal': self._journal, 'payload_views': self._payload_views, 'priority': self._priority}
+
+    def _derive(self, **changes):
+        """Make a new Dispatcher sharing this one's registry, with some of its settings changed"""
+        settings = self._settings()
+        settings.update(changes)
+        return Dispatcher(self._dispatcher_glob_dict, **settings)
+
+    def _get_executor(self):
+        if self._executor is None:
+            return get_default_executor()
+        if self._priority is not None and hasattr(self._executor, 'at_priority'):
+            return self._executor.at_priority(self._priority)
+        return self._executor
+
+    def _go(self, event, args, kwargs, journal=True):
+        """Start an Event's dispatch, journaling it first if this Dispatcher has a journal, and preparing any payloads
+        if it has payload views"""
+        if self._journal is None and self._payload_views is None:
+            event.go(*args, **kwargs)
+            return
+
+        sequence = None
+        if journal and self._journal is not None:
+            sequence = self._journal.append(self._pattern, args, kwargs)
+
+        release = None
+        if self._payload_views is not None:
+            (args, kwargs, release) = self._payload_views.prepare(args, kwargs, runs_out_of_process(self._executor))
+
+        try:
+            event.go(*args, **kwargs)
+        finally:
+            if release is not None:
+                event.when_done(release)
+
+        if sequence is not None:
+            self._journal.track(sequence, event)
+
+    def _new_event(self, event_type, *event_args):
+        """Make a new, not yet started, Event of the given type for all matching callables"""
+        return event_type(self._all_matching_callables(), self._get_executor(), *event_args, pattern=self._pattern,
+                          instrumentation=self._instrumentation)
 
     def _all_matching_callables(self):
-        refs = [item for this_set in self._dispatcher_glob_dict.glob(self._pattern) for item in this_set]
-        potential_callables = [item.get_callable() for item in refs]
-        return [real_callable for real_callable in potential_callables if real_callable]
\ No newline at end of file
+        started = _clock() if self._instrumentation is not None else None
+
+        plan = _deduplicated_plan if self._deduplicate else _per_key_plan
+        refs = self._dispatcher_glob_dict.glob_derived(self._pattern, plan)
+        potential_callables = [Handler.for_reference(item) for item in refs]
+        real_callables = [real_callable for real_callable in potential_callables if real_callable]
+
+        if started is not None:
+            self._instrumentation.lookup_finished(self._pattern, _clock() - started)
+
+        return real_callables
+
+
+def _priority_of(reference):
+    return reference.get_priority()
+
+
+def _per_key_plan(ref_sets):
+    """Work out the references to dispatch to from the matching sets of references: all of them, in priority order.
+    The result is cached by the glob dict until any of the sets change."""
+    refs = [item for this_set in ref_sets for item in list(this_set)]
+    refs.sort(key=_priority_of, reverse=True)
+    return refs
+
+
+def _deduplicated_plan(ref_sets):
+    """As `_per_key_plan`, but with only the first (ie highest priority) reference to each callable"""
+    seen = set()
+    refs = []
+    for item in _per_key_plan(ref_sets):
+        identity = item.get_identity()
+        if identity not in seen:
+            seen.add(identity)
+            refs.append(item)
+    return refs
+
+
+def _unwrap(one_callable):
+    return one_callable.get_callable() if isinstance(one_callable, Handler) else one_callable
+
+
+class _Emission(object):
+    """A single call made by `Dispatcher.emit`, with anything raised handed to the error sink rather than stored"""
+    __slots__ = ('_callable', '_args', '_kwargs', '_error_sink', '_pattern', '_instrumentation', '_submitted')
+
+    def __init__(self, one_callable, args, kwargs, error_sink, pattern, instrumentation):
+        self._callable = one_callable
+        self._args = args
+        self._kwargs = kwargs
+        self._error_sink = error_sink
+        self._pattern = pattern
+        self._instrumentation = instrumentation
+        self._submitted = _clock() if instrumentation is not None else None
+
+    def __call__(self):
+        instrumentation = self._instrumentation
+        if instrumentation is None:
+            try:
+                self._callable(*self._args, **self._kwargs)
+            except Exception as e:
+                self._error_sink(_unwrap(self._callable), e)
+            return
+
+        handler = _unwrap(self._callable)
+        started = _clock()
+        token = instrumentation.handler_started(self._pattern, handler, started - self._submitted, self._args,
+                                                self._kwargs)
+        error = None
+        try:
+            self._callable(*self._args, **self._kwargs)
+        except Exception as e:
+            error = e
+            self._error_sink(handler, e)
+        finally:
+            instrumentation.handler_finished(self._pattern, handler, token, _clock() - started, error)
+            error = None
+
+
+class CoalescingDispatcher(Dispatcher):
+    """A Dispatcher that merges redundant calls into a single dispatch.
+
+    A call is merged into an earlier one with the same key if that earlier dispatch is still in progress, or if it
+    started less than `window` seconds ago. Merged callers are handed the earlier call's Event rather than a new one,
+    and their own arguments are dropped - so unless `key_on_args` is set, this is only suitable for events where any
+    one call is as good as another (cache invalidation, "config changed" notifications, and the like). A merged call
+    made while the earlier one is still submitting its callables waits for it to finish doing so, so the Event it's
+    handed always has every Future.
+
+    Calls are keyed on the filter pattern, and optionally on the call arguments. Calls with unhashable arguments are
+    never merged if `key_on_args` is set. Dispatchers derived from this one (`with_filter`, etc) keep coalescing, and
+    share its record of in-progress calls.
+    """
+    def __init__(self, glob_dict, window=0, key_on_args=False, coalesced=None, **settings):
+        super(CoalescingDispatcher, self).__init__(glob_dict, **settings)
+        self._window = window
+        self._key_on_args = key_on_args
+        self._coalesced = coalesced if coalesced is not None else _CoalescedCalls()
+
+    def call(self, *args, **kwargs):
+        key = self._pattern
+        if self._key_on_args:
+            key = (self._pattern, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return super(CoalescingDispatcher, self).call(*args, **kwargs)
+
+        (coalesced, merged) = self._coalesced.get_or_create(key, self._window,
+                                                            lambda: self._new_event(Event))
+        if merged:
+            coalesced.wait_started()
+            return coalesced.event
+
+        try:
+            self._go(coalesced.event, args, kwargs)
+        except BaseException:
+            self._coalesced.discard(key, coalesced)
+            raise
+        finally:
+            coalesced.started()
+
+        return coalesced.event
+
+    def _derive(self, **changes):
+        settings = self._settings()
+        settings.update(changes)
+        return CoalescingDispatcher(self._dispatcher_glob_dict, window=self._window, key_on_args=self._key_on_args,
+                                    coalesced=self._coalesced, **settings)
+
+
+class _CoalescedCalls(object):
+    """Internal record of recent dispatches for a `CoalescingDispatcher`, keyed by coalescing key"""
+    _MIN_PRUNE_SIZE = 64
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+        self._prune_size = self._MIN_PRUNE_SIZE
+
+    def get_or_create(self, key, window, event_factory):
+        """Get the call any call with this key should be merged into, or create one if there isn't one. A newly
+        created call must be marked as started (see `_CoalescedCall.started`) once its dispatch has been.
+
+        :return:    A tuple of (`_CoalescedCall`, merged), where merged is False if the call was newly created
+        """
+        now = _clock()
+        with self._lock:
+            entry = self._calls.get(key)
+            if entry and entry.is_live(now, window):
+                return entry, True
+
+            entry = _CoalescedCall(event_factory(), now, window)
+            self._calls[key] = entry
+
+            if len(self._calls) >= self._prune_size:
+                self._prune(now)
+
+        return entry, False
+
+    def discard(self, key, entry):
+        """Forget a call whose dispatch couldn't be started, so that later calls aren't merged into it"""
+        with self._lock:
+            if self._calls.get(key) is entry:
+                del self._calls[key]
+
+    def _prune(self, now):
+        """Drop any entries that can no longer be merged into. Must be called with the lock held."""
+        self._calls = dict((key, entry) for key, entry in self._calls.items() if entry.is_live(now, entry.window))
+        self._prune_size = max(self._MIN_PRUNE_SIZE, 2 * len(self._calls))
+
+
+class _CoalescedCall(object):
+    """Internal record of a single dispatch for a `CoalescingDispatcher`, which later calls may be merged into"""
+    __slots__ = ('event', 'created', 'window', '_dispatching_thread', '_started')
+
+    def __init__(self, event, created, window):
+        self.event = event
+        self.created = created
+        self.window = window
+        self._dispatching_thread = current_thread()
+        self._started = ThreadingEvent()
+
+    def is_live(self, now, window):
+        return not self.event.done() or now - self.created < window
+
+    def started(self):
+        """Note that the Event's dispatch has been started (or has failed to start), waking any merged callers"""
+        self._started.set()
+
+    def wait_started(self):
+        """Wait for the Event's dispatch to be started. Calls merged in from the dispatching thread itself - by a
+        handler run synchronously - don't wait, as the dispatch can't finish starting until they return."""
+        if current_thread() is not self._dispatching_thread:
+            self._started.wait()
@@ -1,10 +1,20 @@
 __author__ = 'rob'
 
 import time
+import weakref
 
-from concurrent.futures import wait as futures_wait, FIRST_COMPLETED, ALL_COMPLETED
+from collections import deque
+from functools import partial
+from threading import Condition, RLock
 
-from wireworks.util.static_functions import set_current_event, clear_current_event
+from wireworks.handler import Handler
+from wireworks.payload import call_with_payloads
+from wireworks.tracing import start_trace
+from wireworks.util.rate_limiter import CallRejected
+from wireworks.util.static_functions import set_current_event, clear_current_event, get_current_event, \
+    run_in_copied_context, runs_out_of_process
+
+_clock = getattr(time, 'monotonic', time.time)
 
 
 class Event(object):
@@ -15,15 +25,48 @@ class Event(object):
 
     Alternatively, there are various convienience methods to handle some of the common cases. Unless otherwise
     specified, these methods will filter out cancelled methods.
+
+    The pattern and instrumentation are optional, and only used to report on the dispatch. See `Instrumentation`.
+
+    The event that was current when this one was created (if any) is recorded as its parent, so cascades of events
+    can be traced. See `wireworks.tracing`. Only a weak reference to the parent is kept, so an Event that's held on to
+    doesn't keep its parent's Futures and results alive.
+
+    Nothing a Future holds on to (its done callbacks, or the traceback of an Exception it was completed with) leads
+    back to the Event, so a finished dispatch leaves no reference cycles behind for the garbage collector to find. The
+    one exception is a callable raising when run synchronously, in the dispatching thread: the traceback then keeps
+    the dispatching frames (and so the Event) alive.
+
+    Executors that run calls in other processes (eg `ProcessPoolExecutor`) are sent the bare callable and its
+    arguments, all of which need to be picklable. Such calls don't have a current event, aren't reported to the
+    instrumentation, and bypass result caches.
+
+    An Event can be waited on, cancelled or inspected from any thread, with or without the GIL. Only the thread running
+    `go` adds to its lists (a LazyEvent does so with its lock held), and other threads only read them through single
+    operations on builtin lists, which are atomic either way. Anything that needs more than one step, such as counting
+    down outstanding Futures, takes a lock of its own.
     """
-    def __init__(self, calls, executor):
+    def __init__(self, calls, executor, pattern=None, instrumentation=None):
+        self._futures = []
+        self._unexecuted = []
+        self._reset(calls, executor, pattern, instrumentation)
+
+    def _reset(self, calls, executor, pattern, instrumentation):
+        """Set the Event up for a new dispatch, reusing its lists. See `EventPool`."""
         self._calls = calls
         self._executor = executor
+        self._out_of_process = runs_out_of_process(executor)
+        self._pattern = pattern
+        self._instrumentation = instrumentation
+        parent = get_current_event()
+        self._parent = weakref.ref(parent) if parent is not None else None
+        self._trace = None
+        self._completion = _Completion()
         self._cancelled = False
         self._dispatch_started = False
-        self._futures = []
-        self._completed_futures = []
-        self._unexecuted = []
+        self._dispatch_finished = False
+        del self._futures[:]
+        del self._unexecuted[:]
 
     def go(self, *args, **kwargs):
         """Starts all pending calls for the registered event.
@@ -37,22 +80,21 @@ class Event(object):
             raise ValueError("The dispatch has already started.")
 
         self._dispatch_started = True
+        self._start_trace()
+        started = _clock() if self._instrumentation is not None else None
 
         for one_callable in self._calls:
             if self._cancelled:
                 self._unexecuted.append(one_callable)
                 continue
 
-            def shim():
-                set_current_event(self)
-                try:
-                    return one_callable(*args, **kwargs)
-                finally:
-                    clear_current_event()
+            self._submit(one_callable, args, kwargs)
 
-            future = self._executor.submit(shim)
-            future.add_done_callback(self._handle_complete)
-            self._futures.append(future)
+        if started is not None:
+            self._instrumentation.dispatch_finished(self._pattern, len(self._calls), _clock() - started)
+
+        self._dispatch_finished = True
+        self._all_submitted()
 
         return self
 
@@ -67,6 +109,40 @@ class Event(object):
 
         [future.cancel() for future in self._futures]
 
+    def done(self):
+        """Check whether the dispatch has started, and every Future known to this Event has completed.
+
+        :return:    True if there's nothing left in progress
+        """
+        return self._dispatch_finished and all(future.done() for future in self._futures)
+
+    def when_done(self, callback):
+        """Call the given callback (with no arguments) once every callable submitted so far has completed - or right
+        away, if they already have. Only use this once the dispatch has been started.
+
+        :param callback:    The callable to call. Called from whichever thread completes the last Future.
+        """
+        if self.done():
+            callback()
+            return
+
+        self._completion.when_done(callback)
+
+    def get_parent(self):
+        """Get the event that was current when this one was created - ie, the event whose handler dispatched this one.
+
+        :return:    The parent Event, or None if this Event wasn't dispatched from a handler (or the parent has since
+                    been garbage collected)
+        """
+        return self._parent() if self._parent is not None else None
+
+    def get_trace_span(self):
+        """Get the span reported to the tracer for this Event.
+
+        :return:    The span, or None if tracing was off when the dispatch started
+        """
+        return self._trace.span if self._trace is not None else None
+
     def get_all_futures(self):
         """Get a list of all Futures known to this Event.
 
@@ -77,9 +153,19 @@ class Event(object):
     def get_completed_futures(self):
         """Get all Futures that have currently completed, one way or another.
 
-        :return:    The list of completed Futures
+        :return:    The list of completed Futures, in the order they completed
+        """
+        futures = self._futures
+        return [futures[index] for index in self._completion.get_completed()]
+
+    def get_rejected_futures(self):
+        """Get the Futures of calls that were shed by a rate limit rather than made. Each is completed with a
+        `CallRejected`. See `Registry.limit`.
+
+        :return:    The list of rejected Futures
         """
-        return self._completed_futures
+        return [future for future in self._futures
+                if future.done() and not future.cancelled() and isinstance(future.exception(), CallRejected)]
 
     def first_result(self, timeout=None):
         """Await, and return, the first result from the set of known futures.
@@ -89,16 +175,44 @@ class Event(object):
         :param timeout: Amount of time to wait in seconds before giving up and returning what we got until then
         :return:        The value returned by the first future to finish, or None if no futures completed successfully
         """
+        from concurrent.futures import wait as futures_wait, FIRST_COMPLETED
+
         possible = self._futures
         remaining = timeout
         started = time.time()
 
-        while possible and remaining >= 0:
-            (done, possible) = futures_wait(self._futures, timeout=remaining, return_when=FIRST_COMPLETED)
-            remaining = timeout - (time.time() - started)
+        while possible and (remaining is None or remaining >= 0):
+            (done, possible) = futures_wait(possible, timeout=remaining, return_when=FIRST_COMPLETED)
+            if timeout is not None:
+                remaining = timeout - (time.time() - started)
             for future in done:
                 if not future.cancelled():
                     return future.result(0)
+            if not done:
+                break
+
+        return None
+
+    def first_matching(self, predicate, timeout=None):
+        """Await, and return, the first result that satisfies the given predicate.
+
+        Results are checked in the order their Futures complete. As with `first_result`, if an Exception was thrown
+        by a completed Future, this will be thrown instead.
+
+        :param predicate:   Callable taking a single result, returning True if it's the one we're after
+        :param timeout:     Amount of time to wait in seconds before giving up and returning None
+        :return:            The first matching result, or None if nothing matched before we ran out of Futures/time
+        """
+        from concurrent.futures import as_completed, TimeoutError
+
+        try:
+            for future in as_completed(self._futures, timeout=timeout):
+                if not future.cancelled():
+                    result = future.result(0)
+                    if predicate(result):
+                        return result
+        except TimeoutError:
+            pass
 
         return None
 
@@ -113,9 +227,659 @@ class Event(object):
         :param timeout: Amount of time to wait in seconds before giving up and returning what we got until then
         :return:        All futures that have completed and were not cancelled
         """
+        from concurrent.futures import wait as futures_wait, ALL_COMPLETED
+
         (done, possible) = futures_wait(self._futures, timeout=timeout, return_when=ALL_COMPLETED)
         return [future for future in done if not future.cancelled()]
 
-    def _handle_complete(self, future):
-        """Internal callback to handle completing futures"""
-        self._completed_futures.append(future)
\ No newline at end of file
+    def _submit(self, one_callable, args, kwargs):
+        """Submit a single callable to the executor, keeping track of the Future it gives us back"""
+        admission = None
+        if isinstance(one_callable, Handler):
+            (future, admission) = one_callable.try_short_circuit(args, kwargs)
+            if future is not None:
+                self._track(future)
+                return future
+            one_callable = admission
+            executor = admission.executor_for(self._executor)
+        else:
+            executor = self._executor
+
+        if self._out_of_process:
+            unwrapped = admission.get_callable() if admission is not None else one_callable
+            future = executor.submit(call_with_payloads, unwrapped, args, kwargs)
+        else:
+            if self._instrumentation is not None:
+                invocation = _InstrumentedInvocation(self, one_callable, args, kwargs)
+            else:
+                invocation = _Invocation(self, one_callable, args, kwargs)
+
+            future = executor.submit(run_in_copied_context(invocation))
+
+        if admission is not None:
+            admission.submitted(future)
+        self._track(future)
+
+        return future
+
+    def _track(self, future):
+        """Keep track of a newly submitted Future"""
+        self._futures.append(future)
+        self._completion.track(future)
+
+    def _start_trace(self):
+        """Start tracing this Event's dispatch, if tracing is on"""
+        parent = self.get_parent()
+        self._trace = start_trace(self._pattern, parent._trace if parent is not None else None)
+
+    def _all_submitted(self):
+        """Note that nothing more will be submitted, so the trace can be finished once everything has completed"""
+        self._completion.all_submitted()
+        if self._trace is not None:
+            self._completion.when_done(self._trace.finish)
+
+
+class LazyEvent(Event):
+    """An Event that only invokes its callables as their results are asked for.
+
+    Where a normal Event submits every callable as soon as `go` is called, a LazyEvent submits them one at a time,
+    in order, as the results are consumed - either by iterating over the Event or by using `first_result` or
+    `first_matching`. Callables that are never needed are never invoked, which makes this a good fit for
+    "ask each handler in turn until one of them knows the answer" style dispatches. Pair it with handler priorities
+    so that the cheapest or most authoritative handlers are asked first.
+
+    Iterating over the Event yields the result of each callable in turn. As with `first_result`, if a callable threw
+    an Exception, it's raised from the iterator instead.
+    """
+    def __init__(self, calls, executor, pattern=None, instrumentation=None):
+        super(LazyEvent, self).__init__(calls, executor, pattern, instrumentation)
+        self._lock = RLock()
+        self._pending = deque()
+        self._args = ()
+        self._kwargs = {}
+
+    def go(self, *args, **kwargs):
+        """Prepares the Event for dispatch, without actually invoking anything.
+
+        Callables are invoked on demand as results are requested. If called more than once, subsequent invocations
+        will cause a ValueError to happen.
+
+        :param args:    The set of args to pass to each callable
+        :param kwargs:  The set of kwargs to pass to each callable.
+        """
+        with self._lock:
+            if self._dispatch_started:
+                raise ValueError("The dispatch has already started.")
+
+            self._dispatch_started = True
+            self._args = args
+            self._kwargs = kwargs
+            self._pending.extend(self._calls)
+            self._dispatch_finished = True
+            self._start_trace()
+            if not self._pending:
+                self._all_submitted()
+
+        return self
+
+    def __iter__(self):
+        for future in self._iter_futures():
+            if not future.cancelled():
+                yield future.result()
+
+    def try_cancel_pending_calls(self):
+        """Attempt to cancel all pending calls, where possible.
+
+        Any callables that haven't been invoked yet never will be.
+        """
+        with self._lock:
+            super(LazyEvent, self).try_cancel_pending_calls()
+            self._unexecuted.extend(self._pending)
+            self._pending.clear()
+            self._all_submitted()
+
+    def done(self):
+        """Check whether the dispatch has started, and every callable that's going to be invoked has completed.
+
+        :return:    True if there's nothing left in progress
+        """
+        with self._lock:
+            return not self._pending and super(LazyEvent, self).done()
+
+    def first_result(self, timeout=None):
+        """Invoke callables in turn until one of them returns, and return that result.
+
+        If an Exception was thrown by the callable, this will be thrown instead.
+
+        :param timeout: Amount of time to wait in seconds before giving up and returning None
+        :return:        The value returned by the first callable to finish, or None if nothing completed successfully
+        """
+        return self.first_matching(lambda _: True, timeout)
+
+    def first_matching(self, predicate, timeout=None):
+        """Invoke callables in turn until one of them returns a result satisfying the given predicate.
+
+        If an Exception was thrown by a callable, this will be thrown instead.
+
+        :param predicate:   Callable taking a single result, returning True if it's the one we're after
+        :param timeout:     Amount of time to wait in seconds before giving up and returning None
+        :return:            The first matching result, or None if nothing matched before we ran out of callables/time
+        """
+        from concurrent.futures import TimeoutError
+
+        started = time.time()
+
+        for future in self._iter_futures():
+            remaining = None
+            if timeout is not None:
+                remaining = max(0, timeout - (time.time() - started))
+
+            try:
+                if future.cancelled():
+                    continue
+                result = future.result(remaining)
+            except TimeoutError:
+                return None
+
+            if predicate(result):
+                return result
+
+        return None
+
+    def await_all(self, timeout=None):
+        """Invoke all remaining callables, and await their completion.
+
+        See `Event.await_all`.
+        """
+        while self._submit_next():
+            pass
+
+        return super(LazyEvent, self).await_all(timeout)
+
+    def _iter_futures(self):
+        """Yield each Future in order, submitting the next callable only once the previous Future has been consumed"""
+        index = 0
+        while True:
+            with self._lock:
+                if index < len(self._futures):
+                    future = self._futures[index]
+                else:
+                    future = self._submit_next()
+
+            if not future:
+                return
+
+            yield future
+            index += 1
+
+    def _submit_next(self):
+        """Submit the next pending callable, returning its Future, or None if there's nothing left to submit"""
+        with self._lock:
+            if self._cancelled or not self._pending:
+                return None
+
+            future = self._submit(self._pending.popleft(), self._args, self._kwargs)
+            if not self._pending:
+                self._all_submitted()
+
+            return future
+
+
+class ReducingEvent(Event):
+    """An Event that folds each result into a single value as it completes.
+
+    This is intended for aggregation-style dispatches (eg collecting something from every wired instance), where
+    holding onto a Future per callable until everything has finished would be wasteful. Results are passed to the
+    reducer as soon as they're available - along with the value accumulated so far - and then dropped, so memory use
+    stays flat regardless of the number of callables. The reducer is never called concurrently, so it doesn't need to
+    be threadsafe itself.
+
+    As no Futures are kept, `get_all_futures`, `get_completed_futures` and `await_all` always return empty lists. Use
+    `result` to wait for the reduced value, and `get_exceptions` to find out about anything that went wrong.
+    """
+    def __init__(self, calls, executor, reducer, initial=None, pattern=None, instrumentation=None):
+        super(ReducingEvent, self).__init__(calls, executor, pattern, instrumentation)
+        self._completion = self._reduction = _Reduction(reducer, initial)
+
+    def go(self, *args, **kwargs):
+        """Starts all pending calls for the registered event. See `Event.go`."""
+        try:
+            return super(ReducingEvent, self).go(*args, **kwargs)
+        finally:
+            self._reduction.all_submitted()
+
+    def result(self, timeout=None):
+        """Await the completion of all calls, and return the reduced value.
+
+        :param timeout: Amount of time to wait in seconds before giving up and returning the value reduced so far
+        :return:        The value returned by the final reducer call, or the initial value if nothing completed
+        """
+        return self._reduction.wait(timeout)
+
+    def done(self):
+        """Check whether every submitted call has completed (and been reduced).
+
+        :return:    True if the reduced value is final
+        """
+        return self._reduction.done()
+
+    def get_exceptions(self):
+        """Get any Exceptions thrown by callables (or the reducer) so far.
+
+        :return:    The list of Exceptions
+        """
+        return self._reduction.get_exceptions()
+
+    def _track(self, future):
+        """Fold the Future's result in once it completes, rather than holding on to it"""
+        self._reduction.track(future)
+
+
+class EventPool(object):
+    """A pool of Events to be reused for fire-and-forget dispatches. See `Dispatcher.call_pooled`.
+
+    An Event goes back to the pool once every one of its callables has completed, and is reset and reused for a later
+    dispatch - so nothing outside the pool may hang on to a pooled Event. Idle Events are kept empty, so they don't
+    hold on to any results. The pool is threadsafe.
+
+    :param max_size:    Maximum number of idle Events to keep. Any more are simply dropped.
+    """
+    def __init__(self, max_size=64):
+        self._max_size = max_size
+        self._idle = deque()
+
+    def __len__(self):
+        return len(self._idle)
+
+    def acquire(self, calls, executor, pattern=None, instrumentation=None):
+        """Get an Event ready for dispatch, reusing an idle one if there is one.
+
+        :return:    The Event, which hasn't been started yet
+        """
+        try:
+            event = self._idle.pop()
+        except IndexError:
+            return Event(calls, executor, pattern, instrumentation)
+
+        event._reset(calls, executor, pattern, instrumentation)
+        return event
+
+    def release_when_done(self, event):
+        """Put an Event back in the pool once all its callables have completed (or right away, if they already have).
+
+        :param event:   An Event from `acquire`, whose dispatch has been started
+        """
+        event.when_done(lambda: self._release(event))
+
+    def _release(self, event):
+        event._reset((), None, None, None)
+        event._parent = None
+        if len(self._idle) < self._max_size:
+            self._idle.append(event)
+
+
+class EventGroup(object):
+    """Waits on the calls of any number of dispatched Events at once.
+
+    Waiting on hundreds of Events one at a time means a wait (and a scan of the Futures) per Event. A group instead
+    keeps a single count of the calls still outstanding across all of them, and a record of the order calls complete
+    in, each updated in constant time as a call completes - so waiting for everything, for the first few calls, or
+    for each call as it completes is one wait on one condition, however many Events there are.
+
+        >>> group = EventGroup(dispatcher.call(order) for order in orders)
+        >>> for future in group.as_completed(timeout=5):
+        ...     ...
+
+    Only the calls an Event has submitted when it's added are waited on, so add Events once their dispatch has started.
+    A `LazyEvent` only has the calls it's made so far, and a `ReducingEvent` keeps no Futures at all. As with an Event,
+    cancelled Futures are left out of anything the group hands back. The group is threadsafe: Events can be added
+    while other threads wait.
+
+    :param events:  Events to add to the group to start with
+    """
+    def __init__(self, events=()):
+        self._events = []
+        self._futures = []
+        self._completion = _GroupCompletion()
+        for event in events:
+            self.add(event)
+
+    def __len__(self):
+        return len(self._futures)
+
+    def add(self, event):
+        """Add an Event's calls to the group.
+
+        :param event:   A dispatched Event
+        :return:        The Event
+        """
+        self._events.append(event)
+        for future in list(event.get_all_futures()):
+            self._completion.track(self._futures, future)
+
+        return event
+
+    def get_all_futures(self):
+        """Get the Futures of every call in the group, in the order they were added.
+
+        :return:    The list of Futures
+        """
+        return list(self._futures)
+
+    def get_completed_count(self):
+        """Get the number of calls in the group that have completed (including any that were cancelled).
+
+        :return:    The count
+        """
+        return self._completion.get_completed_count()
+
+    def done(self):
+        """Check whether every call in the group has completed.
+
+        :return:    True if there's nothing left in progress
+        """
+        return self._completion.get_completed_count() == len(self._futures)
+
+    def try_cancel_pending_calls(self):
+        """Attempt to cancel the pending calls of every Event in the group. See `Event.try_cancel_pending_calls`."""
+        for event in list(self._events):
+            event.try_cancel_pending_calls()
+
+    def wait_all(self, timeout=None):
+        """Await the completion of every call in the group.
+
+        :param timeout: Amount of time to wait in seconds before giving up and returning what we got until then
+        :return:        All Futures that have completed and were not cancelled, in the order they completed
+        """
+        self._completion.wait(_deadline(timeout), None)
+        return self._in_completion_order(self._completion.get_completed(), None)
+
+    def wait_any(self, count=1, timeout=None):
+        """Await the completion of the first `count` calls in the group (or every call, if there are fewer).
+
+        :param count:   The number of completed calls to wait for. Cancelled calls don't count.
+        :param timeout: Amount of time to wait in seconds before giving up and returning what we got until then
+        :return:        Up to `count` Futures that have completed and were not cancelled, in the order they completed
+        """
+        self._completion.wait(_deadline(timeout), count)
+        return self._in_completion_order(self._completion.get_completed(), count)
+
+    def as_completed(self, timeout=None):
+        """Iterate over the Futures of the group's calls as they complete, as `concurrent.futures.as_completed` does.
+        Calls in Events added while iterating are included.
+
+        :param timeout: Amount of time in seconds the whole iteration may take
+        :return:        An iterator over the Futures that weren't cancelled, in the order they completed
+        :raises:        concurrent.futures.TimeoutError if the time runs out before every call has completed
+        """
+        deadline = _deadline(timeout)
+        position = 0
+        while True:
+            completed = self._completion.wait_past(position, deadline)
+            if completed is None:
+                return
+            if not completed:
+                from concurrent.futures import TimeoutError
+                raise TimeoutError("%d (of %d) calls not completed" % (len(self._futures) - position,
+                                                                        len(self._futures)))
+
+            position += len(completed)
+            for future in self._in_completion_order(completed, None):
+                yield future
+
+    def _in_completion_order(self, indexes, count):
+        futures = []
+        for index in indexes:
+            future = self._futures[index]
+            if not future.cancelled():
+                futures.append(future)
+                if count is not None and len(futures) >= count:
+                    break
+
+        return futures
+
+
+class _Invocation(object):
+    """A single call of a callable, as submitted to the executor.
+
+    The callable is run with its event set as the current one. The reference to the event is dropped as soon as the
+    call starts, so that the traceback of anything it raises (which its Future keeps, and the event keeps the Future)
+    doesn't lead back to the event.
+    """
+    __slots__ = ('_event', '_callable', '_args', '_kwargs')
+
+    def __init__(self, event, one_callable, args, kwargs):
+        self._event = event
+        self._callable = one_callable
+        self._args = args
+        self._kwargs = kwargs
+
+    def __call__(self):
+        token = set_current_event(self._event)
+        self._event = None
+        try:
+            return self._callable(*self._args, **self._kwargs)
+        finally:
+            clear_current_event(token)
+
+
+class _InstrumentedInvocation(_Invocation):
+    """An `_Invocation` that reports the queue wait and run time of the callable to the event's instrumentation"""
+    __slots__ = ('_instrumentation', '_pattern', '_handler', '_submitted')
+
+    def __init__(self, event, one_callable, args, kwargs):
+        super(_InstrumentedInvocation, self).__init__(event, one_callable, args, kwargs)
+        self._instrumentation = event._instrumentation
+        self._pattern = event._pattern
+        self._handler = one_callable.get_callable() if isinstance(one_callable, Handler) else one_callable
+        self._submitted = _clock()
+
+    def __call__(self):
+        started = _clock()
+        token = self._instrumentation.handler_started(self._pattern, self._handler, started - self._submitted,
+                                                      self._args, self._kwargs)
+        error = None
+        try:
+            return super(_InstrumentedInvocation, self).__call__()
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._instrumentation.handler_finished(self._pattern, self._handler, token, _clock() - started, error)
+            # this frame ends up in the exception's traceback, so it mustn't keep the exception itself
+            error = None
+
+
+class _Completion(object):
+    """Internal count of the Futures an event is waiting on, so that something can be done once they've all completed,
+    and record of the order they complete in.
+
+    Kept separate from the event itself (and without holding on to any Futures) so that the done callbacks of
+    Futures don't lead back to the event. As with `_GroupCompletion`, Futures are known by the order they were
+    tracked in, which is their index in the event's list of them.
+    """
+    def __init__(self):
+        self._outstanding = 0
+        self._tracked = 0
+        self._completed_indexes = []
+        self._submitting = True
+        self._done_callbacks = []
+        self._condition = Condition(RLock())
+
+    def track(self, future):
+        """Wait for a newly submitted Future to complete"""
+        with self._condition:
+            index = self._tracked
+            self._tracked += 1
+            self._outstanding += 1
+        future.add_done_callback(partial(self.complete, index))
+
+    def all_submitted(self):
+        """Note that nothing more will be tracked. Only the first call does anything."""
+        callbacks = ()
+        with self._condition:
+            if self._submitting:
+                self._submitting = False
+                self._condition.notify_all()
+                callbacks = self._take_done_callbacks()
+
+        for callback in callbacks:
+            callback()
+
+    def complete(self, index, future):
+        with self._condition:
+            try:
+                self._completed(index, future)
+            finally:
+                self._outstanding -= 1
+                self._condition.notify_all()
+                callbacks = self._take_done_callbacks()
+
+        for callback in callbacks:
+            callback()
+
+    def _completed(self, index, future):
+        """Called for each Future as it completes, with the lock held"""
+        self._completed_indexes.append(index)
+
+    def get_completed(self):
+        """Get the indexes of completed Futures, in the order they completed"""
+        with self._condition:
+            return list(self._completed_indexes)
+
+    def when_done(self, callback):
+        """Call the given callback once everything has completed (or right away, if it already has)"""
+        with self._condition:
+            self._done_callbacks.append(callback)
+            callbacks = self._take_done_callbacks()
+
+        for callback in callbacks:
+            callback()
+
+    def _take_done_callbacks(self):
+        """If everything has completed, hand back the done callbacks (once). Must be called with the lock held."""
+        if self._submitting or self._outstanding or not self._done_callbacks:
+            return ()
+
+        callbacks = self._done_callbacks
+        self._done_callbacks = []
+        return callbacks
+
+    def done(self):
+        with self._condition:
+            return not self._submitting and self._outstanding == 0
+
+
+class _Reduction(_Completion):
+    """Internal accumulator state for a `ReducingEvent`.
+
+    Kept separate from the event itself so that the done callbacks of in-flight Futures don't hold the event alive.
+    """
+    def __init__(self, reducer, initial):
+        super(_Reduction, self).__init__()
+        self._reducer = reducer
+        self._value = initial
+        self._exceptions = []
+
+    def _completed(self, index, future):
+        try:
+            if future.cancelled():
+                pass
+            elif future.exception() is not None:
+                self._exceptions.append(future.exception())
+            else:
+                self._value = self._reducer(self._value, future.result())
+        except Exception as e:
+            self._exceptions.append(e)
+
+    def wait(self, timeout=None):
+        started = time.time()
+        with self._condition:
+            while self._submitting or self._outstanding:
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.time() - started)
+                    if remaining <= 0:
+                        break
+                self._condition.wait(remaining)
+
+            return self._value
+
+    def get_exceptions(self):
+        with self._condition:
+            return list(self._exceptions)
+
+
+class _GroupCompletion(object):
+    """Internal record of the calls an `EventGroup` is waiting on, and of the order they complete in.
+
+    Calls are known by their index in the group's list of Futures, rather than by their Future, so that the done
+    callbacks of Futures don't lead back to the Futures (or to the group).
+    """
+    def __init__(self):
+        self._outstanding = 0
+        self._completed = []
+        self._succeeded = 0
+        self._condition = Condition()
+
+    def track(self, futures, future):
+        """Add a Future to a group's list of them, and wait for it to complete"""
+        with self._condition:
+            index = len(futures)
+            futures.append(future)
+            self._outstanding += 1
+        future.add_done_callback(partial(self._complete, index))
+
+    def _complete(self, index, future):
+        cancelled = future.cancelled()
+        with self._condition:
+            self._completed.append(index)
+            self._outstanding -= 1
+            if not cancelled:
+                self._succeeded += 1
+            self._condition.notify_all()
+
+    def get_completed_count(self):
+        return len(self._completed)
+
+    def get_completed(self):
+        """Get the indexes of completed Futures, in the order they completed"""
+        with self._condition:
+            return list(self._completed)
+
+    def wait(self, deadline, count):
+        """Wait until every call has completed (or `count` of them weren't cancelled), or the deadline passes"""
+        with self._condition:
+            while self._outstanding and (count is None or self._succeeded < count):
+                if not self._wait_until(deadline):
+                    return
+
+    def wait_past(self, position, deadline):
+        """Wait until more than `position` calls have completed, or the deadline passes. Returns the indexes of the
+        Futures that completed after the first `position` (empty if the deadline passed first), or None if there are
+        no more to come."""
+        with self._condition:
+            while len(self._completed) <= position:
+                if not self._outstanding:
+                    return None
+                if not self._wait_until(deadline):
+                    break
+
+            return self._completed[position:]
+
+    def _wait_until(self, deadline):
+        """Wait to be notified, unless the deadline has passed. Must be called with the lock held."""
+        if deadline is None:
+            self._condition.wait()
+            return True
+
+        remaining = deadline - _clock()
+        if remaining <= 0:
+            return False
+
+        self._condition.wait(remaining)
+        return True
+
+
+def _deadline(timeout):
+    return _clock() + timeout if timeout is not None else None
@@ -0,0 +1,253 @@
+__author__ = 'rob'
+
+from wireworks.util.circuit_breaker import CircuitOpen
+from wireworks.util.rate_limiter import CallRejected
+from wireworks.util.result_cache import make_key
+
+
+class Handler(object):
+    """A callable resolved from a registry reference, along with whatever it was wired with.
+
+    Dispatchers only wrap callables in one of these when their reference has something extra attached (a result
+    cache, rate limiters, a circuit breaker or a dispatch priority, for example). Plain callables go straight to the
+    executor, as they always have.
+
+    Events give a Handler the chance to short-circuit its call before it's submitted to the executor (eg to serve a
+    cached result, to shed a call its rate limiters won't admit, or to skip a call while its circuit breaker is open).
+    If it doesn't, the call is admitted, and its `Admission` is submitted in the Handler's place and told about the
+    Future it was given (see `Admission.submitted`). Everything particular to one call is kept on its Admission, as
+    the Handler itself may be shared by any number of dispatches at once.
+
+    A Handler can also be registered as a callable in its own right, when it needs to decide how every call is made
+    (see `wireworks.bus.RemoteHandler`). It's then handed to events as it is.
+    """
+    def __init__(self, fn, reference):
+        self._fn = fn
+        self._reference = reference
+
+    @staticmethod
+    def for_reference(reference):
+        """Resolve a reference into something that can be handed to an Event.
+
+        :param reference:   The callable reference to resolve
+        :return:            A Handler if the reference needs one, the bare callable if not, or None if the callable is
+                            no longer valid for calling
+        """
+        fn = reference.get_callable()
+        if not fn:
+            return None
+
+        if isinstance(fn, Handler) or (reference.get_cache() is None and not reference.get_limiters() and
+                                       reference.get_circuit_breaker() is None and
+                                       reference.get_dispatch_priority() is None):
+            return fn
+
+        return Handler(fn, reference)
+
+    def get_callable(self):
+        """Get the callable being handled.
+
+        :return:    The callable
+        """
+        return self._fn
+
+    def get_reference(self):
+        """Get the reference this Handler was resolved from.
+
+        :return:    The callable reference
+        """
+        return self._reference
+
+    def executor_for(self, executor):
+        """Pick the executor to submit the call to: if the reference was registered with a dispatch priority, and the
+        executor has priority lanes (see `PriorityExecutor.at_priority`), the lane for that priority.
+
+        :param executor:    The executor the call would otherwise be submitted to
+        :return:            The executor to submit the call to
+        """
+        priority = self._reference.get_dispatch_priority() if self._reference is not None else None
+        if priority is None or not hasattr(executor, 'at_priority'):
+            return executor
+
+        return executor.at_priority(priority)
+
+    def try_short_circuit(self, args, kwargs):
+        """Try to complete the call without actually invoking the callable, admitting it if not.
+
+        :param args:    The args the callable would be invoked with
+        :param kwargs:  The kwargs the callable would be invoked with
+        :return:        A tuple of a completed Future and None if the call was short-circuited, otherwise of None and
+                        the `Admission` to submit in the Handler's place
+        """
+        cache_key = None
+        cache = self._reference.get_cache()
+        if cache is not None:
+            cache_key = make_key(args, kwargs)
+            if cache_key is not None:
+                (hit, value) = cache.lookup(cache_key)
+                if hit:
+                    return _completed_future(value), None
+
+        admission = self.admit(cache_key)
+        rejection = admission.get_rejection()
+        if rejection is not None:
+            return _completed_future(error=rejection), None
+
+        fallback = admission.get_fallback()
+        if fallback is not None:
+            try:
+                return _completed_future(fallback(*args, **kwargs)), None
+            except Exception as e:
+                return _completed_future(error=e), None
+
+        return None, admission
+
+    def admit(self, cache_key=None):
+        """Check a call against the reference's circuit breaker and rate limiters. A call that's admitted must be
+        released (see `Admission.release`) once it's completed, which calling its Admission does.
+
+        While the circuit breaker is open, a breaker with a fallback admits the call to the fallback instead, without
+        checking the rate limiters.
+
+        :param cache_key:   The key to store the call's result in the reference's result cache under, if any
+        :return:            The call's `Admission`. If the call was shed, its `get_rejection` gives the `CallRejected`
+                            to complete it with (a `CircuitOpen` if it was skipped because the breaker was open).
+        """
+        if self._reference is None:
+            return Admission(self)
+
+        breaker = self._reference.get_circuit_breaker()
+        permit = None
+        if breaker is not None:
+            permit = breaker.try_acquire()
+            if not permit:
+                if breaker.get_fallback() is None:
+                    return Admission(self, rejection=CircuitOpen(breaker))
+                return Admission(self, fallback=breaker.get_fallback())
+
+        taken = []
+        for limiter in self._reference.get_limiters():
+            reason = limiter.try_acquire()
+            if reason is not None:
+                for admitted_by in taken:
+                    admitted_by.release()
+                if breaker is not None:
+                    breaker.abandon(permit)
+                return Admission(self, rejection=CallRejected(limiter, reason))
+            if limiter.tracks_pending():
+                taken.append(limiter)
+
+        return Admission(self, breaker=breaker, permit=permit, pending=taken, cache_key=cache_key)
+
+    def __call__(self, *args, **kwargs):
+        # called directly (eg by Dispatcher.emit), rather than through an Admission
+        admission = self.admit()
+        rejection = admission.get_rejection()
+        if rejection is not None:
+            raise rejection
+
+        return admission(*args, **kwargs)
+
+
+class Admission(Handler):
+    """A single call admitted by a Handler (see `Handler.admit`), holding everything particular to it: the rate limiters
+    it holds a place with, the circuit breaker to record its outcome with, and where to cache its result. Calling it
+    makes the call.
+
+    :param handler:     The Handler that admitted the call
+    :param rejection:   The `CallRejected` the call was shed with, if it was
+    :param fallback:    The circuit breaker's fallback, to make the call with instead, if the breaker was open
+    :param breaker:     The circuit breaker to record the call's outcome with
+    :param permit:      The permit the circuit breaker let the call through with
+    :param pending:     The rate limiters to release once the call's completed
+    :param cache_key:   The key to cache the call's result under
+    """
+    def __init__(self, handler, rejection=None, fallback=None, breaker=None, permit=None, pending=None,
+                 cache_key=None):
+        super(Admission, self).__init__(handler.get_callable(), handler.get_reference())
+        self._rejection = rejection
+        self._fallback = fallback
+        self._breaker = breaker
+        self._permit = permit
+        self._pending = pending
+        self._cache_key = cache_key
+
+    def get_rejection(self):
+        """Get the reason the call was shed, if it was.
+
+        :return:    The `CallRejected`, or None if the call was admitted
+        """
+        return self._rejection
+
+    def get_fallback(self):
+        """Get the fallback to make the call with instead, because the circuit breaker was open.
+
+        :return:    The fallback, or None
+        """
+        return self._fallback
+
+    def admit(self, cache_key=None):
+        return self
+
+    def release(self):
+        """Note that the call has completed, or will never be made. Only the first call does anything."""
+        (pending, self._pending) = (self._pending, None)
+        if pending:
+            for limiter in pending:
+                limiter.release()
+
+    def submitted(self, future):
+        """Called by Events once the call's been submitted, with its Future.
+
+        :param future:  The Future the executor handed back
+        """
+        if self._pending or self._breaker is not None:
+            # covers calls that are cancelled before they run, or that run without the Admission (in other processes)
+            future.add_done_callback(self._settle)
+
+    def _settle(self, future):
+        """Release the call, and record its outcome with the circuit breaker if running it didn't"""
+        self.release()
+
+        (breaker, self._breaker) = (self._breaker, None)
+        if breaker is not None:
+            if future.cancelled():
+                breaker.abandon(self._permit)
+            else:
+                breaker.record(future.exception(), call=self._permit)
+
+    def __call__(self, *args, **kwargs):
+        if self._fallback is not None:
+            return self._fallback(*args, **kwargs)
+
+        if self._breaker is not None:
+            self._breaker.start(self._permit)
+        error = None
+        try:
+            result = self._fn(*args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            (breaker, self._breaker) = (self._breaker, None)
+            if breaker is not None:
+                breaker.record(error, call=self._permit)
+            self.release()
+            # this frame ends up in the exception's traceback, so it mustn't keep the exception itself
+            error = None
+
+        if self._cache_key is not None:
+            self._reference.get_cache().store(self._cache_key, result)
+
+        return result
+
+
+def _completed_future(result=None, error=None):
+    from concurrent.futures import Future
+
+    future = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
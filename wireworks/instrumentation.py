@@ -0,0 +1,157 @@
+"""
+Hooks for measuring what dispatchers and events are up to.
+
+Instrumentation is off unless asked for: dispatchers without any skip all of the timing work, rather than calling
+into a do-nothing implementation. Pass an `Instrumentation` to `Registry(instrumentation=...)` or
+`Dispatcher.with_instrumentation` to turn it on.
+"""
+
+__author__ = 'rob'
+
+from threading import Lock
+
+from wireworks.util.callable_references import callable_name
+from wireworks.util.histogram import Histogram
+
+
+class Instrumentation(object):
+    """Base class for instrumentation. Every hook does nothing; override the ones you're interested in.
+
+    Hooks may be called from any thread, and should be quick - they're on the dispatch path.
+    """
+    def lookup_finished(self, pattern, duration):
+        """Called once a dispatcher has worked out which callables match its pattern.
+
+        :param pattern:     The dispatcher's filter pattern
+        :param duration:    Time taken to find the matching callables, in seconds
+        """
+
+    def dispatch_finished(self, pattern, handler_count, duration):
+        """Called once an Event has submitted all of its callables.
+
+        :param pattern:         The dispatcher's filter pattern
+        :param handler_count:   The number of callables that were submitted
+        :param duration:        Time taken to submit them all, in seconds. For synchronous executors, this includes
+                                the time taken to actually run them.
+        """
+
+    def handler_started(self, pattern, handler, queue_wait, args, kwargs):
+        """Called just before a callable is invoked, from the thread it's being invoked in.
+
+        :param pattern:     The dispatcher's filter pattern
+        :param handler:     The callable
+        :param queue_wait:  Time between submitting the callable to the executor and it starting, in seconds
+        :param args:        The args the callable is being invoked with
+        :param kwargs:      The kwargs the callable is being invoked with
+        :return:            Anything you like; it's passed back to handler_finished
+        """
+        return None
+
+    def handler_finished(self, pattern, handler, token, run_time, error):
+        """Called just after a callable has been invoked, from the thread it was invoked in.
+
+        :param pattern:     The dispatcher's filter pattern
+        :param handler:     The callable
+        :param token:       Whatever handler_started returned for this invocation
+        :param run_time:    Time taken for the callable to run, in seconds
+        :param error:       The exception the callable raised, or None if it didn't
+        """
+
+
+class CompositeInstrumentation(Instrumentation):
+    """Instrumentation that passes every hook on to any number of others."""
+    def __init__(self, *instrumentations):
+        self._instrumentations = instrumentations
+
+    def lookup_finished(self, pattern, duration):
+        for instrumentation in self._instrumentations:
+            instrumentation.lookup_finished(pattern, duration)
+
+    def dispatch_finished(self, pattern, handler_count, duration):
+        for instrumentation in self._instrumentations:
+            instrumentation.dispatch_finished(pattern, handler_count, duration)
+
+    def handler_started(self, pattern, handler, queue_wait, args, kwargs):
+        return [instrumentation.handler_started(pattern, handler, queue_wait, args, kwargs)
+                for instrumentation in self._instrumentations]
+
+    def handler_finished(self, pattern, handler, token, run_time, error):
+        for (instrumentation, one_token) in zip(self._instrumentations, token):
+            instrumentation.handler_finished(pattern, handler, one_token, run_time, error)
+
+
+class HistogramInstrumentation(Instrumentation):
+    """Instrumentation that records latencies into fixed-bucket histograms, per pattern and per handler.
+
+    For each pattern, lookup and dispatch times are recorded. For each handler wired under a pattern, queue wait and
+    run times are recorded, along with a count of errors. Use `snapshot` to get at the numbers.
+
+    :param bounds:  Optional histogram bucket bounds, in seconds. See `Histogram`.
+    """
+    def __init__(self, bounds=None):
+        self._bounds = bounds
+        self._lock = Lock()
+        self._patterns = {}
+        self._handlers = {}
+
+    def lookup_finished(self, pattern, duration):
+        self._pattern_stats(pattern)['lookup'].record(duration)
+
+    def dispatch_finished(self, pattern, handler_count, duration):
+        self._pattern_stats(pattern)['dispatch'].record(duration)
+
+    def handler_started(self, pattern, handler, queue_wait, args, kwargs):
+        stats = self._handler_stats(pattern, handler)
+        stats['queue_wait'].record(queue_wait)
+        return stats
+
+    def handler_finished(self, pattern, handler, token, run_time, error):
+        token['run_time'].record(run_time)
+        if error is not None:
+            with self._lock:
+                token['errors'] += 1
+
+    def snapshot(self):
+        """Get a copy of everything recorded so far.
+
+        :return:    A dict keyed by pattern. Each value holds 'lookup' and 'dispatch' histogram snapshots, and a
+                    'handlers' dict keyed by handler name holding 'queue_wait' and 'run_time' histogram snapshots
+                    along with an 'errors' count.
+        """
+        with self._lock:
+            patterns = list(self._patterns.items())
+            handlers = list(self._handlers.items())
+
+        result = {}
+        for (pattern, stats) in patterns:
+            result[pattern] = {'lookup': stats['lookup'].snapshot(), 'dispatch': stats['dispatch'].snapshot(),
+                               'handlers': {}}
+
+        for ((pattern, name), stats) in handlers:
+            pattern_result = result.setdefault(pattern, {'handlers': {}})
+            pattern_result['handlers'][name] = {'queue_wait': stats['queue_wait'].snapshot(),
+                                                'run_time': stats['run_time'].snapshot(),
+                                                'errors': stats['errors']}
+
+        return result
+
+    def _histogram(self):
+        return Histogram(self._bounds) if self._bounds else Histogram()
+
+    def _pattern_stats(self, pattern):
+        try:
+            return self._patterns[pattern]
+        except KeyError:
+            with self._lock:
+                return self._patterns.setdefault(pattern, {'lookup': self._histogram(),
+                                                           'dispatch': self._histogram()})
+
+    def _handler_stats(self, pattern, handler):
+        key = (pattern, callable_name(handler))
+        try:
+            return self._handlers[key]
+        except KeyError:
+            with self._lock:
+                return self._handlers.setdefault(key, {'queue_wait': self._histogram(),
+                                                       'run_time': self._histogram(),
+                                                       'errors': 0})
@@ -0,0 +1,386 @@
+"""
+A durable journal of dispatches, and a replayer to push them back through a registry.
+
+A `Journal` is a directory of segment files. Each segment is preallocated and memory mapped, and records are appended
+to it back to back; once a segment fills up, the next one is started. A record is a fixed header (payload length,
+CRC32 of the payload, record type, sequence number and timestamp) followed by the pickled pattern and call arguments.
+
+Attach a journal to a dispatcher with `Dispatcher.with_journal`, and every `call` (or `call_pooled`) is appended to it
+before anything is dispatched:
+
+    >>> journal = Journal("/var/lib/myapp/journal")
+    >>> dispatcher = registry.with_journal(journal)
+
+By default, appends are durable: a dispatch doesn't start until its record has been flushed to disk. Flushes are
+shared between threads (group commit) - while one thread is waiting for a flush, any others appending at the same time
+wait for the next one, which covers all of them. If losing the last few records in a crash is acceptable, pass
+`durable=False` and records are flushed when segments fill up, when the journal is closed, or on `sync`.
+
+With `record_completion`, the journal also notes when each dispatch has completed, so that after a crash the dispatches
+that were still in flight can be replayed with `Replayer.replay(pending_only=True)`.
+
+A `Replayer` also makes a realistic load generator: replay recorded traffic at full speed, or at (a multiple of) the
+speed it was originally recorded at.
+"""
+
+__author__ = 'rob'
+
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+
+from collections import namedtuple
+from threading import Condition, Lock
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# payload length, CRC32 of the payload, record type, sequence number, timestamp
+_RECORD_HEADER = struct.Struct('!IIBQd')
+
+_END = 0            # unwritten space at the end of a segment - preallocated segments are zero filled
+_CALL = 1           # payload: pickled (pattern, args, kwargs)
+_DONE = 2           # no payload. The sequence number is that of the completed call.
+
+_SEGMENT_NAME = "segment-%08d.journal"
+_SEGMENT_PATTERN = re.compile(r"^segment-(\d{8})\.journal$")
+
+JournalRecord = namedtuple('JournalRecord', ['sequence', 'timestamp', 'pattern', 'args', 'kwargs'])
+
+# Linux shares the page cache between mappings and file descriptors, so syncing the file also writes out the mapping.
+# Unlike mmap.flush, os.fdatasync releases the GIL while it waits for the disk, letting other threads append meanwhile.
+_sync_file = getattr(os, 'fdatasync', os.fsync) if sys.platform.startswith('linux') else None
+
+
+def _sync_directory(directory):
+    """Flush a directory's entries to disk, so files newly created in it survive a crash. Platforms that can't open a
+    directory to sync it (eg Windows) are left to do their best."""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _segment_paths(directory):
+    """Get the paths of every segment in a journal directory, oldest first"""
+    names = sorted(name for name in os.listdir(directory) if _SEGMENT_PATTERN.match(name))
+    return [os.path.join(directory, name) for name in names]
+
+
+def _read_segment(path):
+    """Read the (type, sequence, timestamp, payload) of every intact record in a segment, in order.
+
+    Reading stops at the end of the written records, or at the first record that's been torn by a crash part way
+    through writing it.
+    """
+    with open(path, 'rb') as segment:
+        data = segment.read()
+
+    position = 0
+    while position + _RECORD_HEADER.size <= len(data):
+        (length, crc, kind, sequence, timestamp) = _RECORD_HEADER.unpack_from(data, position)
+        if kind == _END:
+            return
+
+        start = position + _RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) & 0xffffffff != crc:
+            return
+
+        yield (kind, sequence, timestamp, payload)
+        position = start + length
+
+
+def read_journal(directory, pending_only=False):
+    """Read the calls recorded in a journal directory, oldest first.
+
+    :param directory:       The journal directory
+    :param pending_only:    If True, skip calls the journal recorded as having completed (see `Journal`)
+    :return:                A generator of `JournalRecord`
+    """
+    paths = _segment_paths(directory)
+
+    completed = set()
+    if pending_only:
+        for path in paths:
+            completed.update(sequence for (kind, sequence, _, _) in _read_segment(path) if kind == _DONE)
+
+    for path in paths:
+        for (kind, sequence, timestamp, payload) in _read_segment(path):
+            if kind == _CALL and sequence not in completed:
+                (pattern, args, kwargs) = pickle.loads(payload)
+                yield JournalRecord(sequence, timestamp, pattern, args, kwargs)
+
+
+class _Segment(object):
+    """A segment file, preallocated and memory mapped for writing"""
+    def __init__(self, path, size):
+        # trailing space past the end of the records must read as zeros, which a newly extended file does
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+
+    def flush(self):
+        if _sync_file is not None:
+            _sync_file(self.file.fileno())
+        else:
+            self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class Journal(object):
+    """An append-only, memory mapped log of dispatches. See the module documentation.
+
+    Opening a directory that already holds a journal carries on from where it left off, in a new segment.
+
+    :param directory:           Directory to keep the segments in. Created if it doesn't exist.
+    :param segment_size:        Size in bytes of each segment. Records bigger than this get a segment of their own.
+    :param durable:             If True, `append` doesn't return until the record has been flushed to disk
+    :param record_completion:   If True, dispatches journaled by a Dispatcher are recorded once they've completed
+    """
+    def __init__(self, directory, segment_size=16 * 1024 * 1024, durable=True, record_completion=False):
+        self._directory = directory
+        self._segment_size = segment_size
+        self._durable = durable
+        self._record_completion = record_completion
+
+        # held while writing to the current segment
+        self._lock = Lock()
+        self._segment = None
+        self._position = 0
+        self._written = 0
+        self._closed = False
+
+        # held while working out who flushes, and how far the flushes have got
+        self._sync_condition = Condition(Lock())
+        self._synced = 0
+        self._syncing = False
+        # segments finished with while a sync was in progress, which may be flushing them. Closed once it's done.
+        self._retired = []
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        (self._next_segment, self._next_sequence) = self._find_end()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get_directory(self):
+        return self._directory
+
+    def records_completion(self):
+        return self._record_completion
+
+    def append(self, pattern, args, kwargs):
+        """Append a call to the journal.
+
+        :param pattern: The pattern the call was dispatched with
+        :param args:    The call's args. These (and the kwargs) must be picklable.
+        :param kwargs:  The call's kwargs
+        :return:        The record's sequence number
+        """
+        payload = pickle.dumps((pattern, args, kwargs), pickle.HIGHEST_PROTOCOL)
+        (sequence, written) = self._write(_CALL, None, payload)
+
+        if self._durable:
+            self._sync_to(written)
+
+        return sequence
+
+    def track(self, sequence, event):
+        """Record the completion of a journaled call's Event, if this journal records completion.
+
+        :param sequence:    The call's sequence number, as returned by `append`
+        :param event:       The call's Event, whose dispatch has been started
+        """
+        if self._record_completion:
+            event.when_done(lambda: self.mark_done(sequence))
+
+    def mark_done(self, sequence):
+        """Record that a journaled call has completed, so it's skipped when only pending calls are replayed.
+
+        Completion records aren't flushed straight away, so after a crash, a few completed calls may be replayed
+        again.
+
+        :param sequence:    The call's sequence number, as returned by `append`
+        """
+        try:
+            self._write(_DONE, sequence, b'')
+        except ValueError:
+            # completions can arrive after the journal's been closed; they're only ever an optimisation
+            pass
+
+    def sync(self):
+        """Flush everything appended so far to disk"""
+        with self._lock:
+            written = self._written
+        self._sync_to(written)
+
+    def close(self):
+        """Flush and close the journal. Any further appends raise a ValueError."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._segment is not None:
+                self._segment.flush()
+                self._retire(self._segment)
+                self._segment = None
+
+    def _find_end(self):
+        """Work out the next segment number and sequence number from whatever's already in the directory"""
+        paths = _segment_paths(self._directory)
+        if not paths:
+            return 0, 1
+
+        last_segment = int(_SEGMENT_PATTERN.match(os.path.basename(paths[-1])).group(1))
+        last_sequence = 0
+        for path in reversed(paths):
+            sequences = [sequence for (kind, sequence, _, _) in _read_segment(path) if kind == _CALL]
+            if sequences:
+                last_sequence = max(sequences)
+                break
+
+        return last_segment + 1, last_sequence + 1
+
+    def _write(self, kind, sequence, payload):
+        """Write a record, returning its sequence number and the total number of bytes written once it's in"""
+        size = _RECORD_HEADER.size + len(payload)
+        with self._lock:
+            if self._closed:
+                raise ValueError("The journal is closed.")
+
+            if self._segment is None or self._position + size > len(self._segment.map):
+                self._start_segment(size)
+
+            if sequence is None:
+                sequence = self._next_sequence
+                self._next_sequence += 1
+
+            position = self._position
+            mapping = self._segment.map
+            _RECORD_HEADER.pack_into(mapping, position, len(payload), zlib.crc32(payload) & 0xffffffff, kind,
+                                     sequence, time.time())
+            mapping[position + _RECORD_HEADER.size:position + size] = payload
+            self._position += size
+            self._written += size
+
+            return sequence, self._written
+
+    def _start_segment(self, size):
+        """Start a new segment big enough for a record of the given size. Must be called with the lock held."""
+        if self._segment is not None:
+            # everything in the old segment is flushed now, so syncing only ever needs to flush the current one
+            self._segment.flush()
+            with self._sync_condition:
+                self._synced = max(self._synced, self._written)
+            self._retire(self._segment)
+            self._segment = None
+
+        path = os.path.join(self._directory, _SEGMENT_NAME % self._next_segment)
+        self._next_segment += 1
+
+        self._segment = _Segment(path, max(self._segment_size, size + _RECORD_HEADER.size))
+        self._position = 0
+        # the records are only as durable as the directory entry for the file they're in
+        _sync_directory(self._directory)
+
+    def _retire(self, segment):
+        """Close a segment that's been finished with - or if a sync may be flushing it right now, leave it for the
+        sync to close once it's done"""
+        with self._sync_condition:
+            if self._syncing:
+                self._retired.append(segment)
+                return
+        segment.close()
+
+    def _sync_to(self, written):
+        """Wait until at least `written` bytes have been flushed to disk, flushing them if nobody else is"""
+        with self._sync_condition:
+            while self._synced < written:
+                if self._syncing:
+                    # someone else is flushing; their flush may not cover us, so check again once it's done
+                    self._sync_condition.wait()
+                    continue
+
+                self._syncing = True
+                self._sync_condition.release()
+                try:
+                    # appends carry on while we flush; anything appended once we've looked waits for the next flush
+                    with self._lock:
+                        target = self._written
+                        segment = self._segment
+                    if segment is not None:
+                        try:
+                            segment.flush()
+                        except ValueError:
+                            # closed, which flushes it anyway
+                            pass
+                finally:
+                    self._sync_condition.acquire()
+                    self._syncing = False
+                    self._sync_condition.notify_all()
+                    retired = self._retired
+                    self._retired = []
+                    for old_segment in retired:
+                        old_segment.close()
+                self._synced = max(self._synced, target)
+
+
+class Replayer(object):
+    """Pushes calls recorded in a journal back through a dispatcher.
+
+    Each call is dispatched with `dispatcher.with_filter(pattern).call(...)`, so the replay uses the dispatcher's
+    executor and instrumentation. Don't replay through a dispatcher that journals to the journal being replayed.
+
+    :param dispatcher:  The dispatcher (usually a `Registry`) to replay calls through
+    :param directory:   The journal directory to replay
+    """
+    def __init__(self, dispatcher, directory):
+        self._dispatcher = dispatcher
+        self._directory = directory
+
+    def replay(self, speed=None, pending_only=False, limit=None):
+        """Replay the journal.
+
+        :param speed:           None to replay as fast as possible, or a multiple of the speed the calls were
+                                originally made at - 1 for the original speed, 2 for twice as fast, and so on
+        :param pending_only:    If True, only replay the calls that weren't recorded as having completed (see
+                                `Journal`). Use this to recover the dispatches that were in flight during a crash.
+        :param limit:           Maximum number of calls to replay, or None for all of them
+        :return:                The list of Events for the replayed calls
+        """
+        events = []
+        started = None
+        first_timestamp = None
+
+        for record in read_journal(self._directory, pending_only):
+            if limit is not None and len(events) >= limit:
+                break
+
+            if speed is not None:
+                if started is None:
+                    (started, first_timestamp) = (time.time(), record.timestamp)
+                delay = started + (record.timestamp - first_timestamp) / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            events.append(self._dispatcher.with_filter(record.pattern).call(*record.args, **record.kwargs))
+
+        return events
@@ -0,0 +1,193 @@
+"""
+Metrics for wireworks internals, as a plain dict snapshot or in the Prometheus text exposition format.
+
+    >>> instrumentation = HistogramInstrumentation()
+    >>> registry = Registry(instrumentation=instrumentation)
+    >>> collector = MetricsCollector(registry, instrumentation)
+    >>> server = collector.serve(9464)
+
+The HTTP server is optional, and nothing it needs is imported until it's started.
+"""
+
+__author__ = 'rob'
+
+import json
+
+from threading import Thread
+
+_PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_BREAKER_STATE_VALUES = {'closed': 0, 'half_open': 0.5, 'open': 1}
+
+
+class MetricsCollector(object):
+    """Collects metrics from a registry and, optionally, the instrumentation used by its dispatchers.
+
+    :param registry:        The `Registry` to report on
+    :param instrumentation: Optional `HistogramInstrumentation` to report dispatch counts and latencies from
+    """
+    def __init__(self, registry, instrumentation=None):
+        self._registry = registry
+        self._instrumentation = instrumentation
+
+    def snapshot(self):
+        """Get a snapshot of all metrics.
+
+        :return:    A dict with a 'registry' entry (see `Registry.snapshot`), a 'circuit_breakers' entry (see
+                    `Registry.get_breaker_stats`) and a 'dispatch' entry (see `HistogramInstrumentation.snapshot`),
+                    which is empty if there's no instrumentation
+        """
+        return {'registry': self._registry.snapshot(), 'circuit_breakers': self._registry.get_breaker_stats(),
+                'dispatch': self._instrumentation.snapshot() if self._instrumentation else {}}
+
+    def to_prometheus_text(self):
+        """Render all metrics in the Prometheus text exposition format.
+
+        :return:    The metrics, as a string
+        """
+        snapshot = self.snapshot()
+        registry = snapshot['registry']
+        glob_cache = registry['glob_cache']
+        lines = []
+
+        _add_metric(lines, 'wireworks_registry_keys', 'gauge', 'Number of keys in the registry',
+                    [({}, registry['keys'])])
+        _add_metric(lines, 'wireworks_registry_handlers', 'gauge', 'Number of handlers registered per key',
+                    [({'key': key}, count) for key, count in sorted(registry['handlers_per_key'].items())])
+        _add_metric(lines, 'wireworks_registry_dead_references', 'gauge',
+                    'Number of registered references whose callable has died, but which are yet to be removed',
+                    [({}, registry['dead_references'])])
+        _add_metric(lines, 'wireworks_glob_cache_entries', 'gauge', 'Number of glob patterns currently cached',
+                    [({}, glob_cache['cache_size'])])
+        _add_metric(lines, 'wireworks_glob_cache_hits_total', 'counter', 'Number of globs served from the cache',
+                    [({}, glob_cache['cache_hits'])])
+        _add_metric(lines, 'wireworks_glob_cache_misses_total', 'counter', 'Number of globs not served from the cache',
+                    [({}, glob_cache['cache_misses'])])
+        if glob_cache['cache_hit_ratio'] is not None:
+            _add_metric(lines, 'wireworks_glob_cache_hit_ratio', 'gauge', 'Proportion of globs served from the cache',
+                        [({}, glob_cache['cache_hit_ratio'])])
+
+        breakers = sorted(snapshot['circuit_breakers'], key=lambda stats: (stats['pattern'], stats['handler']))
+        _add_metric(lines, 'wireworks_circuit_breaker_open', 'gauge',
+                    "Whether a handler's circuit breaker is open (1), half open (0.5) or closed (0)",
+                    [({'key': stats['pattern'], 'handler': stats['handler']}, _BREAKER_STATE_VALUES[stats['state']])
+                     for stats in breakers])
+        _add_metric(lines, 'wireworks_circuit_breaker_trips_total', 'counter',
+                    "Number of times a handler's circuit breaker has tripped",
+                    [({'key': stats['pattern'], 'handler': stats['handler']}, stats['trips']) for stats in breakers])
+        _add_metric(lines, 'wireworks_circuit_breaker_skipped_total', 'counter',
+                    "Number of calls skipped, or handed to a fallback, while a handler's circuit breaker was open",
+                    [({'key': stats['pattern'], 'handler': stats['handler']}, stats['skipped']) for stats in breakers])
+
+        dispatch = sorted(snapshot['dispatch'].items())
+        handlers = [(pattern, name, stats) for pattern, pattern_stats in dispatch
+                    for name, stats in sorted(pattern_stats['handlers'].items())]
+
+        _add_histogram(lines, 'wireworks_dispatch_lookup_seconds', 'Time taken to find matching handlers',
+                       [({'pattern': pattern}, stats['lookup']) for pattern, stats in dispatch if 'lookup' in stats])
+        _add_histogram(lines, 'wireworks_dispatch_seconds', 'Time taken to submit all handlers for a dispatch',
+                       [({'pattern': pattern}, stats['dispatch']) for pattern, stats in dispatch
+                        if 'dispatch' in stats])
+        _add_histogram(lines, 'wireworks_handler_queue_wait_seconds', 'Time handlers spent waiting to be run',
+                       [({'pattern': pattern, 'handler': name}, stats['queue_wait'])
+                        for pattern, name, stats in handlers])
+        _add_histogram(lines, 'wireworks_handler_run_seconds', 'Time handlers spent running',
+                       [({'pattern': pattern, 'handler': name}, stats['run_time'])
+                        for pattern, name, stats in handlers])
+        _add_metric(lines, 'wireworks_handler_errors_total', 'counter', 'Number of handler invocations that raised',
+                    [({'pattern': pattern, 'handler': name}, stats['errors']) for pattern, name, stats in handlers])
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Start serving metrics over HTTP from a background thread.
+
+        Prometheus text is served from ``/metrics``, and the JSON snapshot from ``/snapshot``.
+
+        :param port:    Port to listen on. Use 0 to pick any free port.
+        :param host:    Address to listen on. Defaults to the local machine only.
+        :return:        The server. Use `server.server_address` to find out where it ended up, and `server.shutdown()`
+                        to stop it.
+        """
+        try:
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+            from socketserver import ThreadingMixIn
+        except ImportError:
+            from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+            from SocketServer import ThreadingMixIn
+
+        collector = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/metrics':
+                    self._respond(collector.to_prometheus_text(), _PROMETHEUS_CONTENT_TYPE)
+                elif path == '/snapshot':
+                    self._respond(json.dumps(collector.snapshot(), sort_keys=True), 'application/json')
+                else:
+                    self.send_error(404)
+
+            def _respond(self, body, content_type):
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # scrapes are frequent and dull
+                pass
+
+        class MetricsServer(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = MetricsServer((host, port), MetricsRequestHandler)
+        thread = Thread(target=server.serve_forever, name="wireworks-metrics")
+        thread.daemon = True
+        thread.start()
+
+        return server
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    escaped = ['%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in sorted(labels.items())]
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _add_metric(lines, name, metric_type, help_text, samples):
+    if not samples:
+        return
+
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s %s' % (name, metric_type))
+    for (labels, value) in samples:
+        lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+
+
+def _add_histogram(lines, name, help_text, samples):
+    """Add histogram samples, converting each `Histogram.snapshot()` into cumulative Prometheus buckets"""
+    if not samples:
+        return
+
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s histogram' % name)
+    for (labels, histogram) in samples:
+        cumulative = 0
+        for (bound, count) in zip(histogram['bounds'] + [float('inf')], histogram['counts']):
+            cumulative += count
+            bucket_labels = dict(labels, le=_format_value(bound))
+            lines.append('%s_bucket%s %d' % (name, _format_labels(bucket_labels), cumulative))
+        lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(histogram['sum'])))
+        lines.append('%s_count%s %d' % (name, _format_labels(labels), histogram['count']))
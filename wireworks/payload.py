@@ -0,0 +1,185 @@
+"""
+Zero-copy handling of large binary payloads. See `Dispatcher.with_payload_views`.
+
+Within the process, `bytes`, `bytearray` and `memoryview` arguments are handed to every handler as read-only
+`memoryview` instances over the original buffer: no copies are made, and no handler can change what the others see.
+
+Executors that run calls in other processes (eg `ProcessPoolExecutor`) have to pickle each call's arguments, so a
+buffer dispatched to ten handlers would normally be copied ten times. Instead, buffers at least `share_min_size` bytes
+long are copied once into a `multiprocessing.shared_memory` block, and each call is sent a small `SharedPayload`
+reference to it. Handlers are still given a read-only memoryview, this time over the shared block. The block is
+removed once every handler has completed - so handlers mustn't hang on to the view once they've returned. Smaller
+buffers are pickled as usual. Shared memory needs Python 3.8 or later; without it, buffers are always pickled.
+"""
+
+__author__ = 'rob'
+
+import os
+
+_BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+
+def read_only_view(value):
+    """Get a read-only view of a buffer, without copying it where possible.
+
+    Before Python 3.8, a writable buffer can't be viewed read-only, so it's copied instead.
+
+    :param value:   A bytes, bytearray or memoryview
+    :return:        A read-only memoryview
+    """
+    view = value if isinstance(value, memoryview) else memoryview(value)
+    if view.readonly:
+        return view
+    if hasattr(view, 'toreadonly'):
+        return view.toreadonly()
+    return memoryview(view.tobytes())
+
+
+class SharedPayload(object):
+    """A reference to a buffer held in shared memory, sent to another process in place of the buffer itself.
+
+    :param name:    The name of the shared memory block
+    :param size:    The size of the buffer (the block itself may be rounded up)
+    """
+    __slots__ = ('name', 'size')
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __getstate__(self):
+        return self.name, self.size
+
+    def __setstate__(self, state):
+        (self.name, self.size) = state
+
+    def __repr__(self):
+        return "SharedPayload(%r, %d)" % (self.name, self.size)
+
+    def attach(self):
+        """Attach to the shared memory block.
+
+        :return:    The `SharedMemory`, which the caller must close once it's done with it
+        """
+        from multiprocessing.shared_memory import SharedMemory
+
+        try:
+            # the creating process owns the block, so it mustn't be tracked (and cleaned up) here as well
+            return SharedMemory(name=self.name, track=False)
+        except TypeError:
+            pass
+
+        # Before Python 3.13, attaching always registers the block with this process's resource tracker. Processes
+        # started by the owner (eg a ProcessPoolExecutor's workers) share its tracker, which has the block registered
+        # already. Any other process gets a tracker of its own, which would unlink the block (or warn that it leaked)
+        # once this process exits, so the block is unregistered from it again.
+        owners_tracker = _has_resource_tracker()
+        block = SharedMemory(name=self.name)
+        if not owners_tracker and os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+class PayloadViews(object):
+    """Prepares call arguments for dispatch, replacing buffers with read-only views or shared memory references. See
+    the module documentation.
+
+    :param share_min_size:  The smallest buffer, in bytes, to put in shared memory when calls are run in other
+                            processes
+    """
+    def __init__(self, share_min_size=64 * 1024):
+        self._share_min_size = share_min_size
+
+    def get_share_min_size(self):
+        return self._share_min_size
+
+    def prepare(self, args, kwargs, out_of_process=False, share=True):
+        """Prepare call arguments for dispatch.
+
+        :param args:            The call's args
+        :param kwargs:          The call's kwargs
+        :param out_of_process:  True if the calls will be run in other processes
+        :param share:           If False, large buffers aren't put in shared memory even if the calls will be run in
+                                other processes - memoryviews (which can't be pickled) are copied to bytes instead
+        :return:                A tuple of (args, kwargs, release), where release is None, or a callable that must
+                                be called once every handler has completed, to free any shared memory
+        """
+        blocks = []
+        if out_of_process:
+            convert = lambda value: self._to_picklable(value, blocks if share else None)
+        else:
+            convert = read_only_view
+
+        args = tuple(convert(arg) if isinstance(arg, _BUFFER_TYPES) else arg for arg in args)
+        if kwargs:
+            kwargs = dict((name, convert(value) if isinstance(value, _BUFFER_TYPES) else value)
+                          for name, value in kwargs.items())
+
+        return args, kwargs, (lambda: _free(blocks)) if blocks else None
+
+    def _to_picklable(self, value, blocks):
+        data = memoryview(value)
+        if blocks is not None and data.nbytes >= self._share_min_size:
+            try:
+                from multiprocessing.shared_memory import SharedMemory
+            except ImportError:
+                pass
+            else:
+                data = data.cast('B') if data.c_contiguous else memoryview(data.tobytes())
+                block = SharedMemory(create=True, size=max(1, data.nbytes))
+                block.buf[:data.nbytes] = data
+                blocks.append(block)
+                return SharedPayload(block.name, data.nbytes)
+
+        return value.tobytes() if isinstance(value, memoryview) else value
+
+
+def _has_resource_tracker():
+    """Check whether this process is already using a resource tracker - one it was started with, or has started"""
+    try:
+        from multiprocessing import resource_tracker
+    except ImportError:
+        return False
+    return getattr(resource_tracker._resource_tracker, '_fd', None) is not None
+
+
+def _free(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def call_with_payloads(fn, args, kwargs):
+    """Call a callable in another process, handing it read-only views of any `SharedPayload` arguments.
+
+    This is what's actually submitted to executors that run calls in other processes, so it needs to be importable
+    there, and `fn` needs to be picklable.
+
+    :param fn:      The callable
+    :param args:    Its args
+    :param kwargs:  Its kwargs
+    :return:        Whatever the callable returns
+    """
+    attached = []
+
+    def resolve(value):
+        if not isinstance(value, SharedPayload):
+            return value
+        block = value.attach()
+        view = block.buf[:value.size].toreadonly()
+        attached.append((block, view))
+        return view
+
+    try:
+        args = tuple(resolve(arg) for arg in args)
+        kwargs = dict((name, resolve(value)) for name, value in kwargs.items())
+        return fn(*args, **kwargs)
+    finally:
+        for (block, view) in attached:
+            try:
+                view.release()
+                block.close()
+            except BufferError:
+                # the handler's kept a view of its own; the block's closed once that's gone
+                pass
@@ -0,0 +1,184 @@
+"""
+Sampling profiler for finding out which handlers are responsible for slow dispatches.
+
+A `HandlerProfiler` is a kind of `Instrumentation`: a sampled fraction of handler invocations are run under cProfile,
+and any that take longer than a threshold are kept as a report, along with the pattern being dispatched, the handler's
+qualified name and the shape of the arguments it was given. Only the slowest few reports are kept per handler.
+
+    >>> profiler = HandlerProfiler(sample_rate=0.05, threshold=0.25)
+    >>> dispatcher = registry.with_profiling(profiler)
+    ...
+    >>> profiler.write_reports('/tmp/slow-handlers')
+
+The sample rate and threshold can be changed at any time, from any thread.
+"""
+
+__author__ = 'rob'
+
+import heapq
+import os
+import random
+import re
+
+from threading import Lock, local
+
+from wireworks.instrumentation import Instrumentation
+from wireworks.util.callable_references import callable_name
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+# the profile our profilers have running in each thread, if any. Before Python 3.12, enabling a second profile in a
+# thread doesn't fail, it silently takes over from the first - so nested dispatches have to check for themselves.
+_active = local()
+
+
+def describe_args(args, kwargs):
+    """Describe the shape of some call arguments, without including their values.
+
+    :param args:    The call args
+    :param kwargs:  The call kwargs
+    :return:        A string along the lines of ``(str[12], int, list[3]) {'key': dict[2]}``
+    """
+    def describe(value):
+        name = type(value).__name__
+        try:
+            return "%s[%d]" % (name, len(value))
+        except Exception:
+            return name
+
+    description = "(%s)" % ", ".join(describe(arg) for arg in args)
+    if kwargs:
+        description += " {%s}" % ", ".join("%r: %s" % (key, describe(value)) for key, value in sorted(kwargs.items()))
+
+    return description
+
+
+class HandlerProfiler(Instrumentation):
+    """Instrumentation that profiles a sample of handler invocations, keeping reports for the slowest.
+
+    :param sample_rate:     Fraction of invocations to profile, between 0 and 1
+    :param threshold:       Minimum run time in seconds for a profiled invocation to be reported
+    :param max_reports:     Maximum number of reports to keep per handler. The slowest are kept.
+    :param use_cprofile:    If False, sampled invocations are only timed rather than profiled, which is much cheaper
+    """
+    def __init__(self, sample_rate=0.01, threshold=0.1, max_reports=5, use_cprofile=True):
+        self._sample_rate = sample_rate
+        self._threshold = threshold
+        self._max_reports = max_reports
+        self._use_cprofile = use_cprofile
+        self._lock = Lock()
+        self._reports = {}
+        self._sequence = 0
+
+    def set_sample_rate(self, sample_rate):
+        """Change the fraction of invocations to profile.
+
+        :param sample_rate:     Fraction of invocations to profile, between 0 and 1. 0 turns profiling off.
+        """
+        self._sample_rate = sample_rate
+
+    def set_threshold(self, threshold):
+        """Change the minimum run time for a profiled invocation to be reported.
+
+        :param threshold:   Threshold in seconds
+        """
+        self._threshold = threshold
+
+    def handler_started(self, pattern, handler, queue_wait, args, kwargs):
+        if not self._sample_rate or random.random() >= self._sample_rate:
+            return None
+
+        profile = None
+        # if we're already profiling in this thread (eg a nested dispatch), just time the call instead
+        if self._use_cprofile and getattr(_active, 'profile', None) is None:
+            import cProfile
+
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # someone else's profiler is running in this thread
+                profile = None
+            else:
+                _active.profile = profile
+
+        return profile, describe_args(args, kwargs)
+
+    def handler_finished(self, pattern, handler, token, run_time, error):
+        if token is None:
+            return
+
+        (profile, args_shape) = token
+        if profile is not None:
+            profile.disable()
+            _active.profile = None
+
+        if run_time < self._threshold:
+            return
+
+        report = {'pattern': pattern, 'handler': callable_name(handler), 'run_time': run_time,
+                  'args_shape': args_shape, 'error': repr(error) if error is not None else None,
+                  'profile': self._format_profile(profile) if profile is not None else None}
+        self._add_report(report)
+
+    def get_reports(self):
+        """Get the reports kept so far.
+
+        :return:    A dict keyed by handler name, each holding a list of reports (dicts), slowest first
+        """
+        with self._lock:
+            return dict((name, [report for (_, _, report) in sorted(reports, reverse=True)])
+                        for name, reports in self._reports.items())
+
+    def clear_reports(self):
+        """Throw away all reports kept so far."""
+        with self._lock:
+            self._reports = {}
+
+    def write_reports(self, directory):
+        """Write a text report for each handler to the given directory, one file per handler.
+
+        :param directory:   Directory to write to. Created if it doesn't exist.
+        :return:            List of the paths written
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        paths = []
+        for name, reports in sorted(self.get_reports().items()):
+            path = os.path.join(directory, re.sub(r'[^\w.-]+', '_', name) + '.txt')
+            with open(path, 'w') as report_file:
+                for report in reports:
+                    report_file.write("handler:    %s\n" % report['handler'])
+                    report_file.write("pattern:    %s\n" % report['pattern'])
+                    report_file.write("run time:   %.6fs\n" % report['run_time'])
+                    report_file.write("args shape: %s\n" % report['args_shape'])
+                    if report['error']:
+                        report_file.write("error:      %s\n" % report['error'])
+                    if report['profile']:
+                        report_file.write("\n%s" % report['profile'])
+                    report_file.write("\n" + "-" * 80 + "\n\n")
+            paths.append(path)
+
+        return paths
+
+    def _add_report(self, report):
+        with self._lock:
+            self._sequence += 1
+            entry = (report['run_time'], self._sequence, report)
+            reports = self._reports.setdefault(report['handler'], [])
+            if len(reports) < self._max_reports:
+                heapq.heappush(reports, entry)
+            else:
+                heapq.heappushpop(reports, entry)
+
+    @staticmethod
+    def _format_profile(profile):
+        import pstats
+
+        output = StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(25)
+        return output.getvalue()
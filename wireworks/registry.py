@@ -1,23 +1,121 @@
-from __future__ import print_function
-
 from wireworks.dispatcher import Dispatcher
-from wireworks.util.callable_references import StrongCallableReference, WeakCallableReference
-from wireworks.util.globbable_dict import GlobbableDict
+from wireworks.util.circuit_breaker import make_breaker
+from wireworks.util.callable_references import StrongCallableReference, WeakCallableReference, callable_identity, \
+    callable_name
+from wireworks.util.globbable_dict import GlobbableDict, compile_glob
+from wireworks.util.layered_globbable_dict import LayeredGlobbableDict
+from wireworks.util.sharded_globbable_dict import ShardedGlobbableDict, PARTITION_TOP_LEVEL
+from wireworks.util.lazy_logger import LazyLogger
+from wireworks.util.rate_limiter import make_limiter
+from wireworks.util.result_cache import ResultCache, make_cache
 
 __author__ = 'rob'
 
-import inspect
-import logging
+from threading import Lock
+from weakref import ref
 
 
 class Registry(Dispatcher):
-    _LOG = logging.getLogger("wireworks.registry")
-
-    def __init__(self):
-        self._glob_dict = GlobbableDict(default_factory=lambda: set())
+    """Somewhere to register callables against patterns, and dispatch to them from.
+
+    By default, every registration (and unregistration) takes the same lock. If many threads register and unregister
+    at once - eg constructing lots of `wire_class_instances` objects in parallel - split the registry into shards,
+    each with its own lock (see `ShardedGlobbableDict`). Registrations against patterns in different shards then don't
+    hold each other up. Patterns are assigned to shards by their top level component (or, with `partition='key'`,
+    the whole pattern), and dispatches merge the handlers from every shard their filter could match.
+
+    A registry can also be layered over a parent (see `child`), to add handlers to it - or hide some of its handlers -
+    for one tenant, say, or one test. Dispatches through the child see the handlers of both. Nothing is copied, so a
+    child costs the same to make however big its parent is. Everything else (listing patterns, snapshots, statistics,
+    limits, scopes) only covers the child's own registrations.
+
+    :param instrumentation: The `Instrumentation` to report dispatches to, if any
+    :param shards:          The number of shards to split the registry into, or None for a single unsharded one
+    :param partition:       How to assign patterns to shards. See `ShardedGlobbableDict`.
+    :param parent:          The registry to layer this one over, if any
+    """
+    _LOG = LazyLogger("wireworks.registry")
+
+    def __init__(self, instrumentation=None, shards=None, partition=PARTITION_TOP_LEVEL, parent=None):
         self._pending_instance_wiring = {}
+        # held while adding to or removing from the sets of references, and removing the keys that hold them - unless
+        # the registry's sharded, in which case each shard has a lock of its own for that. See `_shard_for`.
+        self._lock = Lock()
+
+        if shards is None:
+            self._glob_dict = GlobbableDict(default_factory=lambda: set())
+            self._shards = None
+        else:
+            self._glob_dict = ShardedGlobbableDict(shards, default_factory=lambda: set(), partition=partition)
+            self._shards = [(Lock(), self._glob_dict.get_shard(index)) for index in range(shards)]
+        # replaced rather than modified, so it can be iterated without the lock
+        self._listeners = ()
+        # (pattern, compiled pattern, RateLimiter) for each limit set with `limit`. Replaced rather than modified too.
+        self._limits = ()
+
+        self._parent = parent
+        dispatch_dict = self._glob_dict
+        if parent is not None:
+            dispatch_dict = LayeredGlobbableDict(self._glob_dict, parent._dispatcher_glob_dict)
+
+        super(Registry, self).__init__(dispatch_dict, instrumentation=instrumentation)
+
+    def child(self):
+        """Make a registry layered over this one. Dispatches through the child go to the handlers registered with it,
+        and to the handlers registered with this registry (and its own parents, if it's a child itself) - less any
+        the child masks (see `mask`). Handlers registered with the child aren't seen by this registry.
+
+        Which handlers match a dispatch is worked out once for both layers together, and cached until a pattern it
+        matched is registered against or unregistered from in either layer, or the child's masks change.
+
+            >>> tenant = registry.child()
+            >>> tenant.register("orders.created", audit_for_tenant)
+            >>> tenant.mask("orders.created", send_default_email)
+            >>> tenant.with_filter("orders.*").call(order)
+
+        :return:    A new, empty Registry, with the same instrumentation as this one
+        """
+        return Registry(instrumentation=self._instrumentation, parent=self)
+
+    def get_parent(self):
+        """Get the registry this one is layered over.
+
+        :return:    The parent Registry, or None if this isn't a child registry
+        """
+        return self._parent
+
+    def mask(self, pattern, fn=None):
+        """Hide handlers inherited from the parent registry from dispatches through this one: every handler
+        registered in the parent against patterns matching a glob, or only registrations of a particular callable.
+        Handlers registered with this registry itself are never masked.
+
+        A mask for a particular callable only weakly references it, and is removed once the callable's gone.
 
-        super(Registry, self).__init__(self._glob_dict)
+        :param pattern:     Glob matching the patterns whose handlers are to be hidden
+        :param fn:          The callable to hide, or None to hide every handler
+        """
+        if self._parent is None:
+            raise ValueError("Only child registries can mask inherited handlers.")
+
+        matches = None
+        if fn is not None:
+            registry = ref(self)
+
+            def callable_died(mask):
+                if registry() is not None:
+                    registry()._dispatcher_glob_dict.unmask(pattern, mask)
+
+            matches = _CallableMask(fn, callable_died)
+        self._dispatcher_glob_dict.mask(pattern, matches)
+
+    def unmask(self, pattern, fn=None):
+        """Stop hiding handlers hidden by `mask` called with the same arguments.
+
+        :param pattern:     The glob given to `mask`
+        :param fn:          The callable given to `mask`, if any
+        """
+        if self._parent is not None:
+            self._dispatcher_glob_dict.unmask(pattern, _CallableMask(fn) if fn is not None else None)
 
     def wire_class_instances(self, cls):
         old_init = None
@@ -25,14 +123,19 @@ class Registry(Dispatcher):
             old_init = cls.__init__
 
         def new_init(inst_self, *args, **kwargs):
+            import inspect
+
             old_rval = None
             if old_init:
                 old_rval = old_init(inst_self, *args, **kwargs)
 
             for _, method in inspect.getmembers(inst_self, lambda mem: inspect.ismethod(mem)):
-                method_func = method.im_func
+                method_func = method.__func__
                 if method_func in self._pending_instance_wiring:
-                    wiring_attrs = self._pending_instance_wiring[method_func]
+                    wiring_attrs = dict(self._pending_instance_wiring[method_func])
+                    if isinstance(wiring_attrs['cache'], ResultCache):
+                        # results depend on the instance, so every instance needs a cache of its own
+                        wiring_attrs['cache'] = wiring_attrs['cache'].empty_copy()
                     self.register(fn=method, **wiring_attrs)
 
             return old_rval
@@ -40,78 +143,393 @@ class Registry(Dispatcher):
         setattr(cls, '__init__', new_init)
         return cls
 
-    def wire(self, pattern, strongly_reference=False):
+    def wire(self, pattern, strongly_reference=False, priority=0, cache=None, rate_limit=None, circuit_breaker=None,
+             dispatch_priority=None):
         def decorator(fn):
-            self.register(pattern, fn, strongly_reference)
+            self.register(pattern, fn, strongly_reference, priority, cache, rate_limit, circuit_breaker,
+                          dispatch_priority)
             return fn
         return decorator
 
-    def wire_instance_method(self, pattern, strongly_reference=False):
+    def wire_instance_method(self, pattern, strongly_reference=False, priority=0, cache=None, rate_limit=None,
+                             circuit_breaker=None, dispatch_priority=None):
         def decorator(fn):
-            self._pending_instance_wiring[fn] = {'pattern': pattern, 'strongly_reference': strongly_reference}
+            self._pending_instance_wiring[fn] = {'pattern': pattern, 'strongly_reference': strongly_reference,
+                                                 'priority': priority, 'cache': cache, 'rate_limit': rate_limit,
+                                                 'circuit_breaker': circuit_breaker,
+                                                 'dispatch_priority': dispatch_priority}
             return fn
         return decorator
 
-    def register(self, pattern, fn, strongly_reference=False):
+    def register(self, pattern, fn, strongly_reference=False, priority=0, cache=None, rate_limit=None,
+                 circuit_breaker=None, dispatch_priority=None):
+        """Register a callable against a pattern.
+
+        :param pattern:             The pattern to register against
+        :param fn:                  The callable
+        :param strongly_reference:  If True, the registry keeps the callable alive. If not, it's removed from the
+                                    registry when it's garbage collected.
+        :param priority:            Dispatch priority; higher priority callables are invoked first
+        :param cache:               Cache results by call arguments, serving repeated calls without invoking the
+                                    callable. True for a default cache, an int for a cache of that size, or a
+                                    `ResultCache`. Only suitable for callables that are pure lookups.
+        :param rate_limit:          Shed calls beyond a rate limit rather than queueing them: a number of calls per
+                                    second, or a `RateLimiter` (which may be shared with other callables). With
+                                    `wire_instance_method`, a number gives each instance a limit of its own.
+        :param circuit_breaker:     Skip calls (or hand them to a fallback) while the callable keeps failing: True for a
+                                    default `CircuitBreaker`, an int for one tripping after that many failures in a
+                                    row, or a `CircuitBreaker` (which may be shared with other callables). With
+                                    `wire_instance_method`, True or an int gives each instance a breaker of its own.
+        :param dispatch_priority:   The lane to submit calls in when dispatching to a `PriorityExecutor`. A priority
+                                    set on the dispatcher with `Dispatcher.with_priority` overrides this one. If None,
+                                    calls go in the dispatch's lane.
+        """
+        self._add_reference(pattern, fn, strongly_reference, priority, cache, rate_limit, circuit_breaker,
+                            dispatch_priority)
+
+    def limit(self, pattern, rate_limit):
+        """Limit the calls made to every callable registered against patterns matching a glob, including those
+        registered later. The limit is shared between all of them, so `limit("payments.*", 100)` admits 100 calls per
+        second to payment handlers in total. Calls beyond the limit are shed before they're submitted to the
+        executor, and their Futures completed with a `CallRejected`.
+
+        Callables limited individually (see `register`) must be admitted by both limits.
+
+            >>> registry.limit("payments.*", RateLimiter(rate=100, burst=20, max_pending=50))
+
+        :param pattern:     The glob to limit. Setting a limit for the same glob again replaces it.
+        :param rate_limit:  A number of calls per second, a `RateLimiter`, or None to remove the glob's limit
+        :return:            The RateLimiter now applied, or None
+        """
+        limiter = make_limiter(rate_limit)
+        with self._lock:
+            limits = tuple(limit for limit in self._limits if limit[0] != pattern)
+            if limiter is not None:
+                limits += ((pattern, compile_glob(pattern), limiter),)
+            self._limits = limits
+
+        for (registered, refs) in self._glob_dict.snapshot_items():
+            limiters = self._limiters_for(registered)
+            for reference in list(refs):
+                reference.set_pattern_limiters(limiters)
+
+        return limiter
+
+    def get_limit_stats(self):
+        """Get statistics for every limit set with `limit`.
+
+        :return:    A list of dicts, each holding a limited glob along with its limiter's statistics
+        """
+        stats = []
+        for (pattern, _, limiter) in self._limits:
+            limiter_stats = limiter.get_stats()
+            limiter_stats.update(pattern=pattern)
+            stats.append(limiter_stats)
+
+        return stats
+
+    def scope(self):
+        """Start a group of registrations that can all be removed again in one go. See `RegistrationScope`.
+
+            >>> with registry.scope() as scope:
+            ...     scope.register("tenant.42.*", handler)
+            ...     registry.call(...)
+
+        :return:    A new, open `RegistrationScope`
+        """
+        return RegistrationScope(self)
+
+    def _add_reference(self, pattern, fn, strongly_reference, priority, cache, rate_limit=None, circuit_breaker=None,
+                       dispatch_priority=None):
+        """Register a callable, returning the reference it's registered under"""
+        result_cache = make_cache(cache)
+        rate_limiter = make_limiter(rate_limit)
+        breaker = make_breaker(circuit_breaker)
         if strongly_reference:
-            p_callable_ref = StrongCallableReference(fn)
+            p_callable_ref = StrongCallableReference(fn, priority, result_cache, rate_limiter, breaker,
+                                                     dispatch_priority)
         else:
-            p_callable_ref = WeakCallableReference(fn, lambda del_proxy: self._unregister_proxy(pattern, del_proxy))
-
-        Registry._LOG.debug("Adding callable %s for pattern %s" % (p_callable_ref, pattern))
-        self._glob_dict[pattern].add(p_callable_ref)
+            p_callable_ref = WeakCallableReference(fn, lambda del_proxy: self._unregister_proxy(pattern, del_proxy),
+                                                   priority, result_cache, rate_limiter, breaker, dispatch_priority)
+
+        limits = self._limits
+        if limits:
+            p_callable_ref.set_pattern_limiters(self._limiters_for(pattern))
+
+        Registry._LOG.debug("Adding callable %s for pattern %s", p_callable_ref, pattern)
+        (lock, glob_dict) = self._shard_for(pattern)
+        with lock:
+            glob_dict[pattern].add(p_callable_ref)
+            glob_dict.touch([pattern])
+
+        if self._limits is not limits:
+            # a limit was set while we were registering, and may have missed us
+            p_callable_ref.set_pattern_limiters(self._limiters_for(pattern))
+
+        for listener in self._listeners:
+            listener(pattern, p_callable_ref, True)
+
+        return p_callable_ref
+
+    def _remove_references(self, references):
+        """Unregister a batch of references, given as (pattern, reference) pairs, removing any keys left empty"""
+        by_lock = {}
+        for (pattern, reference) in references:
+            (lock, glob_dict) = self._shard_for(pattern)
+            by_lock.setdefault(lock, (glob_dict, []))[1].append((pattern, reference))
+
+        for (lock, (glob_dict, shard_references)) in by_lock.items():
+            with lock:
+                changed = set()
+                emptied = set()
+                for (pattern, reference) in shard_references:
+                    refs = glob_dict.get(pattern)
+                    if refs is not None:
+                        refs.discard(reference)
+                        changed.add(pattern)
+                        if not refs:
+                            emptied.add(pattern)
+
+                glob_dict.touch(changed - emptied)
+                glob_dict.remove_keys(emptied)
+
+        for listener in self._listeners:
+            for (pattern, reference) in references:
+                listener(pattern, reference, False)
+
+    def _limiters_for(self, pattern):
+        """Get the limiters set with `limit` that apply to callables registered against a pattern"""
+        return tuple(limiter for (_, compiled, limiter) in self._limits if compiled.match(pattern))
+
+    def _shard_for(self, pattern):
+        """Get the lock to hold while changing the references registered against a pattern, and the GlobbableDict
+        holding them, as a tuple"""
+        if self._shards is None:
+            return self._lock, self._glob_dict
+        return self._shards[self._glob_dict.shard_index(pattern)]
+
+    def add_listener(self, listener):
+        """Be told about every registration and unregistration.
+
+        The listener is called as `listener(pattern, reference, added)` once the change has been made, from whichever
+        thread made it - which, for weakly referenced callables, may be the garbage collector. So it should be quick,
+        and mustn't rely on any locks it takes being free.
+
+        :param listener:    The callable to notify
+        """
+        with self._lock:
+            self._listeners += (listener,)
+
+    def remove_listener(self, listener):
+        """Stop telling a listener added with `add_listener` about registrations.
+
+        :param listener:    The callable to stop notifying
+        """
+        with self._lock:
+            self._listeners = tuple(existing for existing in self._listeners if existing is not listener)
+
+    def get_patterns(self):
+        """Get every pattern that has something registered against it.
+
+        :return:    A list of patterns
+        """
+        return [pattern for pattern, refs in self._glob_dict.snapshot_items() if refs]
+
+    def get_references(self, pattern):
+        """Get the references registered against exactly the given pattern - it isn't treated as a glob.
+
+        :param pattern:     The pattern callables were registered against
+        :return:            A list of callable references, highest priority first
+        """
+        refs = list(self._glob_dict.get(pattern, ()))
+        refs.sort(key=lambda ref: ref.get_priority(), reverse=True)
+        return refs
+
+    def snapshot(self):
+        """Get a snapshot of the registry's current state, for monitoring.
+
+        No locks are taken (see `GlobbableDict.snapshot_items`), so this neither holds up nor waits for registration
+        or dispatch, but the numbers may be slightly out if registrations are happening at the same time.
+
+        :return:    A dict holding the number of keys and handlers, the number of handlers per key, the number of
+                    registered references whose callable has died but which haven't been unregistered yet, and the
+                    glob cache statistics (see `GlobbableDict.get_stats`)
+        """
+        handlers_per_key = {}
+        dead_references = 0
+        for pattern, refs in self._glob_dict.snapshot_items():
+            refs = list(refs)
+            handlers_per_key[pattern] = len(refs)
+            dead_references += sum(1 for ref in refs if not ref.get_callable())
+
+        return {'keys': len(handlers_per_key), 'handlers': sum(handlers_per_key.values()),
+                'handlers_per_key': handlers_per_key, 'dead_references': dead_references,
+                'glob_cache': self._glob_dict.get_stats()}
+
+    def get_cache_stats(self):
+        """Get result cache statistics for every registered callable with a cache.
+
+        :return:    A list of dicts, each holding the pattern and name of a handler along with its cache statistics
+        """
+        stats = []
+        for pattern, refs in self._glob_dict.snapshot_items():
+            for ref in list(refs):
+                cache = ref.get_cache()
+                fn = ref.get_callable()
+                if cache is not None and fn:
+                    cache_stats = cache.get_stats()
+                    cache_stats.update(pattern=pattern, handler=callable_name(fn))
+                    stats.append(cache_stats)
+
+        return stats
+
+    def get_breaker_stats(self):
+        """Get circuit breaker statistics for every registered callable with a breaker.
+
+        :return:    A list of dicts, each holding the pattern and name of a handler along with its breaker's state and
+                    statistics (see `CircuitBreaker.get_stats`)
+        """
+        stats = []
+        for pattern, refs in self._glob_dict.snapshot_items():
+            for ref in list(refs):
+                breaker = ref.get_circuit_breaker()
+                fn = ref.get_callable()
+                if breaker is not None and fn:
+                    breaker_stats = breaker.get_stats()
+                    breaker_stats.update(pattern=pattern, handler=callable_name(fn))
+                    stats.append(breaker_stats)
+
+        return stats
 
     def _unregister_proxy(self, pattern, callable_proxy):
         # in the common case, we should (obviously) always have a reference to both self and Registry. However,
         # if the vm is shutting down, then we may get a callback as stuff starts to get dereferenced, but
         # _our_ classes are not guarenteed to be around. if so, do the best we can given what we've got left.
         if Registry:
-            Registry._LOG.debug("Unregistering proxy %s for pattern %s" % (callable_proxy, pattern))
+            Registry._LOG.debug("Unregistering proxy %s for pattern %s", callable_proxy, pattern)
         if self:
-            self._glob_dict[pattern].remove(callable_proxy)
+            # this can be called from the garbage collector at any point, including while the lock's held by this
+            # thread, so the key is left in place (even if it's now empty) rather than risking a deadlock
+            (_, glob_dict) = self._shard_for(pattern)
+            refs = glob_dict.get(pattern)
+            if refs is not None:
+                refs.discard(callable_proxy)
+                glob_dict.touch([pattern])
+
+            for listener in self._listeners:
+                listener(pattern, callable_proxy, False)
+
+
+def _watch(target, callback):
+    """Weakly reference something, if it can be. If not, it's held on to instead, so it can't die (and have its id
+    reused) while we're watching it."""
+    try:
+        return ref(target, callback)
+    except TypeError:
+        return lambda: target
+
+
+class _CallableMask(object):
+    """Picks out the references to a single callable, for `Registry.mask`. Masks for the same callable are equal.
+
+    Callables are identified by id (see `callable_identity`), which a new object can reuse once the callable's gone, so
+    the callable is only weakly referenced: once it's gone, the mask matches nothing, and `callable_died` is called
+    with it so it can be removed.
+    """
+    __slots__ = ('_identity', '_targets', '__weakref__')
+
+    def __init__(self, fn, callable_died=None):
+        self._identity = callable_identity(fn)
+
+        callback = None
+        if callable_died is not None:
+            mask = ref(self)
+
+            def callback(_):
+                if mask() is not None:
+                    callable_died(mask())
+
+        # a bound method is made afresh each time it's looked up, so its instance and function are watched instead
+        if hasattr(fn, '__func__') and hasattr(fn, '__self__'):
+            self._targets = (_watch(fn.__self__, callback), _watch(fn.__func__, callback))
+        else:
+            self._targets = (_watch(fn, callback),)
+
+    def is_alive(self):
+        return all(target() is not None for target in self._targets)
+
+    def __call__(self, reference):
+        return reference.get_identity() == self._identity and self.is_alive()
+
+    def __eq__(self, other):
+        return other is self or \
+            (isinstance(other, _CallableMask) and other._identity == self._identity and
+             self.is_alive() and other.is_alive())
 
+    def __ne__(self, other):
+        return not self == other
 
-a = Registry()
+    def __hash__(self):
+        return hash(self._identity)
 
-logging.basicConfig(level=logging.DEBUG)
 
+class RegistrationScope(object):
+    """A group of registrations that are all removed together when the scope is closed.
 
-@a.wire("foo.bar")
-def ca(aa, b):
-        print("i sez: " + aa + b)
+    Intended for handlers that only live as long as something else does - a request, a tenant, a test. Closing the
+    scope removes all of its registrations in a single batch, along with any keys they leave empty, so a registry that
+    sees lots of short-lived scopes doesn't fill up with dead keys. Only the cached globs matching those keys are
+    invalidated.
 
-@a.wire("foo.baz")
-def cb(aa, b):
-    print("you sez: " + aa + b)
+    Use the scope as a context manager to have it closed automatically. Registrations made directly on the registry
+    aren't affected by closing the scope.
 
-@a.wire_class_instances
-class X(object):
-    def __init__(self, name):
-        self._name = name
+    :param registry:    The `Registry` to register with
+    """
+    def __init__(self, registry):
+        self._registry = registry
+        self._references = []
+        self._closed = False
 
-    def __del__(self):
-        print("going")
+    def __enter__(self):
+        return self
 
-    @a.wire_instance_method("foo.inner", strongly_reference=False)
-    def ina(self, aa, b):
-        print("inst: " + aa + b + " from " + self._name)
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
+    def __len__(self):
+        return len(self._references)
 
-def inner():
-    @a.wire("foo.moo")
-    def bla(aa, b):
-        print("whatevs: " + aa + b)
+    def register(self, pattern, fn, strongly_reference=False, priority=0, cache=None, rate_limit=None,
+                 circuit_breaker=None, dispatch_priority=None):
+        """Register a callable against a pattern, for as long as the scope is open. See `Registry.register`."""
+        if self._closed:
+            raise ValueError("The scope has been closed.")
 
-    a.with_filter("foo.*").call("x", "y")
+        reference = self._registry._add_reference(pattern, fn, strongly_reference, priority, cache, rate_limit,
+                                                  circuit_breaker, dispatch_priority)
+        self._references.append((pattern, reference))
 
+    def wire(self, pattern, strongly_reference=False, priority=0, cache=None, rate_limit=None, circuit_breaker=None,
+             dispatch_priority=None):
+        """Decorator to register a callable for as long as the scope is open. See `Registry.wire`."""
+        def decorator(fn):
+            self.register(pattern, fn, strongly_reference, priority, cache, rate_limit, circuit_breaker,
+                          dispatch_priority)
+            return fn
+        return decorator
 
-if __name__ == "__main__":
-    x_ref = X('a')
-    y_ref = X('b')
-    x_ref.ina("For", " Dave")
-    inner()
+    def close(self):
+        """Remove every registration made through this scope. Closing a scope more than once does nothing."""
+        if self._closed:
+            return
 
-    dispatcher = a.with_filter("foo.*")
-    dispatcher.call("hello", "world")
+        self._closed = True
+        (references, self._references) = (self._references, [])
+        self._registry._remove_references(references)
 
-    print("done")
\ No newline at end of file
+    def closed(self):
+        """
+        :return:    True if the scope has been closed
+        """
+        return self._closed
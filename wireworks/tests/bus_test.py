@@ -0,0 +1,176 @@
+__author__ = 'rob'
+
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import time
+import unittest
+
+from threading import Event as ThreadingEvent
+
+from wireworks.registry import Registry
+
+
+class _BrokenSocket(object):
+    """Wraps a socket, failing every write to it"""
+    def __init__(self, sock):
+        self._socket = sock
+
+    def sendall(self, data):
+        raise IOError(32, "Broken pipe")
+
+    def shutdown(self, how):
+        self._socket.shutdown(how)
+
+    def close(self):
+        self._socket.close()
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "Unix domain sockets aren't available")
+class BusTests(unittest.TestCase):
+    def setUp(self):
+        from wireworks.bus import Bus
+
+        self._directory = tempfile.mkdtemp()
+        self._local = Registry()
+        self._remote = Registry()
+        self._remote_seen = []
+
+        self._remote.register('orders.created', self._record, strongly_reference=True)
+
+        self._local_bus = Bus(self._local)
+        self._remote_bus = Bus(self._remote)
+        self._remote_bus.listen(os.path.join(self._directory, 'remote.sock'))
+        self._peer = self._local_bus.connect(self._remote_bus.get_path())
+        self.assertTrue(self._peer.wait_for_subscription('orders.created', timeout=5), "Subscription not forwarded")
+
+    def tearDown(self):
+        self._local_bus.close()
+        self._remote_bus.close()
+        shutil.rmtree(self._directory)
+
+    def _record(self, *args):
+        self._remote_seen.append(args)
+        return 'remote %s' % (args,)
+
+    def test_call(self):
+        """Check that a dispatch reaches the sibling's handlers, and their results come back on the Event"""
+
+        self._local.register('orders.created', lambda *args: 'local', strongly_reference=True, priority=1)
+
+        event = self._local.with_filter('orders.*').call(42)
+
+        self.assertEqual(2, len(event.await_all(timeout=5)), "Not every call completed")
+        self.assertListEqual(['local', ['remote (42,)']], [future.result() for future in event.get_all_futures()])
+        self.assertListEqual([(42,)], self._remote_seen)
+
+    def test_exception(self):
+        """Check that an exception raised by the sibling's handler is raised from the Future"""
+
+        def failing(*args):
+            raise KeyError(args)
+
+        self._remote.register('orders.failed', failing, strongly_reference=True)
+        self.assertTrue(self._peer.wait_for_subscription('orders.failed', timeout=5), "Subscription not forwarded")
+
+        event = self._local.with_filter('orders.failed').call(1)
+
+        self.assertRaises(KeyError, event.first_result, 5)
+
+    def test_only_subscribed_patterns(self):
+        """Check that subscriptions follow the sibling's registrations, so it's only sent what it has handlers for"""
+
+        self.assertListEqual(['orders.created'], self._peer.get_subscriptions())
+        self.assertListEqual([], self._local.with_filter('users.*').call(1).get_all_futures(), "Unhandled call sent")
+
+        with self._remote.scope() as scope:
+            scope.register('users.created', self._record, strongly_reference=True)
+            self.assertTrue(self._peer.wait_for_subscription('users.created', timeout=5), "Subscription not forwarded")
+
+        deadline = time.time() + 5
+        while 'users.created' in self._peer.get_subscriptions() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertListEqual(['orders.created'], self._peer.get_subscriptions(), "Unsubscription not forwarded")
+
+    def test_emit(self):
+        """Check that emitted events are sent to the sibling without waiting for a reply"""
+
+        received = ThreadingEvent()
+        self._remote.register('orders.created', lambda *args: received.set(), strongly_reference=True)
+
+        self._local.with_filter('orders.created').emit(1)
+
+        self.assertTrue(received.wait(5), "Emitted event not received")
+
+    def test_no_echo(self):
+        """Check that subscriptions standing in for one sibling aren't forwarded on to another"""
+
+        from wireworks.bus import Bus
+
+        third = Registry()
+        with Bus(third) as third_bus:
+            self._local_bus.listen(os.path.join(self._directory, 'local.sock'))
+            third_peer = third_bus.connect(self._local_bus.get_path())
+
+            self._local.register('local.only', lambda: None, strongly_reference=True)
+            self.assertTrue(third_peer.wait_for_subscription('local.only', timeout=5), "Subscription not forwarded")
+            self.assertListEqual(['local.only'], third_peer.get_subscriptions())
+
+    def test_connection_lost(self):
+        """Check that losing the sibling unregisters its subscriptions"""
+
+        self._remote_bus.close()
+
+        deadline = time.time() + 5
+        while not self._peer.closed() and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertTrue(self._peer.closed(), "Lost connection not noticed")
+        self.assertListEqual([], self._local.with_filter('orders.*').call(1).get_all_futures())
+
+    def test_socket_file(self):
+        """Check that the socket is only accessible to its owner, and that only stale sockets are replaced"""
+        from wireworks.bus import Bus
+
+        path = self._remote_bus.get_path()
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+
+        with Bus(Registry()) as other_bus:
+            self.assertRaises(OSError, other_bus.listen, path)
+
+            not_socket = os.path.join(self._directory, 'file')
+            open(not_socket, 'w').close()
+            self.assertRaises(OSError, other_bus.listen, not_socket)
+
+            stale = os.path.join(self._directory, 'stale.sock')
+            stale_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale_socket.bind(stale)
+            stale_socket.close()
+            other_bus.listen(stale)
+            self.assertEqual(stale, other_bus.get_path())
+
+        self.assertTrue(os.path.exists(path), "Closing a bus that couldn't listen removed another's socket")
+
+    def test_send_failure(self):
+        """Check that a failed write fails every call waiting for a reply on the connection"""
+        from wireworks.bus import RemoteError
+
+        gate = ThreadingEvent()
+        self._remote.register('orders.slow', lambda: gate.wait(5), strongly_reference=True)
+        peer = self._local_bus.connect(self._remote_bus.get_path(), connections=1)
+        self.assertTrue(peer.wait_for_subscription('orders.slow', timeout=5), "Subscription not forwarded")
+
+        try:
+            waiting = peer.call('orders.slow', (), {})
+            connection = peer._connections[0]
+            connection._socket = _BrokenSocket(connection._socket)
+            failed = peer.call('orders.slow', (), {})
+
+            self.assertIsInstance(failed.exception(5), RemoteError)
+            self.assertIsInstance(waiting.exception(5), RemoteError)
+            self.assertIn("Broken pipe", str(waiting.exception()))
+            self.assertTrue(peer.closed())
+        finally:
+            gate.set()
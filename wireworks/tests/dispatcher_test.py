@@ -0,0 +1,581 @@
+__author__ = 'rob'
+
+import time
+import unittest
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Event as ThreadingEvent
+
+from wireworks.dispatcher import CoalescingDispatcher
+from wireworks.event import EventPool
+from wireworks.instrumentation import HistogramInstrumentation
+from wireworks.registry import Registry
+from wireworks.util.circuit_breaker import CircuitBreaker, CircuitOpen
+from wireworks.util.priority_executor import PriorityExecutor, HIGH, LOW
+from wireworks.util.rate_limiter import CallRejected, RateLimiter
+
+
+class CoalescingDispatcherTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._seen = []
+
+        def handler(*args, **kwargs):
+            self._seen.append(args)
+
+        self._handler = handler
+        self._registry.register('a.b', handler, strongly_reference=True)
+
+    def test_window_merges_calls(self):
+        """Check that calls within the window share a single dispatch"""
+
+        dispatcher = self._registry.with_filter('a.*').with_coalescing(window=60)
+
+        first = dispatcher.call(1)
+        second = dispatcher.call(2)
+
+        self.assertIs(first, second, "Merged calls were given different events")
+        self.assertListEqual([(1,)], self._seen, "Merged call was dispatched")
+
+    def test_no_window_merges_until_complete(self):
+        """Check that without a window, calls are only merged while the earlier dispatch is in progress"""
+
+        dispatcher = self._registry.with_filter('a.*').with_coalescing()
+        dispatcher.call(1)
+        dispatcher.call(2)
+
+        self.assertListEqual([(1,), (2,)], self._seen, "Call after completion was merged")
+
+        future = Future()
+
+        class PendingExecutor(object):
+            def submit(self, fn, *args, **kwargs):
+                return future
+
+        dispatcher = dispatcher.with_executor(PendingExecutor())
+        first = dispatcher.call(3)
+        self.assertIs(first, dispatcher.call(4), "Call during an in-progress dispatch was not merged")
+
+        future.set_result(None)
+        self.assertIsNot(first, dispatcher.call(5), "Call after completion was merged")
+
+    def test_merged_calls_wait_for_dispatch(self):
+        """Check that a call merged into a dispatch that's still submitting gets the Event once it has every Future"""
+
+        submitting = ThreadingEvent()
+        release = ThreadingEvent()
+
+        class SlowExecutor(object):
+            def submit(self, fn, *args, **kwargs):
+                submitting.set()
+                release.wait(5)
+                future = Future()
+                future.set_result(fn(*args, **kwargs))
+                return future
+
+        dispatcher = self._registry.with_filter('a.*').with_coalescing(window=60).with_executor(SlowExecutor())
+        with ThreadPoolExecutor(2) as pool:
+            first = pool.submit(dispatcher.call, 1)
+            self.assertTrue(submitting.wait(5))
+            merged = pool.submit(dispatcher.call, 2)
+
+            time.sleep(0.05)
+            self.assertFalse(merged.done(), "Merged call didn't wait for the dispatch to start")
+            release.set()
+
+            self.assertIs(first.result(5), merged.result(5))
+            self.assertEqual(1, len(merged.result().get_all_futures()), "Merged call got an unstarted Event")
+
+    def test_reentrant_merged_call(self):
+        """Check that a handler run synchronously can make a call that's merged into its own dispatch"""
+
+        dispatcher = self._registry.with_filter('x.*').with_coalescing(window=60)
+        inner = []
+        self._registry.register('x.y', lambda: inner.append(dispatcher.call()), strongly_reference=True)
+
+        outer = dispatcher.call()
+
+        self.assertListEqual([outer], inner, "Reentrant call wasn't merged")
+
+    def test_window_expiry(self):
+        """Check that calls after the window has expired are dispatched again"""
+
+        dispatcher = self._registry.with_filter('a.*').with_coalescing(window=0.01)
+        first = dispatcher.call(1)
+        time.sleep(0.02)
+
+        self.assertIsNot(first, dispatcher.call(2), "Call after the window was merged")
+        self.assertListEqual([(1,), (2,)], self._seen, "Call after the window was not dispatched")
+
+    def test_key_on_args(self):
+        """Check that only calls with equal arguments are merged when keying on args"""
+
+        dispatcher = self._registry.with_filter('a.*').with_coalescing(window=60, key_on_args=True)
+
+        self.assertIs(dispatcher.call(1), dispatcher.call(1), "Calls with equal args were not merged")
+        self.assertIsNot(dispatcher.call(1), dispatcher.call(2), "Calls with different args were merged")
+        self.assertIsNot(dispatcher.call([1]), dispatcher.call([1]), "Calls with unhashable args were merged")
+        self.assertListEqual([(1,), (2,), ([1],), ([1],)], self._seen, "Incorrect calls dispatched")
+
+    def test_derived_dispatchers_keep_coalescing(self):
+        """Check that filtering a coalescing dispatcher gives another coalescing dispatcher"""
+
+        dispatcher = self._registry.with_coalescing(window=60).with_filter('a.*')
+
+        self.assertIsInstance(dispatcher, CoalescingDispatcher)
+        self.assertIs(dispatcher.call(1), dispatcher.call(2), "Calls were not merged")
+
+
+class PooledDispatchTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._seen = []
+        self._registry.register('a.b', self._seen.append, strongly_reference=True)
+
+    def test_events_reused(self):
+        """Check that pooled dispatches invoke handlers, and hand their Event back to the pool"""
+
+        pool = EventPool()
+        dispatcher = self._registry.with_filter('a.*').with_event_pool(pool)
+
+        dispatcher.call_pooled(1)
+        self.assertEqual(1, len(pool), "Event not returned to the pool")
+
+        dispatcher.call_pooled(2)
+        self.assertEqual(1, len(pool), "Event not reused")
+        self.assertListEqual([1, 2], self._seen)
+
+    def test_event_released_once_complete(self):
+        """Check that an Event only goes back to the pool once its callables have completed"""
+
+        future = Future()
+
+        class PendingExecutor(object):
+            def submit(self, fn):
+                fn()
+                return future
+
+        pool = EventPool()
+        dispatcher = self._registry.with_filter('a.*').with_executor(PendingExecutor()).with_event_pool(pool)
+
+        dispatcher.call_pooled(1)
+        self.assertEqual(0, len(pool), "Event returned to the pool before completion")
+
+        future.set_result(None)
+        self.assertEqual(1, len(pool), "Event not returned to the pool on completion")
+
+    def test_without_pool(self):
+        """Check that call_pooled still dispatches when there's no pool"""
+
+        self._registry.with_filter('a.*').call_pooled(1)
+        self.assertListEqual([1], self._seen)
+
+
+class EmitTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._seen = []
+        self._errors = []
+
+        def failing(*args):
+            raise KeyError(args)
+
+        self._failing = failing
+        self._registry.register('a.b', failing, strongly_reference=True, priority=1)
+        self._registry.register('a.b', self._seen.append, strongly_reference=True)
+
+    def _sink(self, handler, error):
+        self._errors.append((handler, error))
+
+    def test_errors_go_to_sink(self):
+        """Check that emit calls every handler, handing errors to the sink rather than raising them"""
+
+        result = self._registry.with_filter('a.*').with_error_sink(self._sink).emit(1)
+
+        self.assertIsNone(result, "emit returned something")
+        self.assertListEqual([1], self._seen, "Handler after the failing one not called")
+        self.assertEqual(1, len(self._errors), "Error not passed to the sink")
+        self.assertIs(self._failing, self._errors[0][0], "Wrong handler passed to the sink")
+        self.assertIsInstance(self._errors[0][1], KeyError)
+
+    def test_executor(self):
+        """Check that emit submits handlers to the executor, still handing errors to the sink"""
+
+        pool = ThreadPoolExecutor(max_workers=2)
+        try:
+            self._registry.with_filter('a.*').with_executor(pool).with_error_sink(self._sink).emit(1)
+        finally:
+            pool.shutdown()
+
+        self.assertListEqual([1], self._seen, "Handler not called")
+        self.assertEqual(1, len(self._errors), "Error not passed to the sink")
+
+    def test_instrumentation(self):
+        """Check that handlers called from emit are reported to the instrumentation"""
+
+        instrumentation = HistogramInstrumentation()
+        dispatcher = self._registry.with_filter('a.*').with_error_sink(self._sink)
+        dispatcher.with_instrumentation(instrumentation).emit(1)
+
+        handlers = instrumentation.snapshot()['a.*']['handlers']
+        self.assertEqual(2, len(handlers), "Handlers not reported")
+        self.assertEqual([0, 1], sorted(stats['errors'] for stats in handlers.values()), "Error not reported")
+        self.assertEqual(1, len(self._errors), "Error not passed to the sink")
+
+
+class DeduplicationTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._seen = []
+
+        def handler(*args):
+            self._seen.append(('handler', args))
+
+        def other(*args):
+            self._seen.append(('other', args))
+
+        self._handler = handler
+        self._other = other
+        self._registry.register('a.b', handler, strongly_reference=True)
+        self._registry.register('a.c', handler, strongly_reference=True, priority=2)
+        self._registry.register('a.b', other, strongly_reference=True, priority=1)
+
+    def test_called_once(self):
+        """Check that a callable registered under several matching keys is called once, at its highest priority"""
+
+        self._registry.with_filter('a.*').call(1).await_all()
+
+        self.assertListEqual([('handler', (1,)), ('other', (1,))], self._seen)
+
+    def test_per_key(self):
+        """Check that deduplication can be turned off, calling the callable once per matching key"""
+
+        self._registry.with_filter('a.*').with_deduplication(False).call(1).await_all()
+
+        self.assertListEqual([('handler', (1,)), ('other', (1,)), ('handler', (1,))], self._seen)
+
+    def test_plan_invalidated(self):
+        """Check that registering under a key that's already there is picked up by the next dispatch"""
+
+        dispatcher = self._registry.with_filter('a.*')
+        dispatcher.call(1).await_all()
+
+        def late(*args):
+            self._seen.append(('late', args))
+
+        self._registry.register('a.b', late, strongly_reference=True, priority=3)
+        del self._seen[:]
+        dispatcher.call(2).await_all()
+
+        self.assertListEqual([('late', (2,)), ('handler', (2,)), ('other', (2,))], self._seen)
+
+    def test_bound_methods(self):
+        """Check that the same method of the same instance, reached through several keys, is called once"""
+
+        seen = self._seen
+
+        class Receiver(object):
+            def receive(self, arg):
+                seen.append(('receiver', (arg,)))
+
+        receiver = Receiver()
+        self._registry.register('b.c', receiver.receive)
+        self._registry.register('b.d', receiver.receive)
+
+        self._registry.with_filter('b.*').call(1).await_all()
+
+        self.assertListEqual([('receiver', (1,))], self._seen)
+
+
+class RateLimitTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._seen = []
+
+    def test_handler_limit(self):
+        """Check that calls beyond a handler's burst are shed, and show up in the Event as rejected"""
+
+        self._registry.register('payments.charge', self._seen.append, strongly_reference=True,
+                                rate_limit=RateLimiter(rate=0.001, burst=2))
+        dispatcher = self._registry.with_filter('payments.*')
+
+        events = [dispatcher.call(index) for index in range(3)]
+
+        self.assertListEqual([0, 1], self._seen)
+        self.assertListEqual([], events[1].get_rejected_futures())
+        rejected = events[2].get_rejected_futures()
+        self.assertEqual(1, len(rejected))
+        self.assertIsInstance(rejected[0].exception(), CallRejected)
+        self.assertEqual('rate', rejected[0].exception().reason)
+
+    def test_pattern_limit(self):
+        """Check that a limit set for a glob is shared by every handler registered under it, before or after, and
+        leaves other handlers alone"""
+
+        limiter = self._registry.limit('payments.*', RateLimiter(rate=0.001, burst=3))
+        self._registry.register('payments.charge', self._seen.append, strongly_reference=True)
+        self._registry.register('orders.created', self._seen.append, strongly_reference=True)
+        self._registry.register('payments.refund', self._seen.append, strongly_reference=True)
+
+        for index in range(2):
+            self._registry.with_filter('*.*').call(index)
+
+        self.assertEqual(5, len(self._seen), "Expected 3 payment calls and 2 order calls")
+        self.assertEqual({'admitted': 3, 'rejected': 1, 'pending': 0, 'tokens': limiter.get_stats()['tokens'],
+                          'pattern': 'payments.*'}, self._registry.get_limit_stats()[0])
+
+        self._registry.limit('payments.*', None)
+        del self._seen[:]
+        self._registry.with_filter('payments.*').call('unlimited')
+        self.assertEqual(2, len(self._seen), "Limit not removed")
+
+    def test_max_pending(self):
+        """Check that calls are shed while too many are in flight, and admitted again once they've completed"""
+
+        release = ThreadingEvent()
+        self._registry.register('slow.call', lambda: release.wait(5), strongly_reference=True,
+                                rate_limit=RateLimiter(max_pending=2))
+        pool = ThreadPoolExecutor(max_workers=4)
+        try:
+            dispatcher = self._registry.with_filter('slow.call').with_executor(pool)
+            events = [dispatcher.call() for _ in range(3)]
+
+            self.assertEqual('pending', events[2].get_rejected_futures()[0].exception().reason)
+
+            release.set()
+            events[0].await_all()
+            events[1].await_all()
+            self.assertListEqual([], dispatcher.call().get_rejected_futures(), "Completed calls not released")
+        finally:
+            release.set()
+            pool.shutdown()
+
+    def test_emit(self):
+        """Check that emit sheds calls too, handing them to the error sink"""
+
+        errors = []
+        self._registry.register('a.b', self._seen.append, strongly_reference=True, rate_limit=RateLimiter(0.001))
+        dispatcher = self._registry.with_filter('a.b').with_error_sink(lambda handler, error: errors.append(error))
+
+        dispatcher.emit(1)
+        dispatcher.emit(2)
+        dispatcher.with_instrumentation(HistogramInstrumentation()).emit(3)
+
+        self.assertListEqual([1], self._seen)
+        self.assertListEqual([CallRejected, CallRejected], [type(error) for error in errors])
+
+    def test_cached_results_not_limited(self):
+        """Check that calls served from a result cache don't use up the limit"""
+
+        self._registry.register('a.b', lambda value: value * 2, strongly_reference=True, cache=True,
+                                rate_limit=RateLimiter(0.001))
+
+        results = [self._registry.with_filter('a.b').call(1).first_result() for _ in range(3)]
+
+        self.assertListEqual([2, 2, 2], results)
+
+
+    def test_shared_handler(self):
+        """Check that overlapping calls through the same Handler each keep their own admission and cache key"""
+
+        from wireworks.handler import Handler
+
+        limiter = RateLimiter(max_pending=2)
+        self._registry.register('a.b', lambda value: value * 2, strongly_reference=True, cache=True,
+                                rate_limit=limiter)
+        handler = Handler.for_reference(self._registry.get_references('a.b')[0])
+
+        (_, first) = handler.try_short_circuit((1,), {})
+        (_, second) = handler.try_short_circuit((2,), {})
+        self.assertEqual(2, limiter.get_stats()['pending'])
+        self.assertEqual(4, second(2))
+        self.assertEqual(2, first(1))
+
+        self.assertEqual(0, limiter.get_stats()['pending'], "Calls not released")
+        self.assertListEqual([2, 4], [handler.try_short_circuit((value,), {})[0].result() for value in (1, 2)],
+                             "Results cached under the wrong keys")
+
+class PriorityDispatchTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._order = []
+        self._gate = ThreadingEvent()
+        self._executor = PriorityExecutor(max_workers=1)
+
+        started = ThreadingEvent()
+
+        def block():
+            started.set()
+            self._gate.wait(5)
+
+        # holds up the only worker, so that everything dispatched queues up behind it
+        self._executor.submit(block)
+        started.wait(5)
+
+        def handler(name):
+            self._order.append(name)
+
+        self._handler = handler
+
+    def tearDown(self):
+        self._gate.set()
+        self._executor.shutdown()
+
+    def _finish(self):
+        self._gate.set()
+        self._executor.shutdown()
+
+    def test_with_priority(self):
+        """Check that urgent dispatches overtake bulk ones queued ahead of them"""
+
+        self._registry.register('a.b', self._handler)
+        dispatcher = self._registry.with_filter('a.b').with_executor(self._executor)
+
+        dispatcher.with_priority(LOW).call('bulk 1')
+        dispatcher.with_priority(LOW).emit('bulk 2')
+        dispatcher.call('normal')
+        dispatcher.with_priority(HIGH).call('urgent')
+        self._finish()
+
+        self.assertListEqual(['urgent', 'normal', 'bulk 1', 'bulk 2'], self._order)
+
+    def test_dispatch_priority(self):
+        """Check that handlers registered with a dispatch priority are submitted at it, unless the dispatcher's
+        priority was set explicitly"""
+
+        def urgent_handler(name):
+            self._order.append('urgent ' + name)
+
+        self._registry.register('a.b', self._handler, priority=1)
+        self._registry.register('a.b', urgent_handler, dispatch_priority=HIGH)
+        dispatcher = self._registry.with_filter('a.b').with_executor(self._executor)
+
+        dispatcher.call('first')
+        dispatcher.call('second')
+        dispatcher.with_priority(LOW).call('third')
+        self._finish()
+
+        self.assertListEqual(['urgent first', 'urgent second', 'first', 'second', 'third', 'urgent third'],
+                             self._order)
+
+    def test_other_executors(self):
+        """Check that priorities are ignored by executors without lanes"""
+
+        self._registry.register('a.b', self._handler, dispatch_priority=HIGH)
+
+        self._registry.with_filter('a.b').with_priority(LOW).call('now')
+
+        self.assertListEqual(['now'], self._order)
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._calls = []
+        self._failing = True
+
+        def flaky(value):
+            self._calls.append(value)
+            if self._failing:
+                raise ValueError(value)
+            return value
+
+        self._flaky = flaky
+
+    def test_tripped_handler_skipped(self):
+        """Check that a handler that keeps raising is skipped once its breaker trips, showing up as rejected"""
+
+        self._registry.register('a.b', self._flaky, strongly_reference=True, circuit_breaker=2)
+        dispatcher = self._registry.with_filter('a.b')
+
+        for index in range(2):
+            self.assertIsInstance(dispatcher.call(index).get_all_futures()[0].exception(), ValueError)
+        event = dispatcher.call(2)
+
+        self.assertListEqual([0, 1], self._calls, "Handler called once its breaker was open")
+        self.assertIsInstance(event.get_rejected_futures()[0].exception(), CircuitOpen)
+        self.assertEqual([{'pattern': 'a.b', 'handler': self._flaky.__module__ + '.' + _name(self._flaky),
+                           'state': 'open', 'failures': 2, 'trips': 1, 'skipped': 1}],
+                         self._registry.get_breaker_stats())
+
+    def test_fallback(self):
+        """Check that calls go to the fallback while the breaker is open, and back to the handler once a probe
+        succeeds"""
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05, fallback=lambda value: 'fallback')
+        self._registry.register('a.b', self._flaky, strongly_reference=True, circuit_breaker=breaker)
+        dispatcher = self._registry.with_filter('a.b')
+
+        dispatcher.call(0)
+        self.assertEqual('fallback', dispatcher.call(1).first_result())
+
+        time.sleep(0.1)
+        self._failing = False
+        self.assertEqual(2, dispatcher.call(2).first_result(), "Probe not let through")
+        self.assertEqual('closed', breaker.get_state())
+        self.assertListEqual([0, 2], self._calls)
+
+    def test_threaded_and_emitted(self):
+        """Check that outcomes are recorded for calls run on an executor, and that emit skips tripped handlers"""
+
+        errors = []
+        self._registry.register('a.b', self._flaky, strongly_reference=True, circuit_breaker=1)
+        pool = ThreadPoolExecutor(max_workers=2)
+        try:
+            self._registry.with_filter('a.b').with_executor(pool).call(0).await_all()
+        finally:
+            pool.shutdown()
+
+        self._registry.with_filter('a.b').with_error_sink(lambda handler, error: errors.append(error)).emit(1)
+
+        self.assertListEqual([0], self._calls)
+        self.assertListEqual([CircuitOpen], [type(error) for error in errors])
+
+    def test_slow_calls(self):
+        """Check that calls taking longer than the call timeout count as failures"""
+
+        self._registry.register('a.b', lambda: time.sleep(0.02), strongly_reference=True,
+                                circuit_breaker=CircuitBreaker(failure_threshold=1, call_timeout=0.01))
+
+        self._registry.with_filter('a.b').call()
+
+        self.assertEqual(1, len(self._registry.with_filter('a.b').call().get_rejected_futures()))
+
+
+    def test_hung_calls(self):
+        """Check that a call that never returns trips the breaker once it's run past the call timeout"""
+
+        gate = ThreadingEvent()
+        self._registry.register('a.b', lambda: gate.wait(5), strongly_reference=True,
+                                circuit_breaker=CircuitBreaker(failure_threshold=1, call_timeout=0.05))
+        pool = ThreadPoolExecutor(max_workers=2)
+        try:
+            hung = self._registry.with_filter('a.b').with_executor(pool).call()
+            time.sleep(0.1)
+
+            event = self._registry.with_filter('a.b').with_executor(pool).call()
+
+            self.assertFalse(hung.get_all_futures()[0].done())
+            self.assertIsInstance(event.get_rejected_futures()[0].exception(), CircuitOpen)
+        finally:
+            gate.set()
+            pool.shutdown()
+
+def _name(fn):
+    return getattr(fn, '__qualname__', fn.__name__)
+
+
+class ScheduledDispatchTests(unittest.TestCase):
+    def test_call_later(self):
+        """Check that a delayed dispatch happens, and its Event is available from the handle"""
+
+        registry = Registry()
+        called = ThreadingEvent()
+        registry.register('a.b', lambda: called.set() or 'result', strongly_reference=True)
+
+        handle = registry.with_filter('a.*').call_later(0.01)
+
+        self.assertTrue(called.wait(2), "Delayed dispatch did not happen")
+        while not handle.get_call_count():
+            time.sleep(0.001)
+        self.assertEqual('result', handle.get_result().first_result(0))
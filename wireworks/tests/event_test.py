@@ -1,12 +1,17 @@
 __author__ = 'rob'
 
+import gc
 import time
 import unittest
+import weakref
 
 from collections import namedtuple
-from concurrent.futures import Executor, Future
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, TimeoutError
 
-from wireworks.event import Event
+from wireworks.event import Event, EventGroup, LazyEvent, ReducingEvent
+from wireworks.instrumentation import Instrumentation
+from wireworks.tracing import RingBufferTracer, set_tracer
+from wireworks.util.synchronous_executor import SynchronousExecutor
 
 
 class TestExecutor(Executor):
@@ -96,6 +101,20 @@ class EventTests(unittest.TestCase):
 
         self.assertListEqual(futures, evt.get_all_futures(), "Not all futures were returned")
 
+    def test_get_completed_futures(self):
+        """Test that completed futures are listed in the order they completed in"""
+
+        futures = [Future(), Future(), Future()]
+
+        fns = [self._exec.make_expected_function_call() for _ in futures]
+
+        self._exec.set_futures_to_return(futures)
+        evt = self._make_event(fns).go()
+        futures[2].set_result(2)
+        futures[0].set_result(0)
+
+        self.assertListEqual([futures[2], futures[0]], evt.get_completed_futures())
+
     def test_multiple_gos_not_allowed(self):
         """Test that an event dispatch can't be started twice"""
 
@@ -157,3 +176,272 @@ class EventTests(unittest.TestCase):
         future2.set_result("WOOT")
 
         self.assertListEqual([future2], evt.await_all(0), "Single future was not returned after cancel/complete")
+
+    def test_first_matching(self):
+        """Test that the first result satisfying the predicate is returned, ignoring anything else"""
+
+        future1 = Future()
+        future2 = Future()
+
+        evt = self._make_event([self._exec.make_expected_function_call(future1),
+                                self._exec.make_expected_function_call(future2)])
+        evt.go()
+
+        self.assertIsNone(evt.first_matching(lambda val: val > 1, 0), "Nothing completed, yet something returned")
+
+        future1.set_result(1)
+        future2.set_result(2)
+
+        self.assertEqual(2, evt.first_matching(lambda val: val > 1, 0), "Matching result was not returned")
+        self.assertIsNone(evt.first_matching(lambda val: val > 2, 0), "Nothing matched, yet something returned")
+
+
+class LazyEventTests(unittest.TestCase):
+    def setUp(self):
+        self._invoked = []
+
+    def _make_callable(self, name, result=None):
+        def fn(*args, **kwargs):
+            self._invoked.append(name)
+            return result
+        return fn
+
+    def test_nothing_invoked_on_go(self):
+        """Check that no callables are invoked until a result is asked for"""
+
+        evt = LazyEvent([self._make_callable('a')], SynchronousExecutor()).go()
+
+        self.assertListEqual([], self._invoked, "Callables invoked before results were requested")
+        self.assertListEqual([], evt.get_all_futures(), "Futures created before results were requested")
+
+    def test_first_result_short_circuits(self):
+        """Check that first_result only invokes the first callable"""
+
+        evt = LazyEvent([self._make_callable('a', 1), self._make_callable('b', 2)], SynchronousExecutor()).go()
+
+        self.assertEqual(1, evt.first_result(), "Incorrect first result")
+        self.assertListEqual(['a'], self._invoked, "Unneeded callables were invoked")
+
+    def test_first_matching_short_circuits(self):
+        """Check that first_matching stops invoking callables as soon as a result matches"""
+
+        evt = LazyEvent([self._make_callable('a', None), self._make_callable('b', 2), self._make_callable('c', 3)],
+                        SynchronousExecutor()).go()
+
+        self.assertEqual(2, evt.first_matching(lambda val: val is not None), "Incorrect matching result")
+        self.assertListEqual(['a', 'b'], self._invoked, "Unneeded callables were invoked")
+
+        # asking again shouldn't re-invoke anything
+        self.assertEqual(2, evt.first_matching(lambda val: val is not None), "Incorrect matching result")
+        self.assertListEqual(['a', 'b'], self._invoked, "Callables were invoked more than once")
+
+    def test_iteration_invokes_on_demand(self):
+        """Check that iterating the event invokes each callable as its result is consumed"""
+
+        evt = LazyEvent([self._make_callable('a', 1), self._make_callable('b', 2)], SynchronousExecutor()).go()
+        results = iter(evt)
+
+        self.assertEqual(1, next(results))
+        self.assertListEqual(['a'], self._invoked, "Callable invoked before its result was consumed")
+        self.assertEqual(2, next(results))
+        self.assertRaises(StopIteration, next, results)
+
+    def test_cancel_stops_invocation(self):
+        """Check that cancelling prevents any further callables being invoked"""
+
+        evt = LazyEvent([self._make_callable('a', 1), self._make_callable('b', 2)], SynchronousExecutor()).go()
+        evt.first_result()
+        evt.try_cancel_pending_calls()
+
+        self.assertListEqual([1], list(evt), "Cancelled callables were invoked")
+        self.assertListEqual(['a'], self._invoked, "Cancelled callables were invoked")
+
+    def test_await_all_invokes_everything(self):
+        """Check that await_all invokes all remaining callables"""
+
+        evt = LazyEvent([self._make_callable('a'), self._make_callable('b')], SynchronousExecutor()).go()
+
+        self.assertEqual(2, len(evt.await_all()), "Not all futures were returned")
+        self.assertListEqual(['a', 'b'], self._invoked, "Not all callables were invoked")
+
+    def test_exceptions_raised(self):
+        """Check that exceptions from invoked callables are raised from first_result"""
+
+        def fn():
+            raise KeyError()
+
+        evt = LazyEvent([fn], SynchronousExecutor()).go()
+
+        self.assertRaises(KeyError, evt.first_result)
+
+
+class ReducingEventTests(unittest.TestCase):
+    def test_results_reduced(self):
+        """Check that all results are folded into the reduced value"""
+
+        evt = ReducingEvent([lambda: 1, lambda: 2, lambda: 3], SynchronousExecutor(), lambda acc, val: acc + val, 10)
+        evt.go()
+
+        self.assertTrue(evt.done(), "Synchronous reduction not done")
+        self.assertEqual(16, evt.result(0), "Incorrect reduced value")
+        self.assertListEqual([], evt.get_all_futures(), "Futures were held on to")
+
+    def test_exceptions_collected(self):
+        """Check that exceptions are collected rather than reduced"""
+
+        def fn():
+            raise KeyError()
+
+        evt = ReducingEvent([lambda: 1, fn], SynchronousExecutor(), lambda acc, val: acc + val, 0).go()
+
+        self.assertEqual(1, evt.result(0), "Incorrect reduced value")
+        self.assertEqual(1, len(evt.get_exceptions()), "Exception not collected")
+        self.assertIsInstance(evt.get_exceptions()[0], KeyError)
+
+    def test_result_waits_for_completion(self):
+        """Check that result() waits for outstanding futures, and gives up after the timeout"""
+
+        future = Future()
+        executor = TestExecutor()
+        executor.set_futures_to_return([future])
+
+        evt = ReducingEvent([lambda: None], executor, lambda acc, val: acc + val, 0).go()
+
+        self.assertFalse(evt.done(), "Reduction done with outstanding futures")
+        self.assertEqual(0, evt.result(0.1), "Incorrect partially reduced value")
+
+        future.set_result(5)
+
+        self.assertTrue(evt.done(), "Reduction not done after all futures completed")
+        self.assertEqual(5, evt.result(0), "Incorrect reduced value")
+
+
+class EventGroupTests(unittest.TestCase):
+    def setUp(self):
+        self._futures = [Future() for _ in range(5)]
+        executor = TestExecutor()
+        executor.set_futures_to_return(self._futures)
+
+        events = [Event([lambda: None] * 2, executor).go(), Event([lambda: None] * 3, executor).go()]
+        self._group = EventGroup(events)
+
+    def test_wait_all(self):
+        """Check that wait_all waits for the calls of every event, handing them back in the order they completed"""
+
+        self.assertEqual(5, len(self._group))
+        for index in (3, 0, 4):
+            self._futures[index].set_result(index)
+
+        self.assertListEqual([], self._group.wait_all(0.05)[3:], "Incomplete futures returned")
+        self.assertFalse(self._group.done())
+
+        self._futures[1].cancel()
+        self._futures[2].set_result(2)
+
+        self.assertListEqual([self._futures[i] for i in (3, 0, 4, 2)], self._group.wait_all(0))
+        self.assertTrue(self._group.done())
+        self.assertEqual(5, self._group.get_completed_count())
+
+    def test_wait_any(self):
+        """Check that wait_any returns as soon as enough calls have completed, not counting cancelled ones"""
+
+        self._futures[4].cancel()
+        self._futures[2].set_result(2)
+
+        self.assertListEqual([self._futures[2]], self._group.wait_any(timeout=1))
+        self.assertListEqual([self._futures[2]], self._group.wait_any(2, timeout=0.05), "Waited past the timeout")
+
+        self._futures[0].set_result(0)
+        self._futures[1].set_result(1)
+
+        self.assertListEqual([self._futures[2], self._futures[0]], self._group.wait_any(2))
+
+    def test_as_completed(self):
+        """Check that as_completed yields calls as they complete, including those of events added on the way, and
+        gives up at the deadline"""
+
+        self._futures[1].set_result(1)
+        iterator = self._group.as_completed(timeout=5)
+        self.assertIs(self._futures[1], next(iterator))
+
+        late = Future()
+        executor = TestExecutor()
+        executor.set_futures_to_return([late])
+        self._group.add(Event([lambda: None], executor).go())
+
+        pool = ThreadPoolExecutor(max_workers=1)
+        try:
+            pool.submit(lambda: [time.sleep(0.01) or future.set_result(None)
+                                 for future in [late] + self._futures[2:] + self._futures[:1]])
+            self.assertListEqual([late] + self._futures[2:] + self._futures[:1], list(iterator))
+        finally:
+            pool.shutdown()
+
+        self.assertRaises(TimeoutError, list, EventGroup([Event([lambda: None], TestExecutor()).go()])
+                          .as_completed(timeout=0.01))
+
+    def test_threaded_dispatch(self):
+        """Check that a group waits on calls run by a threadpool"""
+
+        pool = ThreadPoolExecutor(max_workers=4)
+        try:
+            group = EventGroup()
+            for value in range(50):
+                group.add(Event([lambda value=value: time.sleep(0.001) or value], pool).go())
+
+            self.assertEqual(list(range(50)), sorted(future.result() for future in group.wait_all(5)))
+        finally:
+            pool.shutdown()
+
+
+class ReferenceCycleTests(unittest.TestCase):
+    """Finished dispatches should be freed by reference counting alone, without any help from the cyclic GC"""
+    def setUp(self):
+        self._gc_was_enabled = gc.isenabled()
+        gc.collect()
+        gc.disable()
+        self._pool = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self._pool.shutdown()
+        set_tracer(None)
+        if self._gc_was_enabled:
+            gc.enable()
+
+    def _assert_freed(self, evt):
+        evt.await_all(2)
+        ref = weakref.ref(evt)
+        del evt
+
+        self.assertIsNone(ref(), "Event kept alive by a reference cycle")
+
+    def _raise(self):
+        raise KeyError()
+
+    def test_synchronous_dispatch(self):
+        """Check that successful synchronous dispatches leave no cycles"""
+
+        self._assert_freed(Event([lambda: 1, lambda: 2], SynchronousExecutor()).go())
+
+    def test_threaded_dispatch(self):
+        """Check that dispatches completed from another thread leave no cycles"""
+
+        self._assert_freed(Event([lambda: 1, self._raise], self._pool).go())
+
+    def test_instrumented_dispatch(self):
+        """Check that instrumented dispatches leave no cycles, even when the handler raises"""
+
+        self._assert_freed(Event([self._raise], self._pool, 'a.b', Instrumentation()).go())
+
+    def test_traced_dispatch(self):
+        """Check that traced dispatches leave no cycles, and still finish their trace"""
+
+        tracer = RingBufferTracer()
+        set_tracer(tracer)
+
+        self._assert_freed(Event([lambda: 1, self._raise], self._pool, 'a.b').go())
+
+        deadline = time.time() + 2
+        while not tracer.get_spans() and time.time() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(1, len(tracer.get_spans()), "Trace not finished")
@@ -0,0 +1,91 @@
+__author__ = 'rob'
+
+import unittest
+
+from wireworks.instrumentation import CompositeInstrumentation, HistogramInstrumentation, Instrumentation
+from wireworks.registry import Registry
+
+
+class RecordingInstrumentation(Instrumentation):
+    def __init__(self):
+        self.seen = []
+
+    def lookup_finished(self, pattern, duration):
+        self.seen.append(('lookup', pattern))
+
+    def dispatch_finished(self, pattern, handler_count, duration):
+        self.seen.append(('dispatch', pattern, handler_count))
+
+    def handler_started(self, pattern, handler, queue_wait, args, kwargs):
+        self.seen.append(('started', pattern, handler.__name__, args, kwargs))
+        return 'token'
+
+    def handler_finished(self, pattern, handler, token, run_time, error):
+        self.seen.append(('finished', pattern, handler.__name__, token, type(error) if error else None))
+
+
+class InstrumentationTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+
+        def good(arg):
+            return arg
+
+        def bad(arg):
+            raise KeyError()
+
+        self._registry.register('a.good', good, strongly_reference=True, priority=1)
+        self._registry.register('a.bad', bad, strongly_reference=True)
+
+    def test_hooks_called(self):
+        """Check that every hook is called, in order, with what we'd expect"""
+
+        instrumentation = RecordingInstrumentation()
+        self._registry.with_instrumentation(instrumentation).with_filter('a.*').call(1)
+
+        self.assertListEqual([('lookup', 'a.*'),
+                              ('started', 'a.*', 'good', (1,), {}),
+                              ('finished', 'a.*', 'good', 'token', None),
+                              ('started', 'a.*', 'bad', (1,), {}),
+                              ('finished', 'a.*', 'bad', 'token', KeyError),
+                              ('dispatch', 'a.*', 2)], instrumentation.seen)
+
+    def test_registry_instrumentation(self):
+        """Check that instrumentation given to a registry is used by the dispatchers derived from it"""
+
+        instrumentation = RecordingInstrumentation()
+        registry = Registry(instrumentation=instrumentation)
+        registry.with_filter('a.*').call()
+
+        self.assertListEqual([('lookup', 'a.*'), ('dispatch', 'a.*', 0)], instrumentation.seen)
+
+    def test_histograms(self):
+        """Check that histogram instrumentation records everything per pattern and per handler"""
+
+        instrumentation = HistogramInstrumentation()
+        dispatcher = self._registry.with_instrumentation(instrumentation).with_filter('a.*')
+        dispatcher.call(1)
+        dispatcher.call(2)
+
+        snapshot = instrumentation.snapshot()['a.*']
+        self.assertEqual(2, snapshot['lookup']['count'])
+        self.assertEqual(2, snapshot['dispatch']['count'])
+
+        handlers = snapshot['handlers']
+        self.assertEqual(2, len(handlers))
+        (good_name,) = [name for name in handlers if name.endswith('good')]
+        (bad_name,) = [name for name in handlers if name.endswith('bad')]
+        self.assertEqual(2, handlers[good_name]['run_time']['count'])
+        self.assertEqual(2, handlers[good_name]['queue_wait']['count'])
+        self.assertEqual(0, handlers[good_name]['errors'])
+        self.assertEqual(2, handlers[bad_name]['errors'])
+
+    def test_composite(self):
+        """Check that composite instrumentation passes everything on, with the right tokens"""
+
+        first = RecordingInstrumentation()
+        second = RecordingInstrumentation()
+        self._registry.with_instrumentation(CompositeInstrumentation(first, second)).with_filter('a.good').call(1)
+
+        self.assertListEqual(first.seen, second.seen)
+        self.assertIn(('finished', 'a.good', 'good', 'token', None), first.seen)
@@ -0,0 +1,159 @@
+__author__ = 'rob'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wireworks.journal import Journal, Replayer, read_journal
+from wireworks.registry import Registry
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._registry = Registry()
+        self._seen = []
+
+        def handler(*args, **kwargs):
+            self._seen.append((args, kwargs))
+
+        self._handler = handler
+        self._registry.register('orders.created', handler, strongly_reference=True)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def test_calls_journaled(self):
+        """Check that calls are journaled before they're dispatched, and can be read back"""
+
+        with Journal(self._directory) as journal:
+            dispatcher = self._registry.with_filter('orders.created').with_journal(journal)
+            dispatcher.call(1, size='large')
+            dispatcher.with_event_pool().call_pooled(2)
+
+        records = list(read_journal(self._directory))
+        self.assertListEqual([1, 2], [record.sequence for record in records])
+        self.assertListEqual([('orders.created', (1,), {'size': 'large'}), ('orders.created', (2,), {})],
+                             [(record.pattern, record.args, record.kwargs) for record in records])
+        self.assertEqual(2, len(self._seen), "Journaled calls not dispatched")
+
+    def test_replay(self):
+        """Check that replaying pushes the journaled calls back through the registry"""
+
+        with Journal(self._directory, durable=False) as journal:
+            for i in range(5):
+                self._registry.with_filter('orders.created').with_journal(journal).call(i)
+
+        del self._seen[:]
+        events = Replayer(self._registry, self._directory).replay()
+
+        self.assertEqual(5, len(events))
+        self.assertListEqual([((i,), {}) for i in range(5)], self._seen)
+
+    def test_replay_at_original_speed(self):
+        """Check that replaying at a given speed keeps the gaps between calls"""
+
+        with Journal(self._directory, durable=False) as journal:
+            journal.append('orders.created', (1,), {})
+            time.sleep(0.2)
+            journal.append('orders.created', (2,), {})
+
+        started = time.time()
+        Replayer(self._registry, self._directory).replay(speed=2)
+
+        self.assertGreaterEqual(time.time() - started, 0.09, "Gap between calls not kept")
+        self.assertEqual(2, len(self._seen))
+
+    def test_segments(self):
+        """Check that full segments roll over, and that reopening the journal carries on where it left off"""
+
+        with Journal(self._directory, segment_size=256, durable=False) as journal:
+            for i in range(20):
+                journal.append('orders.created', (i,), {})
+
+        with Journal(self._directory, segment_size=256, durable=False) as journal:
+            self.assertEqual(21, journal.append('orders.created', ('x' * 1000,), {}), "Sequence didn't carry on")
+
+        self.assertGreater(len(os.listdir(self._directory)), 2, "Segments didn't roll over")
+        records = list(read_journal(self._directory))
+        self.assertListEqual(list(range(1, 22)), [record.sequence for record in records])
+        self.assertEqual('x' * 1000, records[-1].args[0])
+
+    def test_segments_retired_during_sync(self):
+        """Check that a segment filled up while a sync is flushing it is closed once the sync is done"""
+
+        import threading
+
+        flushing = threading.Event()
+        release = threading.Event()
+
+        with Journal(self._directory, segment_size=256, durable=False) as journal:
+            journal.append('orders.created', (0,), {})
+            old_segment = journal._segment
+            flush = old_segment.flush
+
+            def slow_flush():
+                flushing.set()
+                release.wait(5)
+                flush()
+
+            old_segment.flush = slow_flush
+            syncer = threading.Thread(target=journal.sync)
+            syncer.start()
+            flushing.wait(5)
+
+            old_segment.flush = flush
+            for i in range(1, 20):
+                journal.append('orders.created', (i,), {})
+            self.assertIsNot(old_segment, journal._segment, "Segment didn't roll over")
+            self.assertFalse(old_segment.file.closed, "Segment closed while being flushed")
+
+            release.set()
+            syncer.join(5)
+            self.assertTrue(old_segment.file.closed, "Retired segment not closed after the sync")
+
+        self.assertEqual(20, len(list(read_journal(self._directory))))
+
+    def test_pending_only(self):
+        """Check that only calls without a completion record are replayed when replaying pending calls"""
+
+        with Journal(self._directory, record_completion=True) as journal:
+            self._registry.with_filter('orders.created').with_journal(journal).call('complete')
+            journal.append('orders.created', ('in flight',), {})
+
+        del self._seen[:]
+        Replayer(self._registry, self._directory).replay(pending_only=True)
+
+        self.assertListEqual([(('in flight',), {})], self._seen)
+
+    def test_torn_record(self):
+        """Check that reading stops at a record torn by a crash, keeping everything before it"""
+
+        with Journal(self._directory) as journal:
+            journal.append('orders.created', (1,), {})
+            journal.append('orders.created', ('second',), {})
+
+        (path,) = [os.path.join(self._directory, name) for name in os.listdir(self._directory)]
+        with open(path, 'r+b') as segment:
+            data = segment.read()
+            segment.seek(data.index(b'second'))
+            segment.write(b'XX')
+
+        self.assertListEqual([(1,)], [record.args for record in read_journal(self._directory)])
+
+    def test_concurrent_durable_appends(self):
+        """Check that durable appends from many threads all make it in, with distinct sequence numbers"""
+
+        with Journal(self._directory) as journal:
+            pool = ThreadPoolExecutor(max_workers=8)
+            try:
+                sequences = list(pool.map(lambda i: journal.append('orders.created', (i,), {}), range(200)))
+            finally:
+                pool.shutdown()
+
+        self.assertListEqual(list(range(1, 201)), sorted(sequences))
+        self.assertListEqual(list(range(200)), sorted(record.args[0] for record in read_journal(self._directory)))
@@ -0,0 +1,104 @@
+__author__ = 'rob'
+
+import json
+import unittest
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+from wireworks.instrumentation import HistogramInstrumentation
+from wireworks.metrics import MetricsCollector
+from wireworks.registry import Registry
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self._instrumentation = HistogramInstrumentation()
+        self._registry = Registry(instrumentation=self._instrumentation)
+
+        def handler():
+            pass
+
+        self._handler = handler
+        self._registry.register('a.b', handler)
+        self._registry.register('a.b', lambda: None, strongly_reference=True)
+        self._registry.register('a.c', handler)
+
+        self._collector = MetricsCollector(self._registry, self._instrumentation)
+
+    def test_snapshot(self):
+        """Check that the snapshot reports on the registry, glob cache and dispatches"""
+
+        dispatcher = self._registry.with_filter('a.*')
+        dispatcher.call()
+        dispatcher.call()
+
+        snapshot = self._collector.snapshot()
+        registry = snapshot['registry']
+        self.assertEqual(2, registry['keys'])
+        self.assertEqual(3, registry['handlers'])
+        self.assertDictEqual({'a.b': 2, 'a.c': 1}, registry['handlers_per_key'])
+        self.assertEqual(0, registry['dead_references'])
+        self.assertEqual(1, registry['glob_cache']['cache_size'])
+        self.assertEqual(1, registry['glob_cache']['cache_hits'])
+        self.assertEqual(1, registry['glob_cache']['cache_misses'])
+        self.assertEqual(0.5, registry['glob_cache']['cache_hit_ratio'])
+        self.assertEqual(2, snapshot['dispatch']['a.*']['dispatch']['count'])
+
+    def test_prometheus_text(self):
+        """Check that the prometheus text holds the metrics we'd expect, in the right format"""
+
+        self._registry.with_filter('a.*').call()
+        text = self._collector.to_prometheus_text()
+        lines = text.splitlines()
+
+        self.assertIn('# TYPE wireworks_registry_keys gauge', lines)
+        self.assertIn('wireworks_registry_keys 2', lines)
+        self.assertIn('wireworks_registry_handlers{key="a.b"} 2', lines)
+        self.assertIn('# TYPE wireworks_dispatch_seconds histogram', lines)
+        self.assertIn('wireworks_dispatch_seconds_bucket{le="+Inf",pattern="a.*"} 1', lines)
+        self.assertIn('wireworks_dispatch_seconds_count{pattern="a.*"} 1', lines)
+        self.assertTrue([line for line in lines if line.startswith('wireworks_handler_run_seconds_count{')])
+        self.assertTrue(text.endswith('\n'))
+
+    def test_circuit_breakers(self):
+        """Check that breaker state is reported for each handler wired with one"""
+
+        def failing():
+            raise ValueError()
+
+        self._registry.register('a.d', failing, circuit_breaker=1)
+        self._registry.with_filter('a.d').call()
+
+        self.assertEqual('open', self._collector.snapshot()['circuit_breakers'][0]['state'])
+        lines = self._collector.to_prometheus_text().splitlines()
+        self.assertIn('# TYPE wireworks_circuit_breaker_open gauge', lines)
+        self.assertTrue([line for line in lines
+                         if line.startswith('wireworks_circuit_breaker_open{') and line.endswith(',key="a.d"} 1')])
+
+    def test_without_instrumentation(self):
+        """Check that the collector copes without any instrumentation"""
+
+        collector = MetricsCollector(self._registry)
+
+        self.assertDictEqual({}, collector.snapshot()['dispatch'])
+        self.assertNotIn('wireworks_dispatch_seconds', collector.to_prometheus_text())
+
+    def test_http_endpoint(self):
+        """Check that metrics are served over HTTP"""
+
+        server = self._collector.serve(0)
+        try:
+            base = 'http://127.0.0.1:%d' % server.server_address[1]
+
+            response = urlopen(base + '/metrics')
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+            self.assertIn('wireworks_registry_keys 2', response.read().decode('utf-8'))
+
+            snapshot = json.loads(urlopen(base + '/snapshot').read().decode('utf-8'))
+            self.assertEqual(2, snapshot['registry']['keys'])
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,142 @@
+__author__ = 'rob'
+
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from wireworks.payload import PayloadViews, SharedPayload, read_only_view
+from wireworks.registry import Registry
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+def _describe(payload, label=None):
+    """Module level, so that it can be run in a process pool"""
+    return type(payload).__name__, getattr(payload, 'readonly', None), len(payload), bytes(payload[:4]), label
+
+
+class PayloadViewsTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._seen = []
+
+        def handler(payload, label=None):
+            self._seen.append((payload, label))
+
+        self._handler = handler
+        self._registry.register('images.a', handler, strongly_reference=True)
+        self._registry.register('images.b', lambda payload, label=None: self._seen.append((payload, label)),
+                                strongly_reference=True)
+
+    def test_read_only_views(self):
+        """Check that buffers reach every handler as read-only views of the original, and nothing else is touched"""
+
+        original = bytearray(b'abcdef')
+        self._registry.with_filter('images.*').with_payload_views().call(original, label='label').await_all()
+
+        self.assertEqual(2, len(self._seen))
+        for (payload, label) in self._seen:
+            self.assertIsInstance(payload, memoryview)
+            self.assertTrue(payload.readonly, "View isn't read-only")
+            self.assertIs(original, payload.obj, "Buffer was copied")
+            self.assertEqual('label', label)
+            self.assertRaises(TypeError, payload.__setitem__, 0, 0)
+
+    def test_kwargs_and_emit(self):
+        """Check that buffers passed as kwargs, or emitted, are viewed too"""
+
+        self._registry.with_filter('images.a').with_payload_views().emit(b'x', label=bytearray(b'y'))
+
+        (payload, label) = self._seen[0]
+        self.assertIsInstance(payload, memoryview)
+        self.assertTrue(label.readonly)
+
+    def test_off_by_default(self):
+        """Check that buffers are passed as they are unless asked otherwise"""
+
+        original = bytearray(b'abcdef')
+        dispatcher = self._registry.with_filter('images.a').with_payload_views()
+        dispatcher.with_payload_views(False).call(original)
+
+        self.assertIs(original, self._seen[0][0])
+
+    def test_read_only_view(self):
+        view = read_only_view(memoryview(bytearray(b'abc')))
+
+        self.assertTrue(view.readonly)
+        self.assertEqual(b'abc', view.tobytes())
+
+
+@unittest.skipUnless(shared_memory is not None and os.path.isdir('/dev/shm'), "Shared memory isn't available")
+class SharedPayloadTests(unittest.TestCase):
+    def setUp(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self._pool = ProcessPoolExecutor(max_workers=2)
+        self._registry = Registry()
+        for key in ('images.a', 'images.b', 'images.c'):
+            self._registry.register(key, _describe, strongly_reference=True)
+
+    def tearDown(self):
+        self._pool.shutdown()
+
+    def _shared_blocks(self):
+        return set(name for name in os.listdir('/dev/shm') if name.startswith('psm_') or name.startswith('wnsm_'))
+
+    def test_shared_once(self):
+        """Check that a large buffer is shared with every handler in another process, then freed"""
+
+        # the same handler is registered under every key, so it has to be called once per key to get several calls
+        before = self._shared_blocks()
+        dispatcher = self._registry.with_filter('images.*').with_deduplication(False).with_executor(self._pool)
+        event = dispatcher.with_payload_views(share_min_size=1024).call(b'\x01\x02\x03\x04' * 100000, label='big')
+
+        results = [future.result(timeout=30) for future in event.get_all_futures()]
+
+        self.assertListEqual([('memoryview', True, 400000, b'\x01\x02\x03\x04', 'big')] * 3, results)
+        # freed by a done callback, which may still be running when the results are available
+        deadline = time.time() + 5
+        while self._shared_blocks() != before and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertSetEqual(before, self._shared_blocks(), "Shared memory not freed")
+
+    def test_attached_by_unrelated_process(self):
+        """Check that a process that isn't sharing the owner's resource tracker doesn't remove the block on exit"""
+
+        (args, kwargs, release) = PayloadViews(share_min_size=4).prepare((b'abcdef',), {}, out_of_process=True)
+        try:
+            script = "from wireworks.payload import SharedPayload; " \
+                     "block = SharedPayload(%r, 6).attach(); print(bytes(block.buf[:6])); block.close()" % args[0].name
+            environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+            output = subprocess.check_output([sys.executable, '-c', script], env=environment,
+                                             stderr=subprocess.STDOUT, close_fds=True)
+
+            self.assertEqual(b"b'abcdef'", output.strip(), "Attaching process complained")
+            shared_memory.SharedMemory(name=args[0].name).close()
+        finally:
+            release()
+
+    def test_small_buffers_pickled(self):
+        """Check that buffers smaller than the minimum are pickled as usual"""
+
+        dispatcher = self._registry.with_filter('images.a').with_executor(self._pool)
+        event = dispatcher.with_payload_views(share_min_size=1024).call(memoryview(b'small'))
+
+        self.assertEqual(('bytes', None, 5, b'smal', None), event.first_result(timeout=30))
+
+    def test_prepare(self):
+        """Check that only large buffers are swapped for shared memory references"""
+
+        (args, kwargs, release) = PayloadViews(share_min_size=4).prepare((b'abcdef', b'ab', 1), {}, out_of_process=True)
+        try:
+            self.assertIsInstance(args[0], SharedPayload)
+            self.assertEqual(6, args[0].size)
+            self.assertEqual((b'ab', 1), args[1:])
+        finally:
+            release()
+
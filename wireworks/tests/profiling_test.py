@@ -0,0 +1,111 @@
+__author__ = 'rob'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from wireworks.instrumentation import HistogramInstrumentation
+from wireworks.profiling import HandlerProfiler, describe_args
+from wireworks.registry import Registry
+
+
+class ProfilingTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+
+        def slow(*args, **kwargs):
+            time.sleep(0.02)
+
+        def fast(*args, **kwargs):
+            pass
+
+        self._registry.register('a.slow', slow, strongly_reference=True)
+        self._registry.register('a.fast', fast, strongly_reference=True)
+
+    def test_slow_handlers_reported(self):
+        """Check that only handlers over the threshold are reported, with what we'd expect"""
+
+        profiler = HandlerProfiler(sample_rate=1, threshold=0.01)
+        self._registry.with_profiling(profiler).with_filter('a.*').call('abc', key=[1, 2])
+
+        reports = profiler.get_reports()
+        self.assertEqual(1, len(reports), "Incorrect number of handlers reported")
+        ((name, (report,)),) = reports.items()
+        self.assertTrue(name.endswith('slow'))
+        self.assertEqual('a.*', report['pattern'])
+        self.assertEqual("(str[3]) {'key': list[2]}", report['args_shape'])
+        self.assertGreaterEqual(report['run_time'], 0.01)
+        self.assertIn('function calls', report['profile'])
+
+    def test_sampling_and_runtime_changes(self):
+        """Check that nothing is profiled with a sample rate of 0, and that the rate can be changed"""
+
+        profiler = HandlerProfiler(sample_rate=0, threshold=0)
+        dispatcher = self._registry.with_profiling(profiler).with_filter('a.*')
+        dispatcher.call()
+        self.assertDictEqual({}, profiler.get_reports())
+
+        profiler.set_sample_rate(1)
+        profiler.set_threshold(1000)
+        dispatcher.call()
+        self.assertDictEqual({}, profiler.get_reports())
+
+        profiler.set_threshold(0)
+        dispatcher.call()
+        self.assertEqual(2, len(profiler.get_reports()))
+
+    def test_nested_dispatch(self):
+        """Check that a dispatch made from a profiled handler is only timed, leaving the outer profile running"""
+
+        profiler = HandlerProfiler(sample_rate=1, threshold=0)
+        dispatcher = self._registry.with_profiling(profiler)
+
+        def outer():
+            dispatcher.with_filter('a.fast').call()
+            time.sleep(0.01)
+
+        self._registry.register('b.outer', outer, strongly_reference=True)
+        dispatcher.with_filter('b.outer').call()
+
+        reports = dict((name.rsplit('.', 1)[-1], report) for (name, (report,)) in profiler.get_reports().items())
+        self.assertIsNone(reports['fast']['profile'], "Nested dispatch profiled")
+        self.assertIn('sleep', reports['outer']['profile'], "Outer profile stopped by the nested dispatch")
+
+    def test_slowest_reports_kept(self):
+        """Check that only the slowest reports are kept for each handler"""
+
+        profiler = HandlerProfiler(sample_rate=1, threshold=0, max_reports=2, use_cprofile=False)
+        for run_time in (0.3, 0.1, 0.5, 0.2):
+            token = profiler.handler_started('a', describe_args, 0, (), {})
+            profiler.handler_finished('a', describe_args, token, run_time, None)
+
+        (reports,) = profiler.get_reports().values()
+        self.assertListEqual([0.5, 0.3], [report['run_time'] for report in reports])
+        self.assertIsNone(reports[0]['profile'])
+
+    def test_existing_instrumentation_kept(self):
+        """Check that adding profiling keeps any existing instrumentation"""
+
+        instrumentation = HistogramInstrumentation()
+        profiler = HandlerProfiler(sample_rate=1, threshold=0, use_cprofile=False)
+        self._registry.with_instrumentation(instrumentation).with_profiling(profiler).with_filter('a.*').call()
+
+        self.assertEqual(1, instrumentation.snapshot()['a.*']['dispatch']['count'])
+        self.assertEqual(2, len(profiler.get_reports()))
+
+    def test_write_reports(self):
+        """Check that a report file is written per handler"""
+
+        profiler = HandlerProfiler(sample_rate=1, threshold=0)
+        self._registry.with_profiling(profiler).with_filter('a.*').call()
+
+        directory = tempfile.mkdtemp()
+        try:
+            paths = profiler.write_reports(os.path.join(directory, 'reports'))
+            self.assertEqual(2, len(paths))
+            with open(paths[0]) as report_file:
+                self.assertIn('pattern:    a.*', report_file.read())
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,358 @@
+__author__ = 'rob'
+
+import subprocess
+import sys
+import unittest
+
+from wireworks.registry import Registry
+from wireworks.util.synchronous_executor import SynchronousExecutor
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self._registry = Registry()
+        self._invoked = []
+
+    def _wire(self, pattern, name, result=None, **wiring_attrs):
+        def fn(*args, **kwargs):
+            self._invoked.append(name)
+            return result
+        self._registry.register(pattern, fn, strongly_reference=True, **wiring_attrs)
+        return fn
+
+    def test_priority_order(self):
+        """Check that higher priority callables are invoked first"""
+
+        self._wire('a.low', 'low', priority=-1)
+        self._wire('a.high', 'high', priority=10)
+        self._wire('a.normal', 'normal')
+
+        self._registry.with_filter('a.*').call()
+
+        self.assertListEqual(['high', 'normal', 'low'], self._invoked, "Callables not invoked in priority order")
+
+    def test_lazy_call_short_circuits(self):
+        """Check that a lazy dispatch only invokes callables until a result is found"""
+
+        self._wire('a.cheap', 'cheap', priority=1)
+        self._wire('a.expensive', 'expensive', result='found')
+        self._wire('a.unneeded', 'unneeded', result='also found', priority=-1)
+
+        evt = self._registry.with_filter('a.*').call_lazy()
+
+        self.assertEqual('found', evt.first_matching(lambda val: val is not None), "Incorrect result")
+        self.assertListEqual(['cheap', 'expensive'], self._invoked, "Unneeded callables were invoked")
+
+    def test_call_reduce(self):
+        """Check that results from all matching callables are reduced"""
+
+        self._wire('a.one', 'one', result=1)
+        self._wire('a.two', 'two', result=2)
+
+        evt = self._registry.with_filter('a.*').call_reduce(lambda acc, val: acc + [val], [])
+
+        self.assertListEqual([1, 2], sorted(evt.result()), "Incorrect reduced value")
+
+    def test_cached_results(self):
+        """Check that cached handlers aren't invoked again for the same arguments"""
+
+        calls = []
+
+        @self._registry.wire('a.lookup', strongly_reference=True, cache=True)
+        def lookup(val):
+            calls.append(val)
+            return val * 2
+
+        dispatcher = self._registry.with_filter('a.*')
+
+        self.assertEqual(2, dispatcher.call(1).first_result())
+        self.assertEqual(2, dispatcher.call(1).first_result())
+        self.assertEqual(4, dispatcher.call(2).first_result())
+        self.assertListEqual([1, 2], calls, "Cached handler invoked for a repeated call")
+
+        stats = self._registry.get_cache_stats()
+        self.assertEqual(1, len(stats))
+        self.assertEqual('a.lookup', stats[0]['pattern'])
+        self.assertTrue(stats[0]['handler'].endswith('lookup'))
+        self.assertEqual(1, stats[0]['hits'])
+        self.assertEqual(2, stats[0]['misses'])
+
+    def test_cached_hits_skip_executor(self):
+        """Check that cached results are served without going near the executor"""
+
+        self._wire('a.lookup', 'lookup', result='value', cache=True)
+
+        class CountingExecutor(SynchronousExecutor):
+            submissions = 0
+
+            def submit(self, fn, *args, **kwargs):
+                CountingExecutor.submissions += 1
+                return super(CountingExecutor, self).submit(fn, *args, **kwargs)
+
+        dispatcher = self._registry.with_filter('a.*').with_executor(CountingExecutor())
+        dispatcher.call()
+        evt = dispatcher.call()
+
+        self.assertEqual('value', evt.first_result())
+        self.assertEqual(1, CountingExecutor.submissions, "Cached hit was submitted to the executor")
+
+    def test_cached_instance_methods(self):
+        """Check that each wired instance gets a cache of its own"""
+
+        registry = self._registry
+
+        @registry.wire_class_instances
+        class Wired(object):
+            def __init__(self, name):
+                self._name = name
+
+            @registry.wire_instance_method('a.name', cache=True)
+            def name(self, suffix):
+                return self._name + suffix
+
+        first = Wired('first')
+        second = Wired('second')
+
+        results = sorted(registry.with_filter('a.*').call('!').await_all(), key=lambda f: f.result())
+        self.assertListEqual(['first!', 'second!'], [future.result() for future in results])
+        self.assertEqual(2, len(registry.get_cache_stats()))
+        del first, second
+
+    def test_import_has_no_side_effects(self):
+        """Check that importing the registry doesn't configure logging or pull in heavy modules"""
+
+        script = ("import sys; import wireworks.registry; "
+                  "assert not [m for m in ('logging', 'inspect', 'concurrent.futures') if m in sys.modules]")
+        self.assertEqual(0, subprocess.call([sys.executable, '-c', script]), "Importing the registry had side effects")
+
+    def test_scope(self):
+        """Check that closing a scope removes its registrations, and any keys they leave empty"""
+
+        self._wire('a.shared', 'outside')
+        dispatcher = self._registry.with_filter('a.*')
+
+        with self._registry.scope() as scope:
+            scope.register('a.shared', lambda: self._invoked.append('shared'), strongly_reference=True)
+            scope.wire('a.scoped', strongly_reference=True)(lambda: self._invoked.append('scoped'))
+
+            dispatcher.call()
+            self.assertListEqual(['outside', 'scoped', 'shared'], sorted(self._invoked))
+            self.assertEqual(2, len(scope))
+
+        self.assertTrue(scope.closed())
+        self.assertEqual(0, len(scope))
+        self.assertListEqual(['a.shared'], sorted(self._registry.snapshot()['handlers_per_key']))
+
+        del self._invoked[:]
+        dispatcher.call()
+        self.assertListEqual(['outside'], self._invoked, "Scoped registrations still called after close")
+
+        scope.close()
+        self.assertRaises(ValueError, scope.register, 'a.b', lambda: None)
+
+
+    def test_dispatch_during_registration(self):
+        """Check that dispatches racing registrations, unregistrations and monitoring neither fail nor miss the
+        handlers that were there all along"""
+
+        import threading
+
+        self._registry.register('race.kept', lambda: 'kept', strongly_reference=True)
+        dispatcher = self._registry.with_filter('race.*')
+        errors = []
+        missed = []
+
+        def dispatch():
+            try:
+                for _ in range(500):
+                    if 'kept' not in [future.result() for future in dispatcher.call().get_all_futures()]:
+                        missed.append(True)
+            except Exception as e:
+                errors.append(e)
+
+        def churn():
+            try:
+                for index in range(200):
+                    with self._registry.scope() as scope:
+                        scope.register('race.churn%d' % (index % 10), lambda: None, strongly_reference=True)
+                        self._registry.snapshot()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=dispatch) for _ in range(4)] + [threading.Thread(target=churn)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertListEqual([], errors)
+        self.assertListEqual([], missed)
+        self.assertListEqual(['race.kept'], self._registry.get_patterns())
+
+    def test_monitoring_takes_no_locks(self):
+        """Check that monitoring doesn't wait for a thread holding the glob cache lock"""
+
+        import threading
+
+        self._wire('held.a', 'a')
+        (_, glob_dict) = self._registry._shard_for('held.a')
+        held = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def hold_lock():
+            with glob_dict._cachelock:
+                held.set()
+                release.wait(5)
+
+        def monitor():
+            results.append(self._registry.snapshot()['handlers'])
+            results.append(self._registry.get_patterns())
+            results.append(self._registry.get_cache_stats())
+            results.append(self._registry.get_breaker_stats())
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        held.wait(5)
+        try:
+            monitor_thread = threading.Thread(target=monitor)
+            monitor_thread.start()
+            monitor_thread.join(5)
+            self.assertFalse(monitor_thread.is_alive(), "Monitoring waited for the lock")
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertListEqual([1, ['held.a'], [], []], results)
+
+class ShardedRegistryTests(RegistryTests):
+    """Everything a Registry does, a sharded one should do too"""
+    def setUp(self):
+        self._registry = Registry(shards=4)
+        self._invoked = []
+
+    def test_priority_order_across_shards(self):
+        """Check that priorities are respected when handlers come from several shards"""
+
+        for (index, top_level) in enumerate(['a', 'b', 'c', 'd', 'e', 'f']):
+            self._wire(top_level + '.x', top_level, priority=index)
+
+        self._registry.with_filter('*.x').call()
+
+        self.assertListEqual(['f', 'e', 'd', 'c', 'b', 'a'], self._invoked)
+
+    def test_concurrent_registration(self):
+        """Check that registrations and scope closes from many threads at once all take effect"""
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        def register_many(thread):
+            with self._registry.scope() as scope:
+                for index in range(50):
+                    scope.register('t%d.scoped%d' % (index, thread), lambda: None, strongly_reference=True)
+            for index in range(50):
+                self._registry.register('t%d.kept%d' % (index, thread), lambda: None, strongly_reference=True)
+
+        pool = ThreadPoolExecutor(max_workers=8)
+        try:
+            list(pool.map(register_many, range(8)))
+        finally:
+            pool.shutdown()
+
+        self.assertEqual(400, self._registry.snapshot()['keys'])
+        self.assertEqual(400, len(self._registry.with_filter('*.*').call().get_all_futures()))
+
+
+class ChildRegistryTests(RegistryTests):
+    """Everything a Registry does, a child of an empty one should do too"""
+    def setUp(self):
+        self._base = Registry()
+        self._registry = self._base.child()
+        self._invoked = []
+
+    def _wire_base(self, pattern, name, **wiring_attrs):
+        def fn(*args, **kwargs):
+            self._invoked.append(name)
+        self._base.register(pattern, fn, strongly_reference=True, **wiring_attrs)
+        return fn
+
+    def test_inherits_handlers(self):
+        """Check that dispatches through the child reach the handlers of both layers, and the parent's don't reach the
+        child's"""
+
+        self._wire_base('a.b', 'base', priority=1)
+        self._wire('a.c', 'child')
+
+        self._registry.with_filter('a.*').call()
+        self._base.with_filter('a.*').call()
+
+        self.assertListEqual(['base', 'child', 'base'], self._invoked)
+        self.assertIs(self._base, self._registry.get_parent())
+        self.assertListEqual(['a.c'], self._registry.get_patterns())
+
+    def test_parent_changes_seen(self):
+        """Check that registrations with the parent after the child was made are seen through it"""
+
+        self._registry.with_filter('a.*').call()
+        self._wire_base('a.late', 'late')
+        self._registry.with_filter('a.*').call()
+
+        with self._base.scope() as scope:
+            scope.register('a.scoped', lambda: self._invoked.append('scoped'), strongly_reference=True)
+            self._registry.with_filter('a.*').call()
+        self._registry.with_filter('a.*').call()
+
+        self.assertListEqual(['late', 'late', 'late', 'scoped'], sorted(self._invoked))
+
+    def test_masks(self):
+        """Check that the child can hide inherited handlers, by pattern or by callable, but not its own"""
+
+        hidden = self._wire_base('a.b', 'hidden')
+        self._wire_base('a.b', 'kept')
+        self._wire_base('a.c', 'masked key')
+        self._wire('a.c', 'child')
+
+        self._registry.mask('a.c')
+        self._registry.mask('a.*', hidden)
+        self._registry.with_filter('a.*').call()
+        self.assertListEqual(['child', 'kept'], sorted(self._invoked))
+
+        del self._invoked[:]
+        self._registry.unmask('a.*', hidden)
+        self._registry.with_filter('a.*').call()
+        self.assertListEqual(['child', 'hidden', 'kept'], sorted(self._invoked))
+
+        self.assertRaises(ValueError, self._base.mask, 'a.*')
+
+    def test_masks_forget_dead_callables(self):
+        """Check that a mask for a callable is removed once the callable's gone, rather than keeping its id"""
+
+        import gc
+
+        class Handler(object):
+            def handle(self):
+                pass
+
+        handler = Handler()
+        self._base.register('a.b', handler.handle)
+        self._registry.mask('a.*', handler.handle)
+        self._registry.mask('a.*', len)
+        self.assertEqual(2, len(self._registry._dispatcher_glob_dict.get_masks()))
+
+        del handler
+        gc.collect()
+
+        self.assertEqual(1, len(self._registry._dispatcher_glob_dict.get_masks()), "Dead callable's mask kept")
+
+    def test_grandchild(self):
+        """Check that a child of a child sees every layer, less what the layers in between mask"""
+
+        self._wire_base('a.b', 'base')
+        self._wire('a.c', 'child')
+        self._registry.mask('a.b')
+        grandchild = self._registry.child()
+        grandchild.register('a.d', lambda: self._invoked.append('grandchild'), strongly_reference=True)
+
+        grandchild.with_filter('a.*').call()
+
+        self.assertListEqual(['child', 'grandchild'], sorted(self._invoked))
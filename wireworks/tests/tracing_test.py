@@ -0,0 +1,135 @@
+__author__ = 'rob'
+
+import gc
+import sys
+import unittest
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from wireworks.registry import Registry
+from wireworks.tracing import RingBufferTracer, set_tracer
+from wireworks.util.static_functions import current_event
+
+
+class TracingTests(unittest.TestCase):
+    def setUp(self):
+        self._tracer = RingBufferTracer()
+        set_tracer(self._tracer)
+
+        self._registry = Registry()
+        self._seen = {}
+
+        def outer():
+            self._seen['outer'] = current_event()
+            self._seen['inner_event'] = self._registry.with_filter('inner.*').call()
+            self._seen['outer_after'] = current_event()
+
+        def inner():
+            self._seen['inner'] = current_event()
+
+        self._registry.register('outer.a', outer, strongly_reference=True)
+        self._registry.register('inner.a', inner, strongly_reference=True)
+
+    def tearDown(self):
+        set_tracer(None)
+
+    def test_parent_links(self):
+        """Check that events dispatched from handlers record their parent, and the current event is restored"""
+
+        outer_event = self._registry.with_filter('outer.*').call()
+
+        self.assertIs(outer_event, self._seen['outer'])
+        self.assertIs(self._seen['inner_event'], self._seen['inner'])
+        self.assertIs(outer_event, self._seen['inner_event'].get_parent())
+        self.assertIs(outer_event, self._seen['outer_after'], "Current event not restored after nested dispatch")
+        self.assertIsNone(outer_event.get_parent())
+        self.assertRaises(ValueError, current_event)
+
+    def test_parent_weakly_referenced(self):
+        """Check that an event that's held on to doesn't keep its parent alive"""
+
+        outer_event = weakref.ref(self._registry.with_filter('outer.*').call())
+        del self._seen['outer'], self._seen['outer_after']
+        gc.collect()
+
+        self.assertIsNone(outer_event(), "Parent kept alive by its child")
+        self.assertIsNone(self._seen['inner_event'].get_parent())
+
+    def test_parent_links_through_executor(self):
+        """Check that the current event reaches handlers run on other threads"""
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            outer_event = self._registry.with_executor(executor).with_filter('outer.*').call()
+            outer_event.await_all()
+            self._seen['inner_event'].await_all()
+        finally:
+            executor.shutdown()
+
+        self.assertIs(outer_event, self._seen['outer'])
+        self.assertIs(outer_event, self._seen['inner_event'].get_parent())
+
+    def test_spans_recorded(self):
+        """Check that a span is recorded for each event, linked to its parent"""
+
+        outer_event = self._registry.with_filter('outer.*').call()
+
+        spans = self._tracer.get_spans()
+        self.assertEqual(2, len(spans))
+        outer_span = outer_event.get_trace_span()
+        inner_span = self._seen['inner_event'].get_trace_span()
+        self.assertIsNone(outer_span.parent_id)
+        self.assertEqual(outer_span.span_id, inner_span.parent_id)
+        self.assertEqual('inner.*', inner_span.pattern)
+        self.assertGreaterEqual(outer_span.duration(), inner_span.duration())
+        self.assertListEqual([outer_span, inner_span], self._tracer.get_cascade(outer_span.span_id))
+
+    def test_dump_folded(self):
+        """Check that cascades are dumped as folded stacks"""
+
+        outer_event = self._registry.with_filter('outer.*').call()
+        self._registry.with_filter('inner.*').call()
+
+        output = StringIO()
+        self._tracer.dump_folded(output, outer_event.get_trace_span().span_id)
+        stacks = sorted(line.rsplit(' ', 1)[0] for line in output.getvalue().splitlines())
+
+        self.assertListEqual(['outer.*', 'outer.*;inner.*'], stacks)
+
+    def test_no_tracer(self):
+        """Check that nothing is traced once the tracer is removed"""
+
+        set_tracer(None)
+        event = self._registry.with_filter('outer.*').call()
+
+        self.assertIsNone(event.get_trace_span())
+        self.assertListEqual([], self._tracer.get_spans())
+
+    @unittest.skipIf(sys.version_info < (3, 7), "Context variables need python 3.7+")
+    def test_current_event_reaches_asyncio(self):
+        """Check that asyncio callbacks scheduled by a handler see the handler's event"""
+
+        import asyncio
+
+        seen = []
+
+        def handler():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.call_soon(lambda: seen.append(current_event()))
+                loop.call_soon(loop.stop)
+                loop.run_forever()
+            finally:
+                loop.close()
+
+        self._registry.register('async.a', handler, strongly_reference=True)
+        event = self._registry.with_filter('async.*').call()
+        event.first_result()
+
+        self.assertListEqual([event], seen)
@@ -0,0 +1,192 @@
+"""
+Tracing for event cascades - handlers that dispatch further events, which have handlers that dispatch further events,
+and so on.
+
+Every Event remembers the event that was current when it was created (see `current_event()`), which is its parent.
+When a tracer is installed with `set_tracer`, each Event reports a span covering its dispatch, from `go` until its
+last callable completes, linked to its parent's span. Tracing is off unless a tracer is installed.
+
+`RingBufferTracer` keeps the most recent spans in memory, and can dump them as folded stacks, the input format for
+flame graph tools (eg ``flamegraph.pl`` or speedscope).
+"""
+
+__author__ = 'rob'
+
+import itertools
+import threading
+import time
+
+from collections import deque
+
+_clock = getattr(time, 'monotonic', time.time)
+
+_tracer = None
+
+
+def set_tracer(tracer):
+    """Install the tracer that all Events report to.
+
+    :param tracer:  A `Tracer`, or None to turn tracing off
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    """Get the installed tracer.
+
+    :return:    The `Tracer`, or None if tracing is off
+    """
+    return _tracer
+
+
+def start_trace(pattern, parent_trace):
+    """Start tracing a dispatch, if tracing is on. Largely for internal use by Events.
+
+    :param pattern:         The filter pattern of the dispatcher that made the Event, if known
+    :param parent_trace:    The `ActiveTrace` of the parent Event, or None
+    :return:                An `ActiveTrace`, or None if tracing is off
+    """
+    tracer = _tracer
+    if tracer is None:
+        return None
+
+    return ActiveTrace(tracer, tracer.event_started(pattern, parent_trace.span if parent_trace is not None else None))
+
+
+class ActiveTrace(object):
+    """A span that's been started, along with the tracer it needs to be reported back to when it's finished."""
+    __slots__ = ('tracer', 'span', '_finished', '_lock')
+
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def finish(self):
+        """Report the span as finished. Only the first call does anything."""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+
+        self.tracer.event_finished(self.span)
+
+
+class Tracer(object):
+    """Base class for tracers. Override both methods."""
+    def event_started(self, pattern, parent_span):
+        """Called when an Event's dispatch starts.
+
+        :param pattern:     The filter pattern of the dispatcher that made the Event, if known
+        :param parent_span: Whatever this method returned for the parent Event, or None if there's no parent (or the
+                            parent started before tracing was turned on)
+        :return:            A span object, passed to `event_finished` and to `event_started` for any children
+        """
+        return None
+
+    def event_finished(self, span):
+        """Called once every callable for an Event has completed. May be called from any thread.
+
+        :param span:    Whatever `event_started` returned
+        """
+
+
+class Span(object):
+    """A record of a single Event's dispatch."""
+    __slots__ = ('span_id', 'parent_id', 'pattern', 'thread_name', 'start', 'end')
+
+    def __init__(self, span_id, parent_id, pattern, thread_name, start):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.pattern = pattern
+        self.thread_name = thread_name
+        self.start = start
+        self.end = None
+
+    def duration(self):
+        """
+        :return:    Duration of the dispatch in seconds, or None if it hasn't finished
+        """
+        return self.end - self.start if self.end is not None else None
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class RingBufferTracer(Tracer):
+    """Keeps the most recently finished spans in memory.
+
+    :param capacity:    Maximum number of finished spans to keep. The oldest are dropped first.
+    """
+    def __init__(self, capacity=10000):
+        self._ids = itertools.count(1)
+        self._spans = deque(maxlen=capacity)
+
+    def event_started(self, pattern, parent_span):
+        return Span(next(self._ids), parent_span.span_id if parent_span is not None else None, pattern,
+                    threading.current_thread().name, _clock())
+
+    def event_finished(self, span):
+        span.end = _clock()
+        self._spans.append(span)
+
+    def get_spans(self):
+        """Get all finished spans still in the buffer.
+
+        :return:    List of `Span`, in the order they finished
+        """
+        return list(self._spans)
+
+    def clear(self):
+        """Drop all spans."""
+        self._spans.clear()
+
+    def get_cascade(self, span_id):
+        """Get a span and all of its descendants that are still in the buffer.
+
+        :param span_id: Id of the root span
+        :return:        List of `Span`, root first, then children breadth first
+        """
+        spans = self.get_spans()
+        children = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+
+        cascade = [span for span in spans if span.span_id == span_id]
+        for span in cascade:
+            cascade.extend(sorted(children.get(span.span_id, []), key=lambda child: child.start))
+
+        return cascade
+
+    def dump_folded(self, output, span_id=None):
+        """Write spans as folded stacks, one line per span: its ancestry of patterns, then its self time in
+        microseconds (its duration, minus the time covered by its children).
+
+        :param output:  A path, or a file-like object to write to
+        :param span_id: Only dump the cascade from this span. If None, everything in the buffer is dumped.
+        """
+        spans = self.get_cascade(span_id) if span_id is not None else self.get_spans()
+        by_id = dict((span.span_id, span) for span in spans)
+        child_time = {}
+        for span in spans:
+            if span.parent_id in by_id:
+                child_time[span.parent_id] = child_time.get(span.parent_id, 0) + span.duration()
+
+        lines = []
+        for span in spans:
+            stack = []
+            current = span
+            while current is not None:
+                stack.append(str(current.pattern).replace(';', ':').replace(' ', '_'))
+                current = by_id.get(current.parent_id)
+
+            self_time = max(0, span.duration() - child_time.get(span.span_id, 0))
+            lines.append("%s %d\n" % (";".join(reversed(stack)), int(self_time * 1000000)))
+
+        if hasattr(output, 'write'):
+            output.writelines(lines)
+        else:
+            with open(output, 'w') as output_file:
+                output_file.writelines(lines)
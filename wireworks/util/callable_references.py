@@ -4,6 +4,19 @@ from functools import partial
 from weakref import ref
 
 
+def callable_identity(callable_fn):
+    """Get something that identifies a callable for as long as it's alive, so that the same callable registered more
+    than once can be recognised. Bound methods are identified by their instance and function, as a new method object
+    is made each time one is looked up.
+
+    :param callable_fn:     The callable to identify
+    :return:                A hashable identity
+    """
+    if hasattr(callable_fn, '__func__') and hasattr(callable_fn, '__self__'):
+        return id(callable_fn.__func__), id(callable_fn.__self__)
+    return id(callable_fn), None
+
+
 class StrongCallableReference(object):
     """A class to represent a strong ref to a callable. The callable can't be gc'd while this class is still referenced.
 
@@ -14,16 +27,88 @@ class StrongCallableReference(object):
     The docs for get_callable() say this may return None. That needs to be true to provide a consistent contract,
     but practially the only way you'll a None out is if you put a None in, and that's your own fault really.
     """
-    def __init__(self, callable_fn):
+    def __init__(self, callable_fn, priority=0, cache=None, rate_limiter=None, circuit_breaker=None,
+                 dispatch_priority=None):
         """Make a new StrongCallableReference for some callable.
 
         :param callable_fn:     The function to store a strong reference to
+        :param priority:        Dispatch priority; higher priority callables are invoked first
+        :param cache:           Optional ResultCache to serve repeated calls from
+        :param rate_limiter:    Optional RateLimiter a call must be admitted by before it's made
+        :param circuit_breaker: Optional CircuitBreaker tracking whether the callable keeps failing
+        :param dispatch_priority:   Optional priority to submit calls to a `PriorityExecutor` at
         """
         self._callable_fn = callable_fn
+        self._priority = priority
+        self._cache = cache
+        self._rate_limiter = rate_limiter
+        self._circuit_breaker = circuit_breaker
+        self._dispatch_priority = dispatch_priority
+        self._limiters = (rate_limiter,) if rate_limiter is not None else ()
+        self._identity = callable_identity(callable_fn)
 
     def __hash__(self):
         return hash(self._callable_fn)
 
+    def get_identity(self):
+        """Returns the identity of the referenced callable. See `callable_identity`.
+
+        :return:    The identity, which is the same for every reference to the same callable
+        """
+        return self._identity
+
+    def get_priority(self):
+        """Returns the dispatch priority given when this reference was made.
+
+        :return:    The priority. Higher priority callables should be invoked first.
+        """
+        return self._priority
+
+    def get_cache(self):
+        """Returns the ResultCache given when this reference was made.
+
+        :return:    The cache, or None if results aren't to be cached
+        """
+        return self._cache
+
+    def get_circuit_breaker(self):
+        """Returns the CircuitBreaker given when this reference was made.
+
+        :return:    The breaker, or None if failures aren't tracked
+        """
+        return self._circuit_breaker
+
+    def get_dispatch_priority(self):
+        """Returns the priority given when this reference was made for submitting calls to a `PriorityExecutor`.
+
+        :return:    The priority, or None to submit calls at whatever priority the dispatch asks for
+        """
+        return self._dispatch_priority
+
+    def get_rate_limiter(self):
+        """Returns the RateLimiter given when this reference was made.
+
+        :return:    The limiter, or None if calls aren't limited individually
+        """
+        return self._rate_limiter
+
+    def get_limiters(self):
+        """Returns every RateLimiter a call must be admitted by before it's made: this reference's own, then any
+        applying to the pattern it's registered against.
+
+        :return:    A tuple of limiters, empty if calls aren't limited
+        """
+        return self._limiters
+
+    def set_pattern_limiters(self, limiters):
+        """Set the RateLimiters applying to the pattern this reference is registered against. The tuple of limiters
+        is replaced rather than changed, so dispatches already under way aren't affected.
+
+        :param limiters:    The pattern's limiters
+        """
+        own = (self._rate_limiter,) if self._rate_limiter is not None else ()
+        self._limiters = own + tuple(limiters)
+
     def get_callable(self):
         """Returns the stored callable.
 
@@ -38,15 +123,28 @@ class StrongCallableReference(object):
 class WeakCallableReference(object):
     """A class to store a weak reference to a callable. If the callable has no other references, it'll be gc'd."""
 
-    def __init__(self, callable_fn, dereference_callback=None):
+    def __init__(self, callable_fn, dereference_callback=None, priority=0, cache=None, rate_limiter=None,
+                 circuit_breaker=None, dispatch_priority=None):
         """Make a new WeakCallableReference for some callable.
 
         :param callable_fn:     The function to store a strong reference to
         :param dereference_callback:    Optional callback that will be notified if this reference dies.
+        :param priority:        Dispatch priority; higher priority callables are invoked first
+        :param cache:           Optional ResultCache to serve repeated calls from
+        :param rate_limiter:    Optional RateLimiter a call must be admitted by before it's made
+        :param circuit_breaker: Optional CircuitBreaker tracking whether the callable keeps failing
+        :param dispatch_priority:   Optional priority to submit calls to a `PriorityExecutor` at
         """
         self._dereference_callback = dereference_callback
+        self._priority = priority
+        self._cache = cache
+        self._rate_limiter = rate_limiter
+        self._circuit_breaker = circuit_breaker
+        self._dispatch_priority = dispatch_priority
+        self._limiters = (rate_limiter,) if rate_limiter is not None else ()
         self._class_inst_ref = None
         self._hash = hash(callable_fn)
+        self._identity = callable_identity(callable_fn)
         self._callable_ref = ref(callable_fn, self._dereference)
 
         # maybe clobber some of those if we've been given a class method
@@ -55,6 +153,14 @@ class WeakCallableReference(object):
     def __hash__(self):
         return self._hash
 
+    def get_identity(self):
+        """Returns the identity of the referenced callable, as it was when this reference was made. See
+        `callable_identity`.
+
+        :return:    The identity, which is the same for every reference to the same callable
+        """
+        return self._identity
+
     def _set_properties_for_class_method(self, callable_fn, dereference_fn):
         """Tweak properties of `self` as necessary to support a class method.
 
@@ -99,6 +205,58 @@ class WeakCallableReference(object):
         if self._dereference_callback:
             self._dereference_callback(self)
 
+    def get_priority(self):
+        """Returns the dispatch priority given when this reference was made.
+
+        :return:    The priority. Higher priority callables should be invoked first.
+        """
+        return self._priority
+
+    def get_cache(self):
+        """Returns the ResultCache given when this reference was made.
+
+        :return:    The cache, or None if results aren't to be cached
+        """
+        return self._cache
+
+    def get_circuit_breaker(self):
+        """Returns the CircuitBreaker given when this reference was made.
+
+        :return:    The breaker, or None if failures aren't tracked
+        """
+        return self._circuit_breaker
+
+    def get_dispatch_priority(self):
+        """Returns the priority given when this reference was made for submitting calls to a `PriorityExecutor`.
+
+        :return:    The priority, or None to submit calls at whatever priority the dispatch asks for
+        """
+        return self._dispatch_priority
+
+    def get_rate_limiter(self):
+        """Returns the RateLimiter given when this reference was made.
+
+        :return:    The limiter, or None if calls aren't limited individually
+        """
+        return self._rate_limiter
+
+    def get_limiters(self):
+        """Returns every RateLimiter a call must be admitted by before it's made: this reference's own, then any
+        applying to the pattern it's registered against.
+
+        :return:    A tuple of limiters, empty if calls aren't limited
+        """
+        return self._limiters
+
+    def set_pattern_limiters(self, limiters):
+        """Set the RateLimiters applying to the pattern this reference is registered against. The tuple of limiters
+        is replaced rather than changed, so dispatches already under way aren't affected.
+
+        :param limiters:    The pattern's limiters
+        """
+        own = (self._rate_limiter,) if self._rate_limiter is not None else ()
+        self._limiters = own + tuple(limiters)
+
     def get_callable(self):
         """ Returns the stored callable.
 
@@ -122,3 +280,23 @@ class WeakCallableReference(object):
             return None
 
         return partial(callable_fn, class_inst)
+
+
+def callable_name(callable_fn):
+    """Get a human readable name for a callable, for logging and statistics.
+
+    Partials (as returned by `WeakCallableReference.get_callable()` for bound methods) are named after the function
+    they wrap.
+
+    :param callable_fn:     The callable to name
+    :return:                The callable's qualified name where possible, or its repr if not
+    """
+    if isinstance(callable_fn, partial):
+        callable_fn = callable_fn.func
+
+    name = getattr(callable_fn, '__qualname__', None) or getattr(callable_fn, '__name__', None)
+    if not name:
+        return repr(callable_fn)
+
+    module = getattr(callable_fn, '__module__', None)
+    return "%s.%s" % (module, name) if module else name
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breakers for handlers that keep failing.
+
+A breaker starts closed, letting every call through. Once enough calls in a row have raised (or run for longer than the
+call timeout, whether they've returned yet or not), it trips open, and calls are skipped - or handed to a fallback -
+without going anywhere near the executor. After the reset timeout, it goes half-open and lets a single probe call
+through: if that succeeds, the breaker closes again, and if not, it's open for another reset timeout. Only the probe
+decides: calls let through before the breaker tripped that finish while it's half-open don't count.
+"""
+
+__author__ = 'rob'
+
+import itertools
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+from wireworks.util.rate_limiter import CallRejected
+
+_clock = getattr(time, 'monotonic', time.time)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(CallRejected):
+    """
+    A call was skipped because its handler's circuit breaker was open. This is what the call's Future is completed
+    with, if the breaker has no fallback.
+
+    Args:
+        breaker (CircuitBreaker): The open breaker
+    """
+    def __init__(self, breaker):
+        super(CircuitOpen, self).__init__(breaker, 'circuit open')
+        self.breaker = breaker
+
+
+def make_breaker(spec):
+    """
+    Build a CircuitBreaker from one of the forms accepted by ``Registry.wire(circuit_breaker=...)``.
+
+    Args:
+        spec: None or False for no breaker, True for a breaker with the default settings, an int for a breaker
+            tripping after that many failures in a row, or a CircuitBreaker to be used as-is - and shared with anything
+            else using it
+
+    Returns:
+        CircuitBreaker: The breaker, or None if none was asked for
+    """
+    if spec is None or spec is False:
+        return None
+    if spec is True:
+        return CircuitBreaker()
+    if isinstance(spec, CircuitBreaker):
+        return spec
+    return CircuitBreaker(failure_threshold=int(spec))
+
+
+class CircuitBreaker(object):
+    """
+    Make us a new CircuitBreaker, closed.
+
+    Args:
+        failure_threshold (int, optional): Failures in a row that trip the breaker
+        reset_timeout (float, optional): Seconds the breaker stays open before letting a probe call through
+        call_timeout (float, optional): Calls taking longer than this many seconds count as failures, even if they
+            return. A call that hangs is counted as soon as the next call is attempted after its time is up, rather
+            than waiting for it to return. Only calls run in this process are timed. If None, calls aren't timed.
+        fallback (callable, optional): Called in place of the handler while the breaker is open, with the same
+            arguments, right there in the dispatching thread - so it should be quick. If None, calls are skipped,
+            and their Futures completed with a CircuitOpen.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, call_timeout=None, fallback=None):
+        if failure_threshold < 1:
+            raise AttributeError("The failure threshold must be positive")
+
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._call_timeout = call_timeout
+        self._fallback = fallback
+        self._lock = Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened = None
+        # the permit of the half-open probe call, while it's in flight
+        self._probe = None
+        self._trips = 0
+        self._skipped = 0
+        # the time each call being timed started running, keyed by its permit. Oldest first.
+        self._running = OrderedDict()
+        # the permits of calls already counted as failures for running past the call timeout, until they return
+        self._hung = set()
+        self._permits = itertools.count(1)
+
+    def __repr__(self):
+        return "CircuitBreaker(state=%r, failure_threshold=%r, reset_timeout=%r)" % (
+            self._state, self._failure_threshold, self._reset_timeout)
+
+    def get_fallback(self):
+        return self._fallback
+
+    def get_state(self):
+        """
+        Returns:
+            str: CLOSED, OPEN or HALF_OPEN. An open breaker whose reset timeout has passed only goes half-open when
+            the next call is attempted.
+        """
+        return self._state
+
+    def try_acquire(self):
+        """
+        Check whether a call may be made. Every call that's allowed must be followed by either record or abandon - and
+        by start, once it starts running, if it's run in this process.
+
+        Returns:
+            The call's permit (a true value) to pass to start, record and abandon, or False if it's to be skipped (or
+            handed to the fallback)
+        """
+        with self._lock:
+            self._expire_hung_calls()
+            if self._state == CLOSED:
+                return next(self._permits)
+
+            if self._state == OPEN:
+                if _clock() - self._opened < self._reset_timeout:
+                    self._skipped += 1
+                    return False
+                self._state = HALF_OPEN
+
+            if self._probe is not None:
+                self._skipped += 1
+                return False
+
+            self._probe = next(self._permits)
+            return self._probe
+
+    def start(self, call):
+        """
+        Note that an allowed call has started running, so the breaker can time it - and count it as a failure once
+        it's run for longer than the call timeout, even if it never returns.
+
+        Args:
+            call: The permit try_acquire handed out for the call
+        """
+        if self._call_timeout is None:
+            return
+
+        with self._lock:
+            self._running[call] = _clock()
+
+    def record(self, error, duration=None, call=None):
+        """
+        Record the outcome of an allowed call.
+
+        Args:
+            error: The exception the call raised, or None if it returned
+            duration (float, optional): Seconds the call took to run, to check against the call timeout
+            call (optional): The permit try_acquire handed out for the call. Only the probe's outcome counts while the
+                breaker is half-open. If start was called for it, the call is timed from then instead, and a call
+                that's already been counted as a failure for running past the call timeout isn't counted again.
+        """
+        with self._lock:
+            if call in self._hung:
+                self._hung.discard(call)
+                return
+
+            started = self._running.pop(call, None) if call is not None else None
+            if started is not None:
+                duration = _clock() - started
+
+            failed = error is not None or \
+                (duration is not None and self._call_timeout is not None and duration > self._call_timeout)
+            self._record(failed, call)
+
+    def _record(self, failed, call):
+        """Record the outcome of a call. Must be called with the lock held."""
+        if self._state == HALF_OPEN:
+            if call is None or call != self._probe:
+                return
+            self._probe = None
+            if failed:
+                self._trip()
+            else:
+                self._state = CLOSED
+                self._failures = 0
+        elif failed:
+            self._failures += 1
+            if self._state == CLOSED and self._failures >= self._failure_threshold:
+                self._trip()
+        else:
+            self._failures = 0
+
+    def _expire_hung_calls(self):
+        """Count the calls that have been running for longer than the call timeout as failures, without waiting for
+        them to return. Must be called with the lock held."""
+        if not self._running:
+            return
+
+        deadline = _clock() - self._call_timeout
+        while self._running:
+            call = next(iter(self._running))
+            if self._running[call] > deadline:
+                break
+            del self._running[call]
+            self._hung.add(call)
+            self._record(True, call)
+
+    def abandon(self, call=None):
+        """
+        Note that an allowed call was never made (eg it was cancelled), so doesn't count either way.
+
+        Args:
+            call (optional): The permit try_acquire handed out for the call
+        """
+        with self._lock:
+            self._running.pop(call, None)
+            if call is not None and call == self._probe:
+                self._probe = None
+
+    def reset(self):
+        """
+        Close the breaker, forgetting any failures.
+        """
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._probe = None
+            self._running.clear()
+            self._hung.clear()
+
+    def _trip(self):
+        """Open the breaker. Must be called with the lock held."""
+        self._state = OPEN
+        self._opened = _clock()
+        self._trips += 1
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: The state, the number of failures in a row, the number of times the breaker has tripped, and the
+            number of calls skipped (or handed to the fallback) while it was open
+        """
+        with self._lock:
+            return {'state': self._state, 'failures': self._failures, 'trips': self._trips,
+                    'skipped': self._skipped}
@@ -9,7 +9,9 @@ glob pattern. As such, there are a few additional restrictions on the possible k
   * Keys must not contain the '*' character
 
 This should be fairly threadsafe, assuming the reading threads are happy with the chance of slightly
-out of date data being returned if you're unlucky.
+out of date data being returned if you're unlucky. Globs that hit the cache don't take any locks: each is a single
+lookup in a dict that's only changed with the lock held, which is safe with or without the GIL (free-threaded builds
+lock dicts internally). Anything more involved than that takes the lock.
 """
 
 __author__ = 'rob'
@@ -17,8 +19,33 @@ __author__ = 'rob'
 
 import re
 
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from threading import RLock
+from weakref import ref
+
+from wireworks.util.thread_counters import ThreadCounters
+
+_MISSING = object()
+
+
+def compile_glob(glob_pattern, separator='.'):
+    """
+    Convert a glob with ``*`` and ``**`` wildcards into a regular expression matching the keys it would glob, with the
+    same wildcard behaviour as GlobbableDict.glob.
+
+    Args:
+        glob_pattern (str): The glob
+        separator (str, optional): Single character separator used to split components
+
+    Returns:
+        A compiled regular expression
+    """
+    n_parts = []
+    for part in glob_pattern.split('**'):
+        f_parts = [re.escape(p) for p in part.split("*")]
+        n_parts.append(("[^" + separator + "]*").join(f_parts))
+    str_re = "^" + ".*".join(n_parts) + "$"
+    return re.compile(str_re)
 
 
 class GlobbableDict(defaultdict):
@@ -49,6 +76,14 @@ class GlobbableDict(defaultdict):
         self._glob_return_type = glob_return_type
         self._allow_wildcard_keys = allow_wildcard_keys
 
+        # cache hits and misses, counted per thread so that lookups hitting the cache never contend
+        self._stats = ThreadCounters(2)
+
+        # bumped (with the lock held) after every change to the keys, so snapshot_items can tell whether its last copy
+        # of them is still current without taking the lock
+        self._generation = 0
+        self._items = (-1, ())
+
         self._empty_cache()
 
     def glob_intersection(self, glob_patterns):
@@ -100,7 +135,7 @@ class GlobbableDict(defaultdict):
               [1, 2]
 
         This method caches the result where possible, meaning subsequent calls for the same pattern should be faster.
-        Sets or deletes on the dict cause the cache to be invalidated.
+        Sets or deletes on the dict invalidate the cached results for any patterns the key matches.
 
         Args:
             glob_pattern (str): Glob pattern, containing any number of `*` or `**` wildcards.
@@ -115,11 +150,104 @@ class GlobbableDict(defaultdict):
         """
 
         try:
-            return self._cache[glob_pattern]
+            vals = self._cache[glob_pattern]
         except KeyError:
             with self._cachelock:
+                self._stats.get()[1] += 1
                 return self._get_and_cache_glob_value(glob_pattern)
 
+        self._stats.get()[0] += 1
+        return vals
+
+    def glob_derived(self, glob_pattern, derive):
+        """
+        Get a value derived from the result of a glob, such as a sorted or filtered copy of it. The derived value is
+        cached along with the glob result, and thrown away whenever that is - or when `touch` is called for any of the
+        keys the pattern matches.
+
+        Args:
+            glob_pattern (str): Glob pattern, as for glob()
+            derive (callable): Called with the result of glob(glob_pattern) to work out the derived value. Results are
+                cached per derive callable, so it should be the same object every time (eg a module level function)
+                rather than, say, a new lambda for each call.
+
+        Returns:
+            Whatever derive returned
+        """
+        try:
+            vals = self._derived[glob_pattern][derive]
+        except KeyError:
+            with self._cachelock:
+                vals = derive(self.glob(glob_pattern))
+                self._derived.setdefault(glob_pattern, {})[derive] = vals
+                return vals
+
+        self._stats.get()[0] += 1
+        return vals
+
+    def touch(self, keys):
+        """
+        Note that the values of some keys have been changed in place (eg a set that's been added to), so any values
+        derived from globs that match them (see `glob_derived`) are out of date. Cached glob results themselves are
+        left alone, as they hold the values rather than copies of them.
+
+        Args:
+            keys (iterable): The keys whose values have changed
+        """
+        with self._cachelock:
+            self._invalidate(list(keys), derived_only=True)
+
+    def remove_keys(self, keys):
+        """
+        Delete several keys in one go, invalidating the cached globs they match just once. Keys that aren't in the
+        dict are ignored.
+
+        Args:
+            keys (iterable): The keys to delete
+        """
+        with self._cachelock:
+            removed = []
+            for key in keys:
+                if super(GlobbableDict, self).pop(key, _MISSING) is not _MISSING:
+                    removed.append(key)
+
+            if removed:
+                self._generation += 1
+            self._invalidate(removed)
+
+    def snapshot_items(self):
+        """
+        Get every key and value, consistently even while other threads are changing the dict. Iterating over the dict
+        itself isn't safe then: without the GIL, nothing stops a key being added part way through.
+
+        This doesn't take the cache lock, so never waits for a writer. The copy is taken in one go (dict.copy is atomic
+        with the GIL, and holds the dict's own internal lock without it), stamped with the generation of the keys it
+        was taken from, and handed out again until the keys next change.
+
+        Returns:
+            tuple: (key, value) tuples
+        """
+        # read the generation before copying: a change made part way through leaves the copy stamped as out of date
+        generation = self._generation
+        (copied_at, items) = self._items
+        if copied_at != generation:
+            items = tuple(dict.copy(self).items())
+            self._items = (generation, items)
+        return items
+
+    def get_stats(self):
+        """
+        Get statistics about the dict and its glob cache. This doesn't take the cache lock, so is safe to call as often
+        as you like, at the cost of the numbers possibly being very slightly out of date.
+
+        Returns:
+            dict: The number of keys, number of cached glob patterns, glob cache hits and misses, and the hit ratio
+            (or None if nothing has been globbed yet)
+        """
+        (hits, misses) = self._stats.totals()
+        return {'keys': len(self), 'cache_size': len(self._cache), 'cache_hits': hits, 'cache_misses': misses,
+                'cache_hit_ratio': float(hits) / (hits + misses) if hits + misses else None}
+
     def _empty_cache(self):
         """
         Truncate the cache, forcing subsequent calls to do a full lookup
@@ -127,18 +255,30 @@ class GlobbableDict(defaultdict):
 
         with self._cachelock:
             self._cache = {}
+            self._derived = {}
+            self._cache_globs = {}
+
+    def _invalidate(self, keys, derived_only=False):
+        """
+        Drop the cached results (and derived values) for any patterns that match any of the given keys. Must be called
+        with the lock held.
+        """
+        if not keys or not self._cache_globs:
+            return
+
+        stale = [glob_pattern for glob_pattern, compiled_glob in list(self._cache_globs.items())
+                 if any(self._key_matches(compiled_glob, glob_pattern, key) for key in keys)]
+        for glob_pattern in stale:
+            self._derived.pop(glob_pattern, None)
+            if not derived_only:
+                self._cache.pop(glob_pattern, None)
+                del self._cache_globs[glob_pattern]
 
     def _make_glob_re(self, glob_pattern):
         """
         Convert a glob with ``*`` and ``**`` wildcards into a valid regular expression to use for matching keys
         """
-
-        n_parts = []
-        for part in glob_pattern.split('**'):
-            f_parts = [re.escape(p) for p in part.split("*")]
-            n_parts.append(("[^" + self._sep + "]*").join(f_parts))
-        str_re = "^" + ".*".join(n_parts) + "$"
-        return re.compile(str_re)
+        return compile_glob(glob_pattern, self._sep)
 
     def _get_matching_items(self, glob_pattern):
         """
@@ -162,6 +302,13 @@ class GlobbableDict(defaultdict):
 
         return collected_vals
 
+    def _key_matches(self, compiled_glob, glob_pattern, key):
+        """
+        Check whether a key matches a glob pattern, given the pattern's regular expression
+        """
+        return compiled_glob.match(key) is not None or \
+            ('*' in key and self._make_glob_re(key).match(glob_pattern) is not None)
+
     def _get_and_cache_glob_value(self, glob_pattern):
         """
         Match the given glob_key against all registered keys in the dict (using
@@ -174,6 +321,7 @@ class GlobbableDict(defaultdict):
             vals = self._glob_return_type(vals)
 
         self._cache[glob_pattern] = vals
+        self._cache_globs[glob_pattern] = self._make_glob_re(glob_pattern)
 
         return vals
 
@@ -183,9 +331,80 @@ class GlobbableDict(defaultdict):
 
         with self._cachelock:
             super(GlobbableDict, self).__setitem__(str(key), value)
-            self._empty_cache()
+            self._generation += 1
+            self._invalidate([str(key)])
 
     def __delitem__(self, key):
         with self._cachelock:
             super(GlobbableDict, self).__delitem__(key)
-            self._empty_cache()
\ No newline at end of file
+            self._generation += 1
+            self._invalidate([key])
+
+
+class _Generation(object):
+    """See glob_generation. Weakly referenceable, unlike a bare object()."""
+    __slots__ = ('__weakref__',)
+
+
+def glob_generation(values):
+    """
+    A stand-in derived value, to pass to glob_derived to notice when a dict's derived values for a glob are thrown
+    away: a new generation is made each time they're rebuilt, and only the dict holds on to it until then.
+
+    Returns:
+        A new generation token
+    """
+    return _Generation()
+
+
+class MergedGlobCache(object):
+    """
+    Make us a new MergedGlobCache: values derived from a glob over several dicts at once (the shards of a
+    ShardedGlobbableDict, or the layers of a LayeredGlobbableDict), each kept along with the generation of the glob in
+    every dict it was built from (see glob_generation).
+
+    Generations are only weakly referenced, so a value goes stale - and is dropped the next time anything's added - as
+    soon as any of the dicts throws its own derived values for the glob away. Past that, the values least recently
+    added are dropped once there are more than `max_size`. The values are replaced wholesale rather than changed in
+    place, so lookups need no lock.
+
+    Args:
+        max_size (int, optional): The most values to keep
+    """
+    def __init__(self, max_size=4096):
+        if max_size < 1:
+            raise AttributeError("The cache must be able to hold at least one value")
+
+        self._max_size = max_size
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, generations, extra=None):
+        """
+        Args:
+            key: The glob pattern and derive callable the value is for
+            generations (tuple): The current generation of the glob in each dict
+            extra (optional): Anything else the value depends on, compared by equality
+
+        Returns:
+            tuple: (True, the value) if a value built from exactly those generations is cached, otherwise (False, None)
+        """
+        cached = self._values.get(key)
+        if cached is not None and cached[1] == extra and len(cached[0]) == len(generations) and \
+                all(weak() is generation for (weak, generation) in zip(cached[0], generations)):
+            return True, cached[2]
+        return False, None
+
+    def put(self, key, generations, value, extra=None):
+        """
+        Cache a value, dropping any that have gone stale (and the oldest, if there are too many). Arguments are as for
+        get.
+        """
+        values = OrderedDict((cached_key, cached) for (cached_key, cached) in self._values.items()
+                             if cached_key != key and all(weak() is not None for weak in cached[0]))
+        values[key] = (tuple(ref(generation) for generation in generations), extra, value)
+        while len(values) > self._max_size:
+            values.popitem(last=False)
+        self._values = values
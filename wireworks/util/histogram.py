@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+A fixed-bucket histogram, cheap enough to record into on every dispatch.
+
+Buckets are set up front, so recording a value is a binary search and a couple of increments, and memory use never
+grows no matter how many values are recorded. The price is that quantiles are only as precise as the buckets.
+"""
+
+__author__ = 'rob'
+
+from bisect import bisect_left
+from threading import Lock
+
+#: Default bucket upper bounds for latencies, in seconds: 10us up to 10s, roughly logarithmically spaced
+DEFAULT_LATENCY_BOUNDS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                          0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    """
+    Make us a new Histogram.
+
+    Args:
+        bounds (iterable, optional): Sorted upper bounds (inclusive) for each bucket. Anything above the last bound
+            goes into an extra overflow bucket.
+    """
+    def __init__(self, bounds=DEFAULT_LATENCY_BOUNDS):
+        self._bounds = tuple(bounds)
+        if list(self._bounds) != sorted(self._bounds):
+            raise AttributeError("Histogram bounds must be sorted")
+
+        self._lock = Lock()
+        self._counts = [0] * (len(self._bounds) + 1)
+        self._count = 0
+        self._sum = 0.0
+
+    def record(self, value):
+        """
+        Record a single value.
+
+        Args:
+            value (float): The value to record
+        """
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+
+    def get_count(self):
+        """
+        Returns:
+            int: The number of values recorded
+        """
+        return self._count
+
+    def quantile(self, q):
+        """
+        Estimate a quantile from the bucket counts.
+
+        Args:
+            q (float): The quantile, between 0 and 1
+
+        Returns:
+            float: The upper bound of the bucket the quantile falls into (or infinity for the overflow bucket), or
+            None if nothing has been recorded
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+
+        if not total:
+            return None
+
+        target = q * total
+        running = 0
+        for index, count in enumerate(counts):
+            running += count
+            if running >= target and count:
+                return self._bounds[index] if index < len(self._bounds) else float('inf')
+
+        return float('inf')
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: The bucket bounds, per-bucket (non-cumulative) counts - including the overflow bucket - along with
+            the total count and sum of all recorded values
+        """
+        with self._lock:
+            return {'bounds': list(self._bounds), 'counts': list(self._counts), 'count': self._count,
+                    'sum': self._sum}
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+A read-only view globbing over a stack of GlobbableDicts at once, with the top layers able to mask values in the
+layers below.
+
+Making a layer costs the same however much is in the layers below it: nothing is copied. Globs are answered by
+globbing each layer (each using its own glob cache) and merging the results. Values derived from a merged glob (see
+`GlobbableDict.glob_derived`) are cached here, along with a generation token from each layer and the masks in force
+when they were built. A cached value is used for as long as no layer has thrown away its own derived values for the
+glob - ie until a key the glob matches is set, deleted or touched in some layer - and the masks haven't changed. Stale
+values are dropped as new ones are cached, and only so many are kept (see `MergedGlobCache`).
+
+Values are expected to be sets (as they are in a Registry), so that masks can pick individual items out of them.
+"""
+
+__author__ = 'rob'
+
+from wireworks.util.globbable_dict import MergedGlobCache, glob_generation
+
+
+def _merged_values(values):
+    return values
+
+
+class _Layer(object):
+    """One dict in the stack, along with the masks it applies to the layers below it. Masks are replaced wholesale,
+    rather than changed in place, so they can be read without a lock."""
+    __slots__ = ('glob_dict', 'masks')
+
+    def __init__(self, glob_dict):
+        self.glob_dict = glob_dict
+        self.masks = ()
+
+
+class LayeredGlobbableDict(object):
+    """
+    Make us a new LayeredGlobbableDict, layering a dict over a parent.
+
+    Supports the read-only subset of the GlobbableDict interface that a Dispatcher needs. Changes are made directly to
+    the dicts in each layer.
+
+    Args:
+        glob_dict: The top layer: a GlobbableDict (or ShardedGlobbableDict) with set values
+        parent: The layers below: another LayeredGlobbableDict, whose layers (and masks) are shared rather than copied,
+            or a single GlobbableDict (or ShardedGlobbableDict)
+        max_merged (int, optional): The most values derived from merged globs to cache (see MergedGlobCache)
+    """
+    def __init__(self, glob_dict, parent, max_merged=4096):
+        self._layer = _Layer(glob_dict)
+        if isinstance(parent, LayeredGlobbableDict):
+            self._layers = (self._layer,) + parent._layers
+        else:
+            self._layers = (self._layer, _Layer(parent))
+        # derived values for merged globs, along with the masks they were built with
+        self._merged = MergedGlobCache(max_merged)
+
+    def get_depth(self):
+        """
+        Returns:
+            int: The number of layers
+        """
+        return len(self._layers)
+
+    def mask(self, glob_pattern, matches=None):
+        """
+        Hide values in the layers below the top one from globs through this dict: whole values, for keys matching a
+        glob, or only the items in them a predicate picks out. Masks in the layers below apply too, to the layers
+        below them.
+
+        Args:
+            glob_pattern (str): Glob matching the keys to mask
+            matches (callable, optional): Called with an item from a masked value, returning True if it's to be
+                hidden. Compared by equality to unmask it, so shouldn't be a new lambda each time. If None, the
+                values are hidden entirely.
+        """
+        self._layer.masks = tuple(mask for mask in self._layer.masks if mask != (glob_pattern, matches)) + \
+            ((glob_pattern, matches),)
+
+    def unmask(self, glob_pattern, matches=None):
+        """
+        Remove a mask added with the same arguments (see mask). Masks that were never added are ignored.
+        """
+        self._layer.masks = tuple(mask for mask in self._layer.masks if mask != (glob_pattern, matches))
+
+    def get_masks(self):
+        """
+        Returns:
+            tuple: (glob_pattern, matches) for each mask on the top layer, in the order they were added
+        """
+        return self._layer.masks
+
+    def glob(self, glob_pattern):
+        """
+        As GlobbableDict.glob, merging the results from every layer, top layer first, less anything masked.
+
+        Returns:
+            list: Any matches
+        """
+        return self.glob_derived(glob_pattern, _merged_values)
+
+    def glob_derived(self, glob_pattern, derive):
+        """
+        As GlobbableDict.glob_derived. The value derived from the merged result is cached here, and rebuilt whenever
+        any layer throws away its own derived values for the glob, or the masks change.
+
+        Returns:
+            Whatever derive returned
+        """
+        generations = tuple(layer.glob_dict.glob_derived(glob_pattern, glob_generation) for layer in self._layers)
+        masks = tuple(layer.masks for layer in self._layers)
+        cache_key = (glob_pattern, derive)
+        (hit, value) = self._merged.get(cache_key, generations, masks)
+        if hit:
+            return value
+
+        value = derive(self._merge(glob_pattern))
+        self._merged.put(cache_key, generations, value, masks)
+        return value
+
+    def get_stats(self):
+        """
+        Get statistics about the top layer and its glob cache, along with the number of layers and merged globs.
+        See GlobbableDict.get_stats.
+
+        Returns:
+            dict: As GlobbableDict.get_stats, along with 'layers' and 'merged_cache_size'
+        """
+        stats = self._layer.glob_dict.get_stats()
+        stats.update(layers=len(self._layers), merged_cache_size=len(self._merged))
+        return stats
+
+    def _merge(self, glob_pattern):
+        """Glob every layer, top first, dropping or filtering the values masked by the layers above"""
+        values = []
+        hidden = set()
+        filters = {}
+        for (depth, layer) in enumerate(self._layers):
+            for value in layer.glob_dict.glob(glob_pattern):
+                if id(value) in hidden:
+                    continue
+
+                value_filters = filters.get(id(value))
+                if value_filters:
+                    value = set(item for item in list(value) if not any(matches(item) for matches in value_filters))
+                values.append(value)
+
+            # masks apply to the layers below the one they're on, so are only gathered once it's been globbed
+            for (mask_pattern, matches) in layer.masks:
+                for value in self._masked_below(depth, mask_pattern):
+                    if matches is None:
+                        hidden.add(id(value))
+                    else:
+                        filters.setdefault(id(value), []).append(matches)
+
+        return values
+
+    def _masked_below(self, depth, mask_pattern):
+        """Get the values in the layers below the one at the given depth with keys matching a mask's glob"""
+        return [value for lower in self._layers[depth + 1:] for value in lower.glob_dict.glob(mask_pattern)]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+A stand-in for a logging.Logger that doesn't import logging until it's needed.
+
+Logging can't have been configured if it's never been imported, so until something else imports it, debug messages
+are dropped for the price of a dictionary lookup. Once it has been imported, debug messages cost whatever the logger's
+own level check costs - their arguments are only formatted if the message is actually going to be emitted.
+"""
+
+__author__ = 'rob'
+
+import sys
+
+
+class LazyLogger(object):
+    """
+    Make us a new LazyLogger.
+
+    Args:
+        name (str): Name of the logger to use
+    """
+    def __init__(self, name):
+        self._name = name
+        self._logger = None
+
+    def get_logger(self):
+        """
+        Returns:
+            logging.Logger: The underlying logger, importing logging if it hasn't been already
+        """
+        if self._logger is None:
+            import logging
+            self._logger = logging.getLogger(self._name)
+
+        return self._logger
+
+    def is_debug_enabled(self):
+        """
+        Returns:
+            bool: True if debug messages would be emitted. Use this to avoid doing expensive work to build arguments
+            for a debug message that's going to be dropped.
+        """
+        logging = sys.modules.get('logging')
+        return logging is not None and self.get_logger().isEnabledFor(logging.DEBUG)
+
+    def debug(self, msg, *args):
+        """
+        Log a debug message, with %-style arguments. Dropped without importing logging if it hasn't been imported.
+        """
+        if 'logging' in sys.modules:
+            self.get_logger().debug(msg, *args)
+
+    def error(self, msg, *args, **kwargs):
+        self.get_logger().error(msg, *args, **kwargs)
+
+    def exception(self, msg, *args, **kwargs):
+        self.get_logger().exception(msg, *args, **kwargs)
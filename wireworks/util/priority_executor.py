@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+A thread pool that runs calls by priority rather than first in, first out.
+
+Calls wait in one of a fixed number of lanes, and workers always take the next call from the most urgent lane with
+anything in it - so a latency-critical call submitted behind a flood of bulk work overtakes all of it, rather than
+queueing up behind it. To stop a busy urgent lane starving the others entirely, a lane that's been passed over too
+many times in a row gets the next call taken, whatever's waiting above it.
+
+Dispatchers use the lanes through `Dispatcher.with_priority`, or for handlers registered with a dispatch priority.
+"""
+
+__author__ = 'rob'
+
+import os
+
+from collections import deque
+from concurrent.futures import Executor, Future
+from threading import Condition, Thread
+
+LOW = 0
+NORMAL = 1
+HIGH = 2
+
+
+class _WorkItem(object):
+    __slots__ = ('future', 'fn', 'args', 'kwargs')
+
+    def __init__(self, future, fn, args, kwargs):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+class PriorityExecutor(Executor):
+    """
+    Make us a new PriorityExecutor. Worker threads are started as they're needed, up to `max_workers`.
+
+    Priorities are lane numbers, from 0 (LOW) up to `lanes - 1`; higher priority calls are run first. With the default
+    three lanes, LOW, NORMAL and HIGH name them all. Priorities outside the range are clamped to it.
+
+    Args:
+        max_workers (int, optional): The most threads to run calls on. Defaults to the number of CPUs plus four (and no
+            more than 32), as for a ThreadPoolExecutor.
+        lanes (int, optional): The number of priority lanes
+        starvation_limit (int, optional): The most times in a row a lane with calls waiting may be passed over for a
+            more urgent one. Once it has been, the lane's next call is taken ahead of anything more urgent. If None,
+            lanes are strictly prioritised, and a busy lane can starve every lane below it.
+        default_priority (int, optional): The priority of calls made through `submit`. Defaults to the middle lane.
+    """
+    def __init__(self, max_workers=None, lanes=3, starvation_limit=16, default_priority=None):
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4) if hasattr(os, 'cpu_count') else 5
+        if max_workers < 1:
+            raise AttributeError("There must be at least one worker")
+        if lanes < 1:
+            raise AttributeError("There must be at least one lane")
+        if starvation_limit is not None and starvation_limit < 1:
+            raise AttributeError("The starvation limit must be positive")
+
+        self._max_workers = max_workers
+        self._starvation_limit = starvation_limit
+        self._lanes = [deque() for _ in range(lanes)]
+        self._skips = [0] * lanes
+        self._submitted = [0] * lanes
+        self._promoted = [0] * lanes
+        self._default_lane = self._lane_index(default_priority if default_priority is not None else lanes // 2)
+        self._lane_executors = [_LaneExecutor(self, lane) for lane in range(lanes)]
+        self._condition = Condition()
+        self._queued = 0
+        self._idle = 0
+        self._threads = []
+        self._shutdown = False
+
+    def __repr__(self):
+        return "PriorityExecutor(max_workers=%r, lanes=%r, starvation_limit=%r)" % (
+            self._max_workers, len(self._lanes), self._starvation_limit)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Submit a call at the default priority.
+
+        Returns:
+            Future: A Future representing the call
+        """
+        return self.submit_at(self._default_lane, fn, *args, **kwargs)
+
+    def submit_at(self, priority, fn, *args, **kwargs):
+        """
+        Submit a call at the given priority.
+
+        Args:
+            priority (int): The lane to queue the call in
+
+        Returns:
+            Future: A Future representing the call
+        """
+        lane = self._lane_index(priority)
+        future = Future()
+        item = _WorkItem(future, fn, args, kwargs)
+
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit calls after shutdown")
+
+            self._lanes[lane].append(item)
+            self._submitted[lane] += 1
+            self._queued += 1
+
+            # wake an idle worker first, so the call never waits on a new thread starting when one's already free
+            self._condition.notify()
+            if self._queued > self._idle and len(self._threads) < self._max_workers:
+                thread = Thread(target=self._work, name="wireworks-priority-%d" % len(self._threads))
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+
+        return future
+
+    def at_priority(self, priority):
+        """
+        Get an Executor that submits everything to this one at the given priority. Shutting it down shuts down this
+        executor.
+
+        Args:
+            priority (int): The lane to queue calls in
+
+        Returns:
+            Executor: The lane's executor
+        """
+        return self._lane_executors[self._lane_index(priority)]
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        Stop accepting calls. Calls already queued are still run, unless `cancel_futures` is True.
+
+        Args:
+            wait (bool, optional): If True, wait for queued calls to finish and the workers to exit
+            cancel_futures (bool, optional): If True, cancel every call that hasn't started yet
+        """
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                for lane in self._lanes:
+                    while lane:
+                        lane.popleft().future.cancel()
+                self._queued = 0
+            self._condition.notify_all()
+            threads = list(self._threads)
+
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: The number of workers started, and for each lane (lowest priority first) the number of calls queued,
+            the number submitted, and the number taken ahead of a more urgent lane to keep the lane from starving
+        """
+        with self._condition:
+            return {'workers': len(self._threads),
+                    'lanes': [{'queued': len(lane), 'submitted': submitted, 'promoted': promoted}
+                              for (lane, submitted, promoted) in zip(self._lanes, self._submitted, self._promoted)]}
+
+    def _lane_index(self, priority):
+        return max(0, min(len(self._lanes) - 1, int(priority)))
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queued:
+                    if self._shutdown:
+                        return
+                    self._idle += 1
+                    self._condition.wait()
+                    self._idle -= 1
+
+                item = self._take()
+
+            item.run()
+            # don't hang onto the call (and its arguments) while waiting for the next one
+            item = None
+
+    def _take(self):
+        """Take the next call to run. Must be called with the lock held, and something queued."""
+        lanes = self._lanes
+        skips = self._skips
+        top = None
+        chosen = None
+        for lane in range(len(lanes) - 1, -1, -1):
+            if not lanes[lane]:
+                continue
+            if top is None:
+                top = chosen = lane
+            elif self._starvation_limit is not None and skips[lane] >= self._starvation_limit:
+                chosen = lane
+                break
+
+        for lane in range(len(lanes)):
+            if lanes[lane] and lane != chosen:
+                skips[lane] += 1
+        skips[chosen] = 0
+        if chosen != top:
+            self._promoted[chosen] += 1
+
+        self._queued -= 1
+        return lanes[chosen].popleft()
+
+
+class _LaneExecutor(Executor):
+    """Submits everything to a PriorityExecutor at a single priority"""
+    def __init__(self, executor, priority):
+        self._executor = executor
+        self._priority = priority
+
+    def __repr__(self):
+        return "%r at priority %d" % (self._executor, self._priority)
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit_at(self._priority, fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self._executor.shutdown(wait, cancel_futures)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Rate limiting and load shedding for handlers: a threadsafe token bucket, optionally combined with a cap on the number
+of calls in flight.
+
+Calls that a limiter won't admit are shed rather than queued, and their Futures are completed with a CallRejected
+instead of a result.
+"""
+
+__author__ = 'rob'
+
+import time
+
+from threading import Lock
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class CallRejected(Exception):
+    """
+    A call was shed by a RateLimiter rather than being made. This is what the call's Future is completed with.
+
+    Args:
+        limiter: The RateLimiter (or, for a CircuitOpen, the CircuitBreaker) that shed the call
+        reason (str): Why it was shed: 'rate' if the token bucket was empty, 'pending' if too many calls were
+            already in flight, or 'circuit open' for a CircuitOpen
+    """
+    def __init__(self, limiter, reason):
+        super(CallRejected, self).__init__("Call shed (%s): %r" % (reason, limiter))
+        self.limiter = limiter
+        self.reason = reason
+
+
+def make_limiter(spec):
+    """
+    Build a RateLimiter from one of the forms accepted by ``Registry.wire(rate_limit=...)``.
+
+    Args:
+        spec: None for no limit, a number of calls per second (with a burst of the same size), or a RateLimiter to be
+            used as-is - and shared with anything else using it
+
+    Returns:
+        RateLimiter: The limiter, or None if no limit was asked for
+    """
+    if spec is None:
+        return None
+    if isinstance(spec, RateLimiter):
+        return spec
+    return RateLimiter(rate=float(spec))
+
+
+class RateLimiter(object):
+    """
+    Make us a new RateLimiter.
+
+    The token bucket starts full. Each call admitted takes a token, and tokens are added back at `rate` per second, up
+    to `burst` of them - so a quiet handler can take a burst of calls at once, and a busy one is held to `rate` on
+    average. With `max_pending`, calls are also shed while that many admitted calls have yet to complete, which stops
+    work queueing up behind a slow handler.
+
+    Args:
+        rate (float, optional): Calls per second to admit on average. If None, calls aren't rate limited.
+        burst (int, optional): Size of the token bucket - the most calls admitted at once after a quiet spell.
+            Defaults to one second's worth of calls (and at least one).
+        max_pending (int, optional): The most admitted calls that may not have completed yet. If None, there's no
+            limit.
+    """
+    def __init__(self, rate=None, burst=None, max_pending=None):
+        if rate is None and max_pending is None:
+            raise AttributeError("A rate, a maximum number of pending calls, or both, must be given")
+        if rate is not None and rate <= 0:
+            raise AttributeError("The rate must be positive")
+        if max_pending is not None and max_pending < 1:
+            raise AttributeError("The maximum number of pending calls must be positive")
+
+        self._rate = rate
+        self._burst = float(burst if burst is not None else max(1, rate or 1))
+        self._max_pending = max_pending
+        self._lock = Lock()
+        self._tokens = self._burst
+        self._refilled = _clock()
+        self._pending = 0
+        self._admitted = 0
+        self._rejected = 0
+
+    def __repr__(self):
+        return "RateLimiter(rate=%r, burst=%r, max_pending=%r)" % (self._rate, self._burst, self._max_pending)
+
+    def tracks_pending(self):
+        """
+        Returns:
+            bool: True if admitted calls must be released once they've completed
+        """
+        return self._max_pending is not None
+
+    def try_acquire(self):
+        """
+        Try to admit a call. If the limiter tracks pending calls (see tracks_pending), every admitted call must be
+        released once it's completed.
+
+        Returns:
+            str: None if the call was admitted, or the reason it wasn't (see CallRejected)
+        """
+        with self._lock:
+            if self._max_pending is not None and self._pending >= self._max_pending:
+                self._rejected += 1
+                return 'pending'
+
+            if self._rate is not None:
+                now = _clock()
+                self._tokens = min(self._burst, self._tokens + (now - self._refilled) * self._rate)
+                self._refilled = now
+                if self._tokens < 1:
+                    self._rejected += 1
+                    return 'rate'
+                self._tokens -= 1
+
+            if self._max_pending is not None:
+                self._pending += 1
+            self._admitted += 1
+            return None
+
+    def release(self):
+        """
+        Note that an admitted call has completed (or will never be made).
+        """
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Admitted and rejected call counts, the number of calls in flight, and the tokens left in the bucket
+            (None if calls aren't rate limited)
+        """
+        with self._lock:
+            return {'admitted': self._admitted, 'rejected': self._rejected, 'pending': self._pending,
+                    'tokens': self._tokens if self._rate is not None else None}
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+A small, threadsafe, size-bounded LRU cache for handler results, with optional expiry.
+
+Results are keyed on the arguments a handler was called with, so only handlers that are pure functions of their
+arguments should be cached. Calls with unhashable arguments are never cached.
+"""
+
+__author__ = 'rob'
+
+import time
+
+from collections import OrderedDict
+from threading import Lock
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def make_cache(spec):
+    """
+    Build a ResultCache from one of the forms accepted by ``Registry.wire(cache=...)``.
+
+    Args:
+        spec: None or False for no cache, True for a cache with the default settings, an int for a cache with that
+            maximum size, or a ResultCache to be used as-is
+
+    Returns:
+        ResultCache: The cache, or None if no caching was asked for
+    """
+    if spec is None or spec is False:
+        return None
+    if spec is True:
+        return ResultCache()
+    if isinstance(spec, ResultCache):
+        return spec
+    return ResultCache(max_size=int(spec))
+
+
+def make_key(args, kwargs):
+    """
+    Build a cache key for the given call arguments.
+
+    Returns:
+        The key, or None if the arguments aren't hashable
+    """
+    key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+    try:
+        hash(key)
+    except TypeError:
+        return None
+
+    return key
+
+
+class ResultCache(object):
+    """
+    Make us a new ResultCache.
+
+    Args:
+        max_size (int, optional): Maximum number of results to hold. The least recently used result is evicted to
+            make room for new ones.
+        ttl (float, optional): Time in seconds for which a result stays valid. If None, results never expire.
+    """
+    def __init__(self, max_size=128, ttl=None):
+        if max_size < 1:
+            raise AttributeError("The maximum size must be positive")
+
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        """
+        Look up a result.
+
+        Args:
+            key: Key as returned by make_key()
+
+        Returns:
+            tuple: (hit, value). If hit is False, value is None.
+        """
+        with self._lock:
+            try:
+                (value, expires) = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return False, None
+
+            if expires is not None and expires <= _clock():
+                del self._entries[key]
+                self._misses += 1
+                return False, None
+
+            self._move_to_end(key)
+            self._hits += 1
+            return True, value
+
+    def store(self, key, value):
+        """
+        Store a result, evicting the least recently used one if the cache is full.
+
+        Args:
+            key: Key as returned by make_key()
+            value: The result to store
+        """
+        expires = _clock() + self._ttl if self._ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._move_to_end(key)
+
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def empty_copy(self):
+        """
+        Returns:
+            ResultCache: A new, empty cache with the same settings as this one
+        """
+        return ResultCache(self._max_size, self._ttl)
+
+    def clear(self):
+        """
+        Drop all stored results. Statistics are left alone.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: Hit, miss and eviction counts, along with the current size
+        """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'evictions': self._evictions,
+                    'size': len(self._entries)}
+
+    def _move_to_end(self, key):
+        # OrderedDict.move_to_end only exists on python 3
+        if hasattr(self._entries, 'move_to_end'):
+            self._entries.move_to_end(key)
+        else:
+            self._entries[key] = self._entries.pop(key)
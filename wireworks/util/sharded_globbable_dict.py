@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+A GlobbableDict split over several independently locked shards.
+
+Writes to one shard (setting, deleting or touching keys, and the cache invalidation that comes with them) don't wait
+for writes to any other, so writers spread over many keys contend far less than they would on a single GlobbableDict.
+Globs are answered by whichever shards could hold a match, with the results merged.
+
+Keys are assigned to shards by their top level component by default, so every key starting ``orders.`` lives in the
+same shard, and a glob whose top level component is literal (eg ``orders.*``) only needs to look at one shard. Globs
+with a wildcard in their top level component (eg ``*.created`` or ``**``) look at every shard. Alternatively, keys can
+be assigned by hashing the whole key, which spreads keys sharing a top level component over every shard, at the cost
+of almost every glob looking at every shard.
+
+Wildcard keys aren't supported, as there's no telling which shard would need to hold them.
+"""
+
+__author__ = 'rob'
+
+from wireworks.util.globbable_dict import GlobbableDict, MergedGlobCache, glob_generation
+
+PARTITION_TOP_LEVEL = 'top_level'
+PARTITION_KEY = 'key'
+
+
+class ShardedGlobbableDict(object):
+    """
+    Make us a new ShardedGlobbableDict.
+
+    Supports the subset of the GlobbableDict interface that a Registry needs, with the same semantics.
+
+    Args:
+        shards (int): Number of shards to split the keys over
+        separator (str, optional): Single character separator to use to split components
+        default_factory (callable, optional): As for GlobbableDict
+        partition (str, optional): How to assign keys to shards: PARTITION_TOP_LEVEL (the default) to use the key's
+            top level component, or PARTITION_KEY to use the whole key
+        max_merged (int, optional): The most values derived from globs spanning several shards to cache (see
+            MergedGlobCache)
+    """
+    def __init__(self, shards, separator='.', default_factory=None, partition=PARTITION_TOP_LEVEL, max_merged=4096):
+        if shards < 1:
+            raise AttributeError("There must be at least one shard")
+        if partition not in (PARTITION_TOP_LEVEL, PARTITION_KEY):
+            raise AttributeError("Unknown partitioning %r" % (partition,))
+
+        self._sep = separator
+        self._partition = partition
+        self._shards = [GlobbableDict(separator, default_factory=default_factory) for _ in range(shards)]
+        # merged derived values for globs spanning several shards
+        self._merged = MergedGlobCache(max_merged)
+
+    def get_shard_count(self):
+        return len(self._shards)
+
+    def get_shard(self, index):
+        """
+        Get a shard, to work on its keys directly. Only keys for which shard_index returns the same index may be
+        added to it.
+
+        Returns:
+            GlobbableDict: The shard
+        """
+        return self._shards[index]
+
+    def shard_index(self, key):
+        """
+        Returns:
+            int: The index of the shard holding (or that would hold) the given key
+        """
+        if self._partition == PARTITION_TOP_LEVEL:
+            key = key.partition(self._sep)[0]
+        return hash(key) % len(self._shards)
+
+    def _shard(self, key):
+        return self._shards[self.shard_index(key)]
+
+    def _shards_for_glob(self, glob_pattern):
+        """Get the shards that could hold keys matching the given glob"""
+        if self._partition == PARTITION_TOP_LEVEL:
+            top_level = glob_pattern.partition(self._sep)[0]
+        else:
+            top_level = glob_pattern
+
+        if '*' in top_level:
+            return self._shards
+        return [self._shards[hash(top_level) % len(self._shards)]]
+
+    def _group_by_shard(self, keys):
+        """Group keys into lists by the shard holding them"""
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.shard_index(key), []).append(key)
+        return [(self._shards[index], shard_keys) for index, shard_keys in groups.items()]
+
+    def __getitem__(self, key):
+        return self._shard(key)[key]
+
+    def __setitem__(self, key, value):
+        self._shard(key)[key] = value
+
+    def __delitem__(self, key):
+        del self._shard(key)[key]
+
+    def __contains__(self, key):
+        return key in self._shard(key)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def get(self, key, default=None):
+        return self._shard(key).get(key, default)
+
+    def keys(self):
+        return [key for (key, _) in self.snapshot_items()]
+
+    def items(self):
+        return self.snapshot_items()
+
+    def snapshot_items(self):
+        """
+        As GlobbableDict.snapshot_items, over every shard. Each shard is consistent in itself, but changes made to
+        other shards while it's running may or may not be included.
+
+        Returns:
+            list: (key, value) tuples
+        """
+        return [item for shard in self._shards for item in shard.snapshot_items()]
+
+    def glob(self, glob_pattern):
+        """
+        As GlobbableDict.glob, merging the results from every shard that could hold a match.
+
+        Returns:
+            list: Any matches
+        """
+        shards = self._shards_for_glob(glob_pattern)
+        if len(shards) == 1:
+            return shards[0].glob(glob_pattern)
+        return [value for shard in shards for value in shard.glob(glob_pattern)]
+
+    def glob_derived(self, glob_pattern, derive):
+        """
+        As GlobbableDict.glob_derived. Where a glob spans several shards, the value derived from the merged result is
+        cached here, and rebuilt whenever any of the shards throws away its own derived values for the glob.
+
+        Returns:
+            Whatever derive returned
+        """
+        shards = self._shards_for_glob(glob_pattern)
+        if len(shards) == 1:
+            return shards[0].glob_derived(glob_pattern, derive)
+
+        generations = tuple(shard.glob_derived(glob_pattern, glob_generation) for shard in shards)
+        cache_key = (glob_pattern, derive)
+        (hit, value) = self._merged.get(cache_key, generations)
+        if hit:
+            return value
+
+        value = derive([value for shard in shards for value in shard.glob(glob_pattern)])
+        self._merged.put(cache_key, generations, value)
+        return value
+
+    def touch(self, keys):
+        """
+        As GlobbableDict.touch. Only the shards holding the keys are locked.
+        """
+        for (shard, shard_keys) in self._group_by_shard(keys):
+            shard.touch(shard_keys)
+
+    def remove_keys(self, keys):
+        """
+        As GlobbableDict.remove_keys. Only the shards holding the keys are locked.
+        """
+        for (shard, shard_keys) in self._group_by_shard(keys):
+            shard.remove_keys(shard_keys)
+
+    def get_stats(self):
+        """
+        Get statistics about the dict and its glob cache, summed over every shard. See GlobbableDict.get_stats.
+
+        Returns:
+            dict: As GlobbableDict.get_stats, along with the number of shards
+        """
+        totals = {'keys': 0, 'cache_size': 0, 'cache_hits': 0, 'cache_misses': 0}
+        for shard in self._shards:
+            shard_stats = shard.get_stats()
+            for name in totals:
+                totals[name] += shard_stats[name]
+
+        lookups = totals['cache_hits'] + totals['cache_misses']
+        totals['cache_hit_ratio'] = float(totals['cache_hits']) / lookups if lookups else None
+        totals['shards'] = len(self._shards)
+        return totals
@@ -1,22 +1,77 @@
 __author__ = 'rob'
 
-from threading import local
+import sys
 
+# The current event is kept in a context variable where we can, so that it follows asyncio tasks and anything run in
+# a copied context. Failing that (python < 3.7), a thread local has to do.
+try:
+    from contextvars import ContextVar, copy_context
+except ImportError:
+    ContextVar = None
+    copy_context = None
 
-_event_threadlocal = local()
+    from threading import local
+
+    _event_threadlocal = local()
+else:
+    _current_event = ContextVar('wireworks_current_event', default=None)
 
 
 def set_current_event(event):
+    """Set the current event, returning a token that can be used to restore the previous one with
+    `clear_current_event`."""
+    if ContextVar:
+        return _current_event.set(event)
+
+    previous = getattr(_event_threadlocal, 'event', None)
     _event_threadlocal.event = event
+    return previous
+
+
+def clear_current_event(token=None):
+    """Restore whatever the current event was before the `set_current_event` call that returned the given token. If
+    no token is given, the current event is simply cleared."""
+    if ContextVar:
+        if token is not None:
+            _current_event.reset(token)
+        else:
+            _current_event.set(None)
+    else:
+        _event_threadlocal.event = token
+
+
+def get_current_event():
+    """Get the current event, or None if there isn't one."""
+    if ContextVar:
+        return _current_event.get()
+    return getattr(_event_threadlocal, 'event', None)
+
+
+def run_in_copied_context(fn):
+    """Wrap a callable so that it runs in a copy of the current context, wherever it ends up being called from (eg an
+    executor thread). Without context variables, the callable is returned untouched."""
+    if not copy_context:
+        return fn
+
+    context = copy_context()
+
+    def in_context():
+        return context.run(fn)
+
+    return in_context
 
 
-def clear_current_event():
-    del _event_threadlocal.event
+def runs_out_of_process(executor):
+    """Check whether an executor runs calls in other processes (ie it's a `ProcessPoolExecutor`), so that everything
+    submitted to it has to be pickled. Nothing is imported to find out: if concurrent.futures.process hasn't been
+    imported, there can't be one."""
+    process = sys.modules.get('concurrent.futures.process')
+    return process is not None and isinstance(executor, process.ProcessPoolExecutor)
 
 
 def current_event():
-    try:
-        return _event_threadlocal.event
-    except AttributeError:
+    event = get_current_event()
+    if event is None:
         raise ValueError("No event is currently available. current_event() should only be used from a method that "
-                         "has been invoked as part of an event dispatch.")
\ No newline at end of file
+                         "has been invoked as part of an event dispatch.")
+    return event
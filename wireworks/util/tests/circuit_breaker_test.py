@@ -0,0 +1,126 @@
+__author__ = 'rob'
+
+import time
+import unittest
+
+from wireworks.util.circuit_breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN, make_breaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def _fail(self, breaker, times):
+        for _ in range(times):
+            self.assertTrue(breaker.try_acquire())
+            breaker.record(ValueError())
+
+    def test_trips(self):
+        """
+        Test that the breaker trips after enough failures in a row, and no sooner
+        """
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+
+        self._fail(breaker, 2)
+        self.assertTrue(breaker.try_acquire())
+        breaker.record(None)
+        self._fail(breaker, 2)
+        self.assertEqual(CLOSED, breaker.get_state(), "A success didn't reset the failure count")
+
+        self._fail(breaker, 1)
+        self.assertEqual(OPEN, breaker.get_state())
+        self.assertFalse(breaker.try_acquire())
+        self.assertEqual({'state': OPEN, 'failures': 3, 'trips': 1, 'skipped': 1}, breaker.get_stats())
+
+    def test_half_open_probe(self):
+        """
+        Test that once the reset timeout has passed, a single probe is let through, and its outcome decides the state
+        """
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        self._fail(breaker, 1)
+
+        time.sleep(0.1)
+        probe = breaker.try_acquire()
+        self.assertTrue(probe, "Probe not let through")
+        self.assertEqual(HALF_OPEN, breaker.get_state())
+        self.assertFalse(breaker.try_acquire(), "More than one probe let through")
+
+        breaker.record(ValueError(), call=probe)
+        self.assertEqual(OPEN, breaker.get_state(), "Failed probe didn't reopen the breaker")
+
+        time.sleep(0.1)
+        probe = breaker.try_acquire()
+        self.assertTrue(probe)
+        breaker.abandon(probe)
+        probe = breaker.try_acquire()
+        self.assertTrue(probe, "Abandoned probe not replaced")
+        breaker.record(None, call=probe)
+        self.assertEqual(CLOSED, breaker.get_state())
+        self.assertTrue(breaker.try_acquire())
+
+    def test_late_calls_while_half_open(self):
+        """
+        Test that calls let through before the breaker tripped don't decide the probe's outcome
+        """
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        early = breaker.try_acquire()
+        late = breaker.try_acquire()
+        self._fail(breaker, 1)
+
+        time.sleep(0.1)
+        probe = breaker.try_acquire()
+        self.assertTrue(probe)
+
+        breaker.record(None, call=early)
+        self.assertEqual(HALF_OPEN, breaker.get_state(), "Late success closed the breaker")
+        breaker.record(ValueError(), call=late)
+        self.assertEqual(HALF_OPEN, breaker.get_state(), "Late failure reopened the breaker")
+        self.assertFalse(breaker.try_acquire(), "Late calls cleared the probe")
+
+        breaker.record(None, call=probe)
+        self.assertEqual(CLOSED, breaker.get_state())
+
+    def test_call_timeout(self):
+        """
+        Test that calls taking too long count as failures, even if they returned
+        """
+        breaker = CircuitBreaker(failure_threshold=2, call_timeout=0.5)
+
+        breaker.record(None, 0.1)
+        breaker.record(None, 1.0)
+        self.assertEqual(CLOSED, breaker.get_state())
+        breaker.record(None, 1.0)
+        self.assertEqual(OPEN, breaker.get_state())
+
+    def test_hung_call(self):
+        """
+        Test that a call still running past the call timeout counts as a failure once the next call is attempted, and
+        isn't counted again if it does return
+        """
+        breaker = CircuitBreaker(failure_threshold=1, call_timeout=0.05)
+        hung = breaker.try_acquire()
+        breaker.start(hung)
+
+        time.sleep(0.1)
+        self.assertFalse(breaker.try_acquire(), "Hung call not counted")
+        self.assertEqual(OPEN, breaker.get_state())
+
+        breaker.reset()
+        breaker.record(None, call=hung)
+        self.assertEqual({'state': CLOSED, 'failures': 0, 'trips': 1, 'skipped': 1}, breaker.get_stats())
+
+    def test_reset(self):
+        breaker = CircuitBreaker(failure_threshold=1)
+        self._fail(breaker, 1)
+
+        breaker.reset()
+
+        self.assertEqual(CLOSED, breaker.get_state())
+        self.assertTrue(breaker.try_acquire())
+
+    def test_make_breaker(self):
+        breaker = CircuitBreaker()
+
+        self.assertIsNone(make_breaker(None))
+        self.assertIsNone(make_breaker(False))
+        self.assertIs(breaker, make_breaker(breaker))
+        self.assertIsInstance(make_breaker(True), CircuitBreaker)
+        self.assertEqual(2, make_breaker(2)._failure_threshold)
+        self.assertRaises(AttributeError, CircuitBreaker, failure_threshold=0)
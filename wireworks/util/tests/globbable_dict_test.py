@@ -2,7 +2,7 @@ __author__ = 'rob'
 
 import unittest
 
-from wireworks.util.globbable_dict import GlobbableDict
+from wireworks.util.globbable_dict import GlobbableDict, MergedGlobCache, glob_generation
 
 
 class TestGlobbableDict(unittest.TestCase):
@@ -261,4 +261,152 @@ class TestGlobbableDict(unittest.TestCase):
 
         self.assertListEqual(sorted(d.glob("a.*")), [1, 2])
         self.assertListEqual(sorted(d.glob("a.b/*")), [3])
-        self.assertListEqual(sorted(d.glob("*")), [1, 2])
\ No newline at end of file
+        self.assertListEqual(sorted(d.glob("*")), [1, 2])
+
+    def test_targeted_invalidation(self):
+        """
+        Test that setting or deleting a key only invalidates the cached globs it matches
+        """
+
+        d = GlobbableDict(allow_wildcard_keys=True)
+
+        d['a.b'] = 1
+        d['c.d'] = 2
+
+        self.assertListEqual(d.glob("a.*"), [1])
+        self.assertListEqual(d.glob("c.*"), [2])
+
+        d['a.e'] = 3
+        self.assertListEqual(d.glob("c.*"), [2])
+        self.assertEqual(1, d.get_stats()['cache_hits'], "Unrelated glob was invalidated")
+        self.assertListEqual(sorted(d.glob("a.*")), [1, 3])
+        self.assertEqual(1, d.get_stats()['cache_hits'], "Matching glob not invalidated")
+
+        d['*.f'] = 4
+        self.assertListEqual(d.glob("c.f"), [4])
+        del d['*.f']
+        self.assertListEqual(d.glob("c.f"), [], "Glob matched by a wildcard key not invalidated")
+
+    def test_remove_keys(self):
+        """
+        Test that keys can be removed in bulk, ignoring any that aren't there
+        """
+
+        d = GlobbableDict()
+
+        d['a.b'] = 1
+        d['a.c'] = 2
+        d['d.e'] = 3
+
+        self.assertListEqual(sorted(d.glob("a.*")), [1, 2])
+        self.assertListEqual(d.glob("d.*"), [3])
+
+        d.remove_keys(['a.b', 'a.c', 'x.y'])
+
+        self.assertListEqual(sorted(d.keys()), ['d.e'])
+        self.assertListEqual(d.glob("a.*"), [])
+        self.assertListEqual(d.glob("d.*"), [3])
+        self.assertEqual(1, d.get_stats()['cache_hits'], "Unrelated glob was invalidated")
+
+    def test_glob_derived(self):
+        """
+        Test that derived values are cached until a matching key is set, removed or touched
+        """
+
+        d = GlobbableDict()
+        calls = []
+
+        def derive(values):
+            calls.append(values)
+            return sum(values)
+
+        d['a.b'] = 1
+        d['a.c'] = 2
+        d['d.e'] = 3
+
+        self.assertEqual(3, d.glob_derived("a.*", derive))
+        self.assertEqual(3, d.glob_derived("a.*", derive))
+        self.assertEqual(1, len(calls), "Derived value not cached")
+
+        d.touch(['d.e'])
+        self.assertEqual(3, d.glob_derived("a.*", derive))
+        self.assertEqual(1, len(calls), "Touching an unrelated key invalidated the derived value")
+
+        d.touch(['a.b'])
+        self.assertEqual(3, d.glob_derived("a.*", derive))
+        self.assertEqual(2, len(calls), "Touching a matching key didn't invalidate the derived value")
+
+        d['a.f'] = 4
+        self.assertEqual(7, d.glob_derived("a.*", derive))
+        self.assertEqual(3, len(calls), "Setting a matching key didn't invalidate the derived value")
+
+    def test_concurrent_globs_and_sets(self):
+        """
+        Test that globs and sets from many threads at once neither fail nor lose cache statistics
+        """
+        import threading
+
+        d = GlobbableDict()
+        d['a.b'] = 1
+        d.glob('a.*')
+        errors = []
+
+        def glob_many():
+            try:
+                for _ in range(2000):
+                    d.glob('a.*')
+            except Exception as e:
+                errors.append(e)
+
+        def set_many():
+            for index in range(200):
+                d['b.%d' % index] = index
+                d.snapshot_items()
+
+        threads = [threading.Thread(target=glob_many) for _ in range(4)] + [threading.Thread(target=set_many)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertListEqual([], errors)
+        self.assertEqual(8000, d.get_stats()['cache_hits'])
+        self.assertEqual(201, len(d.snapshot_items()))
+
+
+class TestMergedGlobCache(unittest.TestCase):
+    def setUp(self):
+        self._dicts = [GlobbableDict(), GlobbableDict()]
+        self._dicts[0]['a.b'] = 1
+        self._dicts[1]['b.b'] = 2
+
+    def _generations(self, glob_pattern):
+        return tuple(d.glob_derived(glob_pattern, glob_generation) for d in self._dicts)
+
+    def test_stale_values_dropped(self):
+        """
+        Test that a value is only used while every dict's generation is unchanged, and dropped once it's stale
+        """
+        cache = MergedGlobCache()
+        cache.put(('*.b', sorted), self._generations('*.b'), [1, 2])
+        self.assertEqual((True, [1, 2]), cache.get(('*.b', sorted), self._generations('*.b')))
+        self.assertEqual((False, None), cache.get(('*.b', sorted), self._generations('*.b'), extra='other'))
+
+        self._dicts[1]['c.b'] = 3
+        self.assertEqual((False, None), cache.get(('*.b', sorted), self._generations('*.b')))
+
+        cache.put(('a.*', sorted), self._generations('a.*'), [1])
+        self.assertEqual(1, len(cache), "Stale value kept")
+
+    def test_bounded(self):
+        """
+        Test that only the values added most recently are kept
+        """
+        cache = MergedGlobCache(max_size=2)
+        for glob_pattern in ['a.*', '*.b', '**']:
+            cache.put((glob_pattern, sorted), self._generations(glob_pattern), glob_pattern)
+
+        self.assertEqual(2, len(cache))
+        self.assertFalse(cache.get(('a.*', sorted), self._generations('a.*'))[0])
+        self.assertTrue(cache.get(('**', sorted), self._generations('**'))[0])
+        self.assertRaises(AttributeError, MergedGlobCache, max_size=0)
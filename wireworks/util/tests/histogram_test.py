@@ -0,0 +1,43 @@
+__author__ = 'rob'
+
+import unittest
+
+from wireworks.util.histogram import Histogram
+
+
+class TestHistogram(unittest.TestCase):
+    def test_record_into_buckets(self):
+        """
+        Test that values land in the right buckets, with anything too big going into the overflow bucket
+        """
+        hist = Histogram(bounds=(1, 10))
+
+        for value in (0.5, 1, 5, 10, 11, 100):
+            hist.record(value)
+
+        snapshot = hist.snapshot()
+        self.assertListEqual([1, 10], snapshot['bounds'])
+        self.assertListEqual([2, 2, 2], snapshot['counts'])
+        self.assertEqual(6, snapshot['count'])
+        self.assertAlmostEqual(127.5, snapshot['sum'])
+
+    def test_quantiles(self):
+        """
+        Test that quantiles are estimated as the upper bound of the bucket they fall into
+        """
+        hist = Histogram(bounds=(1, 10))
+        self.assertIsNone(hist.quantile(0.5))
+
+        for value in range(9):
+            hist.record(0.5)
+        hist.record(50)
+
+        self.assertEqual(1, hist.quantile(0.5))
+        self.assertEqual(1, hist.quantile(0.9))
+        self.assertEqual(float('inf'), hist.quantile(0.99))
+
+    def test_unsorted_bounds_rejected(self):
+        """
+        Test that bounds must be sorted
+        """
+        self.assertRaises(AttributeError, Histogram, (10, 1))
@@ -0,0 +1,98 @@
+__author__ = 'rob'
+
+import unittest
+
+from wireworks.util.globbable_dict import GlobbableDict
+from wireworks.util.layered_globbable_dict import LayeredGlobbableDict
+from wireworks.util.sharded_globbable_dict import ShardedGlobbableDict
+
+
+def _flatten(values):
+    return sorted(item for value in values for item in value)
+
+
+def _is_odd(item):
+    return item % 2 == 1
+
+
+class TestLayeredGlobbableDict(unittest.TestCase):
+    def setUp(self):
+        self._parent = GlobbableDict()
+        self._parent['a.b'] = {1, 2}
+        self._parent['a.c'] = {3}
+        self._parent['b.c'] = {4}
+        self._top = GlobbableDict()
+        self._layered = LayeredGlobbableDict(self._top, self._parent)
+
+    def test_merge(self):
+        """
+        Test that globs see the values of both layers
+        """
+        self._top['a.d'] = {5}
+
+        self.assertListEqual([1, 2, 3, 5], _flatten(self._layered.glob('a.*')))
+        self.assertListEqual([3, 4], _flatten(self._layered.glob('*.c')))
+        self.assertEqual(2, self._layered.get_depth())
+        self.assertListEqual(['a.b', 'a.c', 'b.c'], sorted(self._parent.keys()), "Parent changed")
+
+    def test_cached_until_matching_keys_change(self):
+        """
+        Test that derived values are reused until a matching key changes in either layer, and only then
+        """
+        derived = self._layered.glob_derived('a.*', _flatten)
+        self.assertIs(derived, self._layered.glob_derived('a.*', _flatten))
+
+        self._parent['b.d'] = {6}
+        self._top['c.a'] = {7}
+        self.assertIs(derived, self._layered.glob_derived('a.*', _flatten), "Rebuilt for an unrelated key")
+
+        self._parent['a.b'].add(8)
+        self._parent.touch(['a.b'])
+        self.assertListEqual([1, 2, 3, 8], self._layered.glob_derived('a.*', _flatten))
+
+        self._top['a.x'] = {9}
+        self.assertListEqual([1, 2, 3, 8, 9], self._layered.glob_derived('a.*', _flatten))
+
+        del self._parent['a.c']
+        self.assertListEqual([1, 2, 8, 9], self._layered.glob_derived('a.*', _flatten))
+
+    def test_masks(self):
+        """
+        Test that masks hide whole values, or items picked out of them, from the layers below only
+        """
+        self._top['a.b'] = {11}
+        self._layered.mask('a.b')
+        self.assertListEqual([3, 11], _flatten(self._layered.glob('a.*')))
+
+        self._layered.mask('a.*', _is_odd)
+        self.assertListEqual([11], _flatten(self._layered.glob('a.*')))
+        self.assertEqual(2, len(self._layered.get_masks()))
+
+        self._layered.unmask('a.b')
+        self.assertListEqual([2, 11], _flatten(self._layered.glob('a.*')))
+
+        self._layered.unmask('a.*', _is_odd)
+        self.assertListEqual([1, 2, 3, 11], _flatten(self._layered.glob('a.*')))
+        self.assertListEqual([1, 2], sorted(self._parent['a.b']), "Masking changed the parent's values")
+
+    def test_nested_layers(self):
+        """
+        Test that layers over layers see everything below them, along with the masks of the layers in between
+        """
+        self._layered.mask('a.c')
+        self._top['a.d'] = {5}
+        nested_top = GlobbableDict()
+        nested_top['a.e'] = {6}
+
+        nested = LayeredGlobbableDict(nested_top, self._layered)
+
+        self.assertEqual(3, nested.get_depth())
+        self.assertListEqual([1, 2, 5, 6], _flatten(nested.glob('a.*')))
+
+        self._layered.unmask('a.c')
+        self.assertListEqual([1, 2, 3, 5, 6], _flatten(nested.glob('a.*')))
+
+        sharded = ShardedGlobbableDict(4)
+        sharded['x.y'] = {0}
+        over_sharded = LayeredGlobbableDict(GlobbableDict(), sharded)
+        self.assertListEqual([0], _flatten(over_sharded.glob('*.y')))
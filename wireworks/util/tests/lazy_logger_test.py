@@ -0,0 +1,50 @@
+__author__ = 'rob'
+
+import logging
+import subprocess
+import sys
+import unittest
+
+from wireworks.util.lazy_logger import LazyLogger
+
+
+class TestLazyLogger(unittest.TestCase):
+    def setUp(self):
+        self._records = []
+
+        class RecordingHandler(logging.Handler):
+            def emit(handler_self, record):
+                self._records.append(record)
+
+        self._handler = RecordingHandler()
+        self._logger = logging.getLogger("wireworks.test.lazy_logger")
+        self._logger.addHandler(self._handler)
+
+    def tearDown(self):
+        self._logger.removeHandler(self._handler)
+        self._logger.setLevel(logging.NOTSET)
+
+    def test_debug_respects_level(self):
+        """
+        Test that debug messages are only emitted, and their arguments only formatted, if debug is enabled
+        """
+        lazy = LazyLogger("wireworks.test.lazy_logger")
+
+        self._logger.setLevel(logging.INFO)
+        lazy.debug("dropped %s", "message")
+        self.assertFalse(lazy.is_debug_enabled())
+        self.assertListEqual([], self._records)
+
+        self._logger.setLevel(logging.DEBUG)
+        lazy.debug("kept %s", "message")
+        self.assertTrue(lazy.is_debug_enabled())
+        self.assertListEqual(["kept message"], [record.getMessage() for record in self._records])
+
+    def test_logging_not_imported(self):
+        """
+        Test that nothing imports logging until it's needed
+        """
+        script = ("import sys; from wireworks.util.lazy_logger import LazyLogger; "
+                  "logger = LazyLogger('x'); logger.debug('%s', 1); "
+                  "assert not logger.is_debug_enabled(); assert 'logging' not in sys.modules")
+        self.assertEqual(0, subprocess.call([sys.executable, '-c', script]))
@@ -0,0 +1,100 @@
+__author__ = 'rob'
+
+import threading
+import unittest
+
+from wireworks.util.priority_executor import PriorityExecutor, HIGH, LOW, NORMAL
+
+
+class TestPriorityExecutor(unittest.TestCase):
+    def setUp(self):
+        self._order = []
+        self._gate = threading.Event()
+
+    def _blocked(self, executor):
+        """Submit a call that holds up the executor's only worker until the gate is opened"""
+        started = threading.Event()
+
+        def block():
+            started.set()
+            self._gate.wait(5)
+
+        future = executor.submit_at(HIGH, block)
+        started.wait(5)
+        return future
+
+    def _record(self, name):
+        return lambda: self._order.append(name)
+
+    def test_priority_order(self):
+        """
+        Test that queued calls are run most urgent first, and in submission order within a lane
+        """
+        executor = PriorityExecutor(max_workers=1, starvation_limit=None)
+        self._blocked(executor)
+
+        executor.submit_at(LOW, self._record('low 1'))
+        executor.submit(self._record('normal'))
+        executor.submit_at(LOW, self._record('low 2'))
+        executor.submit_at(HIGH, self._record('high'))
+        self._gate.set()
+        executor.shutdown()
+
+        self.assertListEqual(['high', 'normal', 'low 1', 'low 2'], self._order)
+
+    def test_starvation_limit(self):
+        """
+        Test that a lane passed over too many times in a row gets the next call, even with more urgent calls waiting
+        """
+        executor = PriorityExecutor(max_workers=1, starvation_limit=2)
+        self._blocked(executor)
+
+        for index in range(2):
+            executor.submit_at(LOW, self._record('low %d' % index))
+        for index in range(6):
+            executor.submit_at(HIGH, self._record('high %d' % index))
+        self._gate.set()
+        executor.shutdown()
+
+        self.assertListEqual(['high 0', 'high 1', 'low 0', 'high 2', 'high 3', 'low 1', 'high 4', 'high 5'],
+                             self._order)
+        self.assertEqual(2, executor.get_stats()['lanes'][LOW]['promoted'])
+
+    def test_lane_executors(self):
+        """
+        Test that lane executors submit at their priority, and that out of range priorities are clamped
+        """
+        executor = PriorityExecutor(max_workers=1)
+        self._blocked(executor)
+
+        executor.at_priority(-5).submit(self._record('low'))
+        executor.at_priority(NORMAL).submit(self._record('normal'))
+        future = executor.at_priority(99).submit(lambda value: value * 2, 21)
+        self.assertEqual([1, 1, 1], [lane['queued'] for lane in executor.get_stats()['lanes']])
+
+        self._gate.set()
+        self.assertEqual(42, future.result(5))
+        executor.shutdown()
+        self.assertListEqual(['normal', 'low'], self._order)
+
+    def test_errors(self):
+        executor = PriorityExecutor(max_workers=2)
+        future = executor.submit(int, 'nope')
+
+        self.assertIsInstance(future.exception(5), ValueError)
+        executor.shutdown()
+
+    def test_shutdown(self):
+        """
+        Test that calls can't be submitted after shutdown, and that queued calls can be cancelled by it
+        """
+        executor = PriorityExecutor(max_workers=1)
+        self._blocked(executor)
+        queued = executor.submit(self._record('queued'))
+
+        executor.shutdown(wait=False, cancel_futures=True)
+        self._gate.set()
+
+        self.assertTrue(queued.cancelled())
+        self.assertRaises(RuntimeError, executor.submit, self._record('late'))
+        self.assertRaises(AttributeError, PriorityExecutor, lanes=0)
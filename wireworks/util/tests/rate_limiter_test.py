@@ -0,0 +1,59 @@
+__author__ = 'rob'
+
+import time
+import unittest
+
+from wireworks.util.rate_limiter import RateLimiter, make_limiter
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_burst(self):
+        """
+        Test that a full bucket admits a burst of calls, then sheds them until it's refilled
+        """
+        limiter = RateLimiter(rate=20, burst=3)
+
+        self.assertListEqual([None, None, None, 'rate'], [limiter.try_acquire() for _ in range(4)])
+
+        time.sleep(0.1)
+        self.assertIsNone(limiter.try_acquire(), "Bucket not refilled")
+        self.assertEqual(4, limiter.get_stats()['admitted'])
+        self.assertEqual(1, limiter.get_stats()['rejected'])
+
+    def test_default_burst(self):
+        """
+        Test that the bucket holds a second's worth of calls by default, and at least one
+        """
+        limiter = RateLimiter(rate=10)
+        self.assertEqual(10, sum(1 for _ in range(20) if limiter.try_acquire() is None))
+
+        limiter = RateLimiter(rate=0.5)
+        self.assertListEqual([None, 'rate'], [limiter.try_acquire(), limiter.try_acquire()])
+
+    def test_max_pending(self):
+        """
+        Test that calls are shed while too many are in flight
+        """
+        limiter = RateLimiter(max_pending=2)
+
+        self.assertTrue(limiter.tracks_pending())
+        self.assertListEqual([None, None, 'pending'], [limiter.try_acquire() for _ in range(3)])
+
+        limiter.release()
+        self.assertIsNone(limiter.try_acquire())
+        self.assertEqual(2, limiter.get_stats()['pending'])
+
+    def test_bad_settings(self):
+        self.assertRaises(AttributeError, RateLimiter)
+        self.assertRaises(AttributeError, RateLimiter, rate=0)
+        self.assertRaises(AttributeError, RateLimiter, max_pending=0)
+
+    def test_make_limiter(self):
+        limiter = RateLimiter(rate=5)
+
+        self.assertIsNone(make_limiter(None))
+        self.assertIs(limiter, make_limiter(limiter))
+        self.assertFalse(make_limiter(100).tracks_pending())
+
+        limiter = make_limiter(1)
+        self.assertListEqual([None, 'rate'], [limiter.try_acquire(), limiter.try_acquire()])
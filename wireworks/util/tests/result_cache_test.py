@@ -0,0 +1,71 @@
+__author__ = 'rob'
+
+import time
+import unittest
+
+from wireworks.util.result_cache import ResultCache, make_cache, make_key
+
+
+class TestResultCache(unittest.TestCase):
+    def test_lookup_and_store(self):
+        """
+        Test that stored results are returned, and hits and misses are counted
+        """
+        cache = ResultCache()
+        key = make_key((1, 2), {'a': 3})
+
+        self.assertEqual((False, None), cache.lookup(key))
+        cache.store(key, 'result')
+        self.assertEqual((True, 'result'), cache.lookup(key))
+
+        stats = cache.get_stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['size'])
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used result is evicted once the cache is full
+        """
+        cache = ResultCache(max_size=2)
+        cache.store('a', 1)
+        cache.store('b', 2)
+        cache.lookup('a')
+        cache.store('c', 3)
+
+        self.assertEqual((True, 1), cache.lookup('a'))
+        self.assertEqual((False, None), cache.lookup('b'))
+        self.assertEqual((True, 3), cache.lookup('c'))
+        self.assertEqual(1, cache.get_stats()['evictions'])
+
+    def test_ttl_expiry(self):
+        """
+        Test that results expire after the ttl
+        """
+        cache = ResultCache(ttl=0.01)
+        cache.store('a', 1)
+        self.assertEqual((True, 1), cache.lookup('a'))
+
+        time.sleep(0.02)
+        self.assertEqual((False, None), cache.lookup('a'))
+        self.assertEqual(0, len(cache))
+
+    def test_unhashable_keys(self):
+        """
+        Test that unhashable arguments don't produce a key
+        """
+        self.assertIsNone(make_key(([1],), {}))
+        self.assertIsNone(make_key((), {'a': {}}))
+        self.assertEqual(make_key((1,), {'a': 1, 'b': 2}), make_key((1,), {'b': 2, 'a': 1}))
+
+    def test_make_cache(self):
+        """
+        Test that each of the cache specs gives the cache we'd expect
+        """
+        existing = ResultCache()
+
+        self.assertIsNone(make_cache(None))
+        self.assertIsNone(make_cache(False))
+        self.assertIsInstance(make_cache(True), ResultCache)
+        self.assertIs(existing, make_cache(existing))
+        self.assertRaises(AttributeError, make_cache, 0)
@@ -0,0 +1,94 @@
+__author__ = 'rob'
+
+import unittest
+
+from wireworks.util.sharded_globbable_dict import ShardedGlobbableDict, PARTITION_KEY
+
+
+class TestShardedGlobbableDict(unittest.TestCase):
+    def _populate(self, d):
+        for (index, key) in enumerate(['a.b', 'a.c', 'b.c', 'c.d.e', 'd.c']):
+            d[key] = index
+
+    def test_top_level_partitioning(self):
+        """
+        Test that keys sharing a top level component share a shard, and that globs are merged over shards
+        """
+
+        d = ShardedGlobbableDict(8)
+        self._populate(d)
+
+        self.assertEqual(d.shard_index('a.b'), d.shard_index('a.x.y'))
+        self.assertEqual(5, len(d))
+        self.assertEqual(1, d['a.c'])
+        self.assertTrue('c.d.e' in d)
+        self.assertListEqual(sorted(d.glob("a.*")), [0, 1])
+        self.assertListEqual(sorted(d.glob("*.c")), [1, 2, 4])
+        self.assertListEqual(sorted(d.glob("**")), [0, 1, 2, 3, 4])
+        self.assertListEqual(sorted(d.keys()), ['a.b', 'a.c', 'b.c', 'c.d.e', 'd.c'])
+
+    def test_key_partitioning(self):
+        """
+        Test that globs still find everything when keys are spread over shards by the whole key
+        """
+
+        d = ShardedGlobbableDict(8, partition=PARTITION_KEY)
+        self._populate(d)
+
+        self.assertListEqual(sorted(d.glob("a.*")), [0, 1])
+        self.assertListEqual(sorted(d.glob("a.c")), [1])
+        self.assertListEqual(sorted(d.glob("**.c")), [1, 2, 4])
+
+    def test_merged_derived_values(self):
+        """
+        Test that derived values for globs spanning shards are cached, and rebuilt when any shard changes
+        """
+
+        d = ShardedGlobbableDict(8, default_factory=list)
+        calls = []
+
+        def derive(values):
+            calls.append(values)
+            return sorted(value for one_list in values for value in one_list)
+
+        d['a.b'].append(1)
+        d['b.b'].append(2)
+
+        self.assertListEqual([1, 2], d.glob_derived("*.b", derive))
+        self.assertListEqual([1, 2], d.glob_derived("*.b", derive))
+        self.assertEqual(1, len(calls), "Merged value not cached")
+
+        d['b.b'].append(3)
+        d.touch(['b.b'])
+        self.assertListEqual([1, 2, 3], d.glob_derived("*.b", derive))
+
+        d['c.b'] = [4]
+        self.assertListEqual([1, 2, 3, 4], d.glob_derived("*.b", derive))
+
+        d.remove_keys(['a.b', 'x.y'])
+        self.assertListEqual([2, 3, 4], d.glob_derived("*.b", derive))
+        self.assertEqual(4, len(calls))
+
+    def test_stats(self):
+        """
+        Test that statistics are summed over the shards
+        """
+
+        d = ShardedGlobbableDict(4)
+        self._populate(d)
+        d.glob("a.*")
+        d.glob("a.*")
+
+        stats = d.get_stats()
+        self.assertEqual(5, stats['keys'])
+        self.assertEqual(4, stats['shards'])
+        self.assertEqual(1, stats['cache_hits'])
+        self.assertEqual(1, stats['cache_misses'])
+
+    def test_wildcard_keys_rejected(self):
+        d = ShardedGlobbableDict(4)
+
+        def test_putter():
+            d['*.b'] = 1
+
+        self.assertRaises(AttributeError, test_putter)
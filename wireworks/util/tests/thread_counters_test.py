@@ -0,0 +1,38 @@
+__author__ = 'rob'
+
+import threading
+import unittest
+
+from wireworks.util.thread_counters import ThreadCounters
+
+
+class TestThreadCounters(unittest.TestCase):
+    def test_counts(self):
+        counters = ThreadCounters(2)
+
+        counters.get()[0] += 1
+        counters.get()[1] += 3
+
+        self.assertListEqual([1, 3], counters.totals())
+
+    def test_concurrent_increments(self):
+        """
+        Test that increments from many threads at once are never lost, and survive the threads finishing
+        """
+        counters = ThreadCounters(1)
+
+        def increment():
+            for _ in range(10000):
+                counters.get()[0] += 1
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertListEqual([80000], counters.totals())
+        self.assertEqual(0, len(counters._threads), "Finished threads not retired")
+
+        counters.get()[0] += 1
+        self.assertListEqual([80001], counters.totals())
@@ -0,0 +1,114 @@
+__author__ = 'rob'
+
+import time
+import unittest
+
+from threading import Event as ThreadingEvent
+
+from wireworks.util.timing_wheel import TimingWheel
+
+
+class TestTimingWheel(unittest.TestCase):
+    def setUp(self):
+        self._wheel = TimingWheel(tick=0.005, wheel_size=8)
+
+    def tearDown(self):
+        self._wheel.shutdown()
+
+    def test_call_later(self):
+        """
+        Test that a delayed call is made, no earlier than asked for
+        """
+        called = ThreadingEvent()
+        started = time.time()
+        handle = self._wheel.call_later(0.05, called.set)
+
+        self.assertTrue(called.wait(2), "Delayed call was not made")
+        self.assertGreaterEqual(time.time() - started, 0.045, "Delayed call was made early")
+        self.assertEqual(1, handle.get_call_count())
+        self.assertEqual(0, len(self._wheel))
+
+    def test_calls_beyond_one_turn(self):
+        """
+        Test that calls further out than one turn of the wheel are made on the right turn, in order
+        """
+        seen = []
+        done = ThreadingEvent()
+
+        self._wheel.call_later(0.1, lambda: (seen.append('late'), done.set()))
+        self._wheel.call_later(0.01, seen.append, 'early')
+
+        self.assertTrue(done.wait(2), "Delayed calls were not made")
+        self.assertListEqual(['early', 'late'], seen)
+
+    def test_call_at(self):
+        """
+        Test that a call for a given time is made
+        """
+        called = ThreadingEvent()
+        self._wheel.call_at(time.time() + 0.01, called.set)
+
+        self.assertTrue(called.wait(2), "Timed call was not made")
+
+    def test_periodic_call_after_shutdown(self):
+        """
+        Test that a periodic call that's running as the wheel is shut down isn't rescheduled, and doesn't raise
+        """
+        handle = self._wheel.call_every(60, lambda: None)
+        self._wheel.shutdown()
+
+        handle._run()
+
+        self.assertEqual(1, handle.get_call_count())
+
+    def test_cancel(self):
+        """
+        Test that cancelled calls aren't made
+        """
+        called = []
+        handle = self._wheel.call_later(0.02, called.append, 1)
+
+        self.assertTrue(handle.cancel(), "Pending call could not be cancelled")
+        self.assertTrue(handle.cancelled())
+        self.assertFalse(handle.cancel(), "Call cancelled twice")
+        self.assertEqual(0, len(self._wheel))
+
+        time.sleep(0.05)
+        self.assertListEqual([], called, "Cancelled call was made")
+
+    def test_call_every(self):
+        """
+        Test that periodic calls repeat until cancelled
+        """
+        enough = ThreadingEvent()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 3:
+                enough.set()
+            return len(calls)
+
+        handle = self._wheel.call_every(0.01, fn)
+
+        self.assertTrue(enough.wait(2), "Periodic call was not repeated")
+        handle.cancel()
+        count = handle.get_call_count()
+        time.sleep(0.05)
+
+        self.assertEqual(count, handle.get_call_count(), "Periodic call continued after cancellation")
+        self.assertEqual(count, handle.get_result())
+
+    def test_exceptions_do_not_stop_the_wheel(self):
+        """
+        Test that a call raising an exception doesn't stop later calls being made
+        """
+        called = ThreadingEvent()
+
+        def explode():
+            raise KeyError()
+
+        self._wheel.call_later(0.01, explode)
+        self._wheel.call_later(0.02, called.set)
+
+        self.assertTrue(called.wait(2), "Call after an exception was not made")
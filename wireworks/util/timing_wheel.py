@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+A single-threaded scheduler for delayed and periodic calls, built on a hashed timing wheel.
+
+Rather than using a thread (or a heap entry) per pending call, calls are hashed into a fixed-size ring of slots by
+the tick they're due on. Scheduling and cancelling are both O(1), regardless of how many calls are pending. Within a
+slot, calls are bucketed by the turn of the wheel they're due on, so each tick only touches the calls that are actually
+due - calls due further out than one full turn of the wheel wait in their own bucket, never looked at until the wheel
+comes round to it on the right turn.
+
+Calls are made from the wheel's own thread, so anything slow should hand its work off elsewhere (eg to a dispatcher
+using a threadpool executor) rather than holding up every other pending call.
+"""
+
+__author__ = 'rob'
+
+import time
+
+from threading import Condition, Lock, Thread
+
+from wireworks.util.lazy_logger import LazyLogger
+
+_clock = getattr(time, 'monotonic', time.time)
+
+_default_wheel = None
+_default_wheel_lock = Lock()
+
+
+def get_default_timing_wheel():
+    """
+    Get the shared TimingWheel used by dispatchers, creating it if necessary.
+
+    Returns:
+        TimingWheel: The shared wheel
+    """
+    global _default_wheel
+
+    with _default_wheel_lock:
+        if _default_wheel is None:
+            _default_wheel = TimingWheel()
+        return _default_wheel
+
+
+class ScheduledCall(object):
+    """
+    A handle for a call scheduled on a TimingWheel.
+    """
+    def __init__(self, wheel, deadline, interval, fn, args, kwargs):
+        self._wheel = wheel
+        self._deadline = deadline
+        self._interval = interval
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._cancelled = False
+        self._result = None
+        self._call_count = 0
+
+        # maintained by the wheel, under its lock. The slot is None unless the call is pending.
+        self._deadline_tick = None
+        self._slot = None
+
+    def cancel(self):
+        """
+        Cancel the call (or any further calls, if periodic). Calls already in progress aren't interrupted.
+
+        Returns:
+            bool: True if the call was pending and is now cancelled
+        """
+        return self._wheel._cancel(self)
+
+    def cancelled(self):
+        """
+        Returns:
+            bool: True if the call has been cancelled
+        """
+        return self._cancelled
+
+    def get_call_count(self):
+        """
+        Returns:
+            int: The number of times the call has been made so far
+        """
+        return self._call_count
+
+    def get_result(self):
+        """
+        Returns:
+            The value returned by the most recent call, or None if it hasn't been made yet
+        """
+        return self._result
+
+    def _run(self):
+        try:
+            self._result = self._fn(*self._args, **self._kwargs)
+        except Exception:
+            TimingWheel._LOG.exception("Scheduled call %s raised an exception", self._fn)
+        finally:
+            self._call_count += 1
+
+        if self._interval is not None:
+            self._deadline += self._interval
+            self._wheel._schedule(self, reschedule=True)
+
+
+class TimingWheel(object):
+    """
+    Make us a new TimingWheel. The thread driving it is started when the first call is scheduled.
+
+    Args:
+        tick (float, optional): Resolution of the wheel in seconds. Calls may be made up to a tick late.
+        wheel_size (int, optional): Number of slots in the wheel
+    """
+    _LOG = LazyLogger("wireworks.timing_wheel")
+
+    def __init__(self, tick=0.01, wheel_size=512):
+        if tick <= 0 or wheel_size < 1:
+            raise AttributeError("The tick and wheel size must both be positive")
+
+        self._tick = tick
+        # each slot maps the turn of the wheel calls are due on to the set of them
+        self._slots = [{} for _ in range(wheel_size)]
+        self._condition = Condition(Lock())
+        self._start = _clock()
+        self._tick_index = 0
+        self._pending = 0
+        self._thread = None
+        self._shutdown = False
+
+    def __len__(self):
+        return self._pending
+
+    def call_later(self, delay, fn, *args, **kwargs):
+        """
+        Schedule a call to be made after a delay.
+
+        Args:
+            delay (float): Delay in seconds
+            fn (callable): The callable to call. Any further args and kwargs are passed to it.
+
+        Returns:
+            ScheduledCall: A handle for the call, which can be used to cancel it
+        """
+        return self._schedule(ScheduledCall(self, _clock() + delay, None, fn, args, kwargs))
+
+    def call_at(self, when, fn, *args, **kwargs):
+        """
+        Schedule a call to be made at a given time.
+
+        Args:
+            when (float): Time to make the call, as returned by time.time()
+            fn (callable): The callable to call. Any further args and kwargs are passed to it.
+
+        Returns:
+            ScheduledCall: A handle for the call, which can be used to cancel it
+        """
+        return self.call_later(when - time.time(), fn, *args, **kwargs)
+
+    def call_every(self, interval, fn, *args, **kwargs):
+        """
+        Schedule a call to be made repeatedly, every `interval` seconds, until cancelled. The first call is made after
+        one interval. Intervals are measured from when each call was due rather than when it was made, so calls don't
+        drift over time.
+
+        Args:
+            interval (float): Interval in seconds
+            fn (callable): The callable to call. Any further args and kwargs are passed to it.
+
+        Returns:
+            ScheduledCall: A handle for the call, which can be used to cancel it
+        """
+        if interval <= 0:
+            raise AttributeError("The interval must be positive")
+
+        return self._schedule(ScheduledCall(self, _clock() + interval, interval, fn, args, kwargs))
+
+    def shutdown(self):
+        """
+        Stop the wheel. Pending calls are never made.
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+
+    def _schedule(self, call, reschedule=False):
+        with self._condition:
+            if self._shutdown:
+                if reschedule:
+                    # a periodic call that was running as the wheel was shut down just stops
+                    return call
+                raise RuntimeError("Cannot schedule calls on a wheel that has been shut down")
+            if call._cancelled:
+                return call
+
+            if not self._pending:
+                # nothing's been ticking while we were idle; catch up rather than spinning through empty slots
+                self._tick_index = max(self._tick_index, int((_clock() - self._start) / self._tick))
+
+            deadline_tick = -(-(call._deadline - self._start) // self._tick)
+            call._deadline_tick = max(int(deadline_tick), self._tick_index + 1)
+            (turn, slot_index) = divmod(call._deadline_tick, len(self._slots))
+            call._slot = self._slots[slot_index]
+            call._slot.setdefault(turn, set()).add(call)
+            self._pending += 1
+
+            if not self._thread:
+                self._thread = Thread(target=self._run, name="wireworks-timing-wheel")
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._pending == 1:
+                self._condition.notify_all()
+
+        return call
+
+    def _cancel(self, call):
+        with self._condition:
+            was_pending = call._slot is not None
+            call._cancelled = True
+            if was_pending:
+                turn = call._deadline_tick // len(self._slots)
+                bucket = call._slot[turn]
+                bucket.discard(call)
+                if not bucket:
+                    del call._slot[turn]
+                call._slot = None
+                self._pending -= 1
+
+            return was_pending
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._shutdown:
+                    self._condition.wait()
+                if self._shutdown:
+                    return
+
+                next_tick = self._tick_index + 1
+                delay = self._start + next_tick * self._tick - _clock()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                self._tick_index = next_tick
+                due = self._take_due(next_tick)
+
+            for call in due:
+                call._run()
+
+    def _take_due(self, tick):
+        """Take the calls due on a tick out of the wheel. Must be called with the lock held."""
+        (turn, slot_index) = divmod(tick, len(self._slots))
+        due = self._slots[slot_index].pop(turn, ())
+        for call in due:
+            call._slot = None
+        self._pending -= len(due)
+        return due